@@ -1,25 +1,40 @@
 #
-from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import requests
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+import hashlib
 import json
+import math
+import re
+import unicodedata
 #from db_control import crud, mymodels
 from db_control import crud, mymodels_MySQL as mymodels
-import openai
 #from google import genai
 import os
 from dotenv import load_dotenv
-from datetime import datetime
-from gpt_parser import parse_utterance
-from sqlalchemy.orm import sessionmaker
-from db_control.connect_MySQL import engine
-from db_control.mymodels_MySQL import ActivityLog
-from sqlalchemy import text
+from datetime import datetime, timedelta
+from gpt_parser import parse_utterance_async, parse_utterances_async, parser_stats
+from record_validator import RecordValidationError
+from sqlalchemy.orm import Session
+from db_control.connect_MySQL import get_db, get_engine, new_session, pool_status
+from db_control import (activity_logs, analytics, customer_cache, customer_import, ingest_queue, partitions, summary,
+                        timeutil)
 from sqlalchemy.engine import Result
+from contextlib import asynccontextmanager
+import anyio
+import applog
+import http_client
+import llm_gateway
+import metrics
+import tracing
+from ttl_cache import MISSING, TieredCache, build_shared_tier
 
-# SQLAlchemy セッションの準備
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# DB への同期書き込みはスレッドプールへ逃がす。同時実行数は環境変数で上限を設ける
+DB_THREAD_LIMIT = int(os.getenv("DB_THREAD_LIMIT", "10"))
+db_limiter = anyio.CapacityLimiter(DB_THREAD_LIMIT)
+
+logger = applog.get_logger("api")
 
 class Customer(BaseModel):
     customer_id: str
@@ -30,10 +45,7 @@ class Customer(BaseModel):
 # .env を読み込む
 load_dotenv()
 
-# 環境変数からAPIキー取得
-api_key = os.getenv("OPENAI_API_KEY")
-# OpenAIクライアント作成
-client = openai.OpenAI(api_key=api_key)
+# OpenAI の呼び出しは llm_gateway を通す（クライアントは初回利用時に作成する）
 
 
 # # 環境変数からGemini APIキー取得
@@ -41,7 +53,32 @@ client = openai.OpenAI(api_key=api_key)
 # # OpenAIクライアント作成
 # client_gemini = genai.Client(api_key="GEMINI_YOUR_API_KEY")
 
-app = FastAPI()
+# INGEST_MODE=queue のときの write-behind キュー（lifespan で開始・停止する）
+ingest = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global ingest
+    if ingest_queue.INGEST_MODE == "queue":
+        ingest = ingest_queue.IngestQueue(ingest_queue.INGEST_QUEUE_PATH, _flush_ingested).start()
+    # 記録 API が更新する daily_activity_summary を、既存の DB にも作っておく
+    await anyio.to_thread.run_sync(summary.startup, get_engine())
+    if partitions.LOG_PARTITIONS:
+        # activity_logs のパーティションを先の月まで作っておく
+        await anyio.to_thread.run_sync(partitions.startup, get_engine())
+    await http_client.start()
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+        if ingest is not None:
+            # 残りをできるだけ書き込んでから止める（書けなかった分はファイルに残り、次の起動で送る）
+            await anyio.to_thread.run_sync(ingest.stop)
+            ingest = None
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORSミドルウェアの設定
 app.add_middleware(
@@ -50,74 +87,148 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # /ai_gpt の再検証（If-None-Match）にフロントエンドから ETag を読めるようにする
+    expose_headers=["ETag", "X-Cache"],
 )
 
+# 処理段階ごとの所要時間を Server-Timing ヘッダーで返す（遅いリクエストはトレースログにも出す）
+app.add_middleware(tracing.TracingMiddleware)
+
+
+@app.exception_handler(llm_gateway.LLMUnavailableError)
+async def llm_unavailable_handler(request: Request, exc: llm_gateway.LLMUnavailableError):
+    # LLM の混雑・障害は 500 ではなく 503 で返し、クライアントに再試行の目安を伝える
+    retry_after = max(1, math.ceil(exc.retry_after or 5))
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(retry_after)})
+
 #音声認識の方
 class RecordIn(BaseModel):
     utterance: str
     recorded_at: datetime
 
 
+# 1 回のバッチで受け付ける件数の上限
+RECORD_BATCH_MAX = int(os.getenv("RECORD_BATCH_MAX", "500"))
+
+class RecordBatchIn(BaseModel):
+    items: list[RecordIn] = Field(..., min_length=1, max_length=RECORD_BATCH_MAX)
+
+
 @app.get("/")
 def index():
     return {"message": "FastAPI top page!"}
 
 
 @app.post("/customers")
-def create_customer(customer: Customer):
+def create_customer(customer: Customer, db: Session = Depends(get_db)):
     values = customer.dict()
-    tmp = crud.myinsert(mymodels.Customers, values)
-    result = crud.myselect(mymodels.Customers, values.get("customer_id"))
-
-    if result:
-        result_obj = json.loads(result)
-        return result_obj if result_obj else None
-    return None
+    result = customer_cache.create_customer(values, session=db)
+    if result is None:
+        # 既に登録済み（一意制約違反）の場合は登録済みの内容を返す
+        result = customer_cache.get_customer(values.get("customer_id"), session=db)
+    return [result] if result else None
 
 
 @app.get("/customers")
-def read_one_customer(customer_id: str = Query(...)):
-    result = crud.myselect(mymodels.Customers, customer_id)
+def read_one_customer(customer_id: str = Query(...), db: Session = Depends(get_db)):
+    # 読み通しキャッシュ（見つからなかった customer_id も短い間覚えておく）
+    result = customer_cache.get_customer(customer_id, session=db)
     if not result:
         raise HTTPException(status_code=404, detail="Customer not found")
-    result_obj = json.loads(result)
-    return result_obj[0] if result_obj else None
+    return result
 
 
 @app.get("/allcustomers")
-def read_all_customer():
-    result = crud.myselectAll(mymodels.Customers)
-    # 結果がNoneの場合は空配列を返す
-    if not result:
-        return []
-    # JSON文字列をPythonオブジェクトに変換
-    return json.loads(result)
+def read_all_customer(
+    format: str = Query("json", pattern="^(json|ndjson)$", description="json: 配列 / ndjson: 1 行 1 件"),
+    after: str = Query(None, description="この customer_id より後ろから返す（前ページ最後の customer_id）"),
+    limit: int = Query(None, ge=1, description="返す件数の上限"),
+):
+    # テーブル全体を一度に読み込まず、サーバーサイドカーソルから少しずつ書き出す
+    chunks = crud.myselectAll(mymodels.Customers, after=after, limit=limit)
+    if format == "ndjson":
+        return StreamingResponse(_ndjson(chunks), media_type="application/x-ndjson")
+    return StreamingResponse(_json_array(chunks), media_type="application/json")
+
+
+def _ndjson(chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(r, ensure_ascii=False, default=_json_default) + "\n" for r in rows)
+
+
+def _json_array(chunks):
+    yield "["
+    first = True
+    for rows in chunks:
+        body = ",".join(json.dumps(r, ensure_ascii=False, default=_json_default) for r in rows)
+        yield body if first else "," + body
+        first = False
+    yield "]"
 
 
 @app.put("/customers")
-def update_customer(customer: Customer):
-    values = customer.dict()
-    values_original = values.copy()
-    tmp = crud.myupdate(mymodels.Customers, values)
-    result = crud.myselect(mymodels.Customers, values_original.get("customer_id"))
+def update_customer(customer: Customer, db: Session = Depends(get_db)):
+    result = customer_cache.update_customer(customer.dict(), session=db)
     if not result:
         raise HTTPException(status_code=404, detail="Customer not found")
-    result_obj = json.loads(result)
-    return result_obj[0] if result_obj else None
+    return result
 
 
 @app.delete("/customers")
-def delete_customer(customer_id: str = Query(...)):
-    result = crud.mydelete(mymodels.Customers, customer_id)
+def delete_customer(customer_id: str = Query(...), db: Session = Depends(get_db)):
+    result = customer_cache.delete_customer(customer_id, session=db)
     if not result:
         raise HTTPException(status_code=404, detail="Customer not found")
     return {"customer_id": customer_id, "status": "deleted"}
 
 
+# 一括取り込みは本文を読み終えるまでスレッドを 1 つ使い続けるので、同時に走らせる数を絞る
+CUSTOMER_IMPORT_CONCURRENCY = int(os.getenv("CUSTOMER_IMPORT_CONCURRENCY", "2"))
+import_limiter = anyio.CapacityLimiter(CUSTOMER_IMPORT_CONCURRENCY)
+
+
+@app.post("/customers/import")
+async def import_customers(
+    request: Request,
+    format: str = Query(
+        None, pattern="^(csv|ndjson)$", description="省略時は Content-Type（text/csv / application/x-ndjson）から決める"),
+):
+    # 本文を全部受け取ってから処理せず、届いた分から読んでチャンクごとに upsert する
+    try:
+        fmt = customer_import.detect_format(format, request.headers.get("content-type"))
+    except customer_import.CustomerImportError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+    body = request.stream()
+
+    async def next_chunk():
+        return await anext(body, b"")
+
+    def chunks():
+        # ワーカースレッドからイベントループに戻って、本文の続きを受け取る
+        while chunk := anyio.from_thread.run(next_chunk):
+            yield chunk
+
+    try:
+        return await anyio.to_thread.run_sync(customer_import.import_stream, chunks(), fmt, limiter=import_limiter)
+    except customer_import.CustomerImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("顧客の一括取り込み中にエラー")
+        raise HTTPException(status_code=500, detail="取り込み中にエラーが発生しました（それまでのチャンクは保存済みです）")
+
+
+FETCHTEST_URL = os.getenv("FETCHTEST_URL", "https://jsonplaceholder.typicode.com/users")
+
+
 @app.get("/fetchtest")
-def fetchtest():
-    response = requests.get('https://jsonplaceholder.typicode.com/users')
-    return response.json()
+async def fetchtest():
+    # 共有クライアントで接続を使い回す（応答は HTTP_CACHE_TTL 秒キャッシュする）
+    try:
+        return await http_client.get_json(FETCHTEST_URL)
+    except Exception as e:
+        logger.error("外部 API の呼び出しに失敗: %s", e)
+        raise HTTPException(status_code=502, detail="外部 API の呼び出しに失敗しました")
 
 #オウム返し機能(リクエストボディをそのまま返す)
 @app.post("/echo")
@@ -126,105 +237,487 @@ async def echo(request: Request):
     message = data.get("message", "")
     return {"echo": message}
 
-#AIで内容を要約し、本人のやりたいこと、Willを提案する
-@app.post("/ai_gpt")
-async def ask_openai(request: Request):
-    data = await request.json()
-    user_message = data.get("message", "")
+# プロンプトや生成パラメーターを変えたら上げる（古い応答をキャッシュから返さないため）
+AI_GPT_PROMPT_VERSION = "1"
+AI_GPT_MODEL = "gpt-4o-mini"
+
+# /ai_gpt の応答キャッシュ。同じ日記の再送信（再読み込み・フロントエンドの再試行）で LLM を呼び直さない。
+# AI_GPT_CACHE_SHARED: 未設定なら各プロセス内のみ、"db" ならアプリの DB、それ以外は SQLAlchemy URL
+# （"sqlite:///ai_gpt_cache.db" にすると同じマシンのワーカー間で共有し、再起動後も残る）
+AI_GPT_CACHE_TTL = float(os.getenv("AI_GPT_CACHE_TTL", "86400"))
+ai_gpt_cache = TieredCache(
+    "ai_gpt",
+    maxsize=int(os.getenv("AI_GPT_CACHE_SIZE", "1000")),
+    ttl=AI_GPT_CACHE_TTL,
+    shared=build_shared_tier(os.getenv("AI_GPT_CACHE_SHARED", ""), "ai_gpt",
+                             AI_GPT_CACHE_TTL, max_entries=int(os.getenv("AI_GPT_CACHE_SHARED_SIZE", "100000"))),
+)
+
+
+def _ai_gpt_request(user_message: str) -> dict:
+    """/ai_gpt と /ai_gpt/stream で共通の Chat Completions のリクエスト内容。"""
     prompt = f"""
         今日の日記や気持ちを「{user_message}」として記しました。
         この内容から、以下の項目を日本語で1～2行で出力してください：
         - 潜在的にやりたいこと、気持ちが向いているもの（Will Can MustのWillにあたるもの）
         """
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "あなたは相手の文章から気持ちや秘めたる意思を汲み取るプロフェッショナルです"},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=300,
-            temperature=0.7
-        )
+    return {
+        "model": AI_GPT_MODEL,
+        "messages": [
+            {"role": "system", "content": "あなたは相手の文章から気持ちや秘めたる意思を汲み取るプロフェッショナルです"},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 300,
+        "temperature": 0.7,
+    }
 
-        ai_reply = response.choices[0].message.content.strip()
-        return {"ai_response": ai_reply}
 
-    except Exception as e:
-        return {"error": str(e)}
+def _ai_gpt_cache_key(user_message: str) -> str:
+    # 全角・半角の違いと前後・連続する空白の違いは同じ日記とみなす
+    normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", user_message)).strip()
+    return f"{AI_GPT_PROMPT_VERSION}:{AI_GPT_MODEL}:{normalized}"
 
 
-@app.post("/api/record")
-async def record_feed(body: RecordIn):
-# === 1) GPT で構造化データを取得 ===
-    parsed = parse_utterance(body.utterance, body.recorded_at.isoformat())
-    # parsed がどんな辞書になっているかログ出力
-    print("🐣 GPT で構造化されたデータ:", parsed)
+def _etag(ai_reply: str) -> str:
+    return '"' + hashlib.sha256(ai_reply.encode("utf-8")).hexdigest()[:32] + '"'
 
-# === 2) parsed の timestamp を datetime オブジェクトに変換 ===
-    ts_str = parsed.get("timestamp")
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in header.split(",")]
+
+
+def _bypass_cache(request: Request) -> bool:
+    # Cache-Control: no-cache を付けたリクエストは作り直す（結果でキャッシュを上書きする）
+    return "no-cache" in request.headers.get("cache-control", "").lower()
+
+
+async def _ai_gpt_message(request: Request) -> str:
+    """/ai_gpt と /ai_gpt/stream のリクエストから日記の文字列を取り出す。不正なら 400。"""
     try:
-        # 末尾に "Z" がついている場合、"+00:00" に置き換えてから fromisoformat で UTC として扱う
-        ts = datetime.fromisoformat(ts_str.replace("Z", "+00:00"))
-    except Exception:
-        # もし不正な形式なら、API に送られてきた recorded_at（リクエスト送信時刻）を使う
-        ts = body.recorded_at
+        data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON で送ってください")
+    user_message = data.get("message", "") if isinstance(data, dict) else None
+    if not isinstance(user_message, str):
+        raise HTTPException(status_code=400, detail="message は文字列で指定してください")
+    return user_message
+
+
+def _ai_gpt_response(request: Request, ai_reply: str, hit: bool):
+    etag = _etag(ai_reply)
+    headers = {
+        "ETag": etag,
+        # 保存してよいが、使う前に If-None-Match で再検証する
+        "Cache-Control": "private, no-cache",
+        "X-Cache": "HIT" if hit else "MISS",
+    }
+    if _etag_matches(request, etag):
+        # POST の条件付きリクエストが一致したときは 304 ではなく 412（RFC 9110 13.1.2）。
+        # クライアントは手元の応答をそのまま使う
+        return Response(status_code=412, headers=headers)
+    return JSONResponse({"ai_response": ai_reply}, headers=headers)
+
+
+#AIで内容を要約し、本人のやりたいこと、Willを提案する
+@app.post("/ai_gpt")
+async def ask_openai(request: Request):
+    user_message = await _ai_gpt_message(request)
+
+    key = _ai_gpt_cache_key(user_message)
+    if not _bypass_cache(request):
+        cached = await ai_gpt_cache.aget(key)
+        if cached is not MISSING:
+            return _ai_gpt_response(request, cached, hit=True)
 
-# === 3) SQLAlchemy で DB に INSERT ===
-    session = SessionLocal()
+    # 流量制限・タイムアウトで応答が得られなければ LLMUnavailableError（503 を返す）
     try:
-        new_log = ActivityLog(
-            activity_type = parsed.get("activity_type", ""),
-            milktype      = parsed.get("milktype", ""),
-            volume        = parsed.get("volume", 0),
-            diaper_type   = parsed.get("diaper_type", ""),
-            hardness      = parsed.get("hardness", ""),
-            diaper_amount = parsed.get("diaper_amount", ""),
-            sleep_state   = parsed.get("sleep_state", ""),
-            timestamp     = ts,
-            # created_at は server_default で自動設定
-        )
-        session.add(new_log)
-        session.commit()
+        response = await llm_gateway.chat(**_ai_gpt_request(user_message))
+    except llm_gateway.LLMUnavailableError:
+        raise
+    except Exception as e:
+        logger.exception("AI 応答の取得に失敗")
+        raise HTTPException(status_code=502, detail="AI 応答の取得に失敗しました")
+
+    ai_reply = response.choices[0].message.content.strip()
+    await ai_gpt_cache.aset(key, ai_reply)
+    return _ai_gpt_response(request, ai_reply, hit=False)
+
+
+def _sse(data: dict, event: str = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream_ai_gpt(user_message: str, use_cache: bool = True):
+    """
+    生成されたテキストを Server-Sent Events で少しずつ返す。
+    data: {"delta": "..."} を届いた順に送り、最後に event: done で全文を送る。
+    キャッシュに応答があれば、全文を 1 つの delta として返す。
+    クライアントが切断すると StreamingResponse がこのジェネレーターをキャンセルし、
+    llm_gateway.stream が上流の接続を閉じて生成を打ち切る。
+    """
+    key = _ai_gpt_cache_key(user_message)
+    if use_cache:
+        cached = await ai_gpt_cache.aget(key)
+        if cached is not MISSING:
+            yield _sse({"delta": cached})
+            yield _sse({"ai_response": cached}, event="done")
+            return
+
+    parts = []
+    try:
+        async for chunk in llm_gateway.stream(**_ai_gpt_request(user_message)):
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield _sse({"delta": delta})
+    except llm_gateway.LLMUnavailableError as e:
+        # ヘッダーは送信済みなのでステータスコードは変えられない。エラーイベントで伝える
+        yield _sse({"detail": str(e), "retry_after": e.retry_after}, event="error")
+        return
     except Exception as e:
+        logger.exception("AI 応答のストリーミングに失敗")
+        yield _sse({"detail": "AI 応答の取得に失敗しました"}, event="error")
+        return
+    ai_reply = "".join(parts).strip()
+    # 最後まで生成できたものだけキャッシュする（/ai_gpt と共有）
+    await ai_gpt_cache.aset(key, ai_reply)
+    yield _sse({"ai_response": ai_reply}, event="done")
+
+
+@app.post("/ai_gpt/stream")
+async def ask_openai_stream(request: Request):
+    # /ai_gpt のストリーミング版（最初のトークンが生成された時点で表示を始められる）
+    user_message = await _ai_gpt_message(request)
+    return StreamingResponse(
+        _stream_ai_gpt(user_message, use_cache=not _bypass_cache(request)),
+        media_type="text/event-stream",
+        # プロキシ（nginx / App Service の前段）でバッファリングさせない
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def write_activity_logs(session: Session, rows: list[dict]):
+    """構造化済みのログを 1 トランザクションで activity_logs に INSERT し、日ごとの集計も更新する（同期処理）。"""
+    try:
+        # 最初の execute でプールから接続を取るので、db.insert には db.checkout が含まれる
+        with tracing.span("db.insert", rows=len(rows)):
+            activity_logs.insert_logs(session, rows)
+        with tracing.span("db.summary"):
+            summary.apply_logs(session, rows)
+        with tracing.span("db.commit"):
+            session.commit()
+    except Exception:
         session.rollback()
-        print("🔴 DB 保存中にエラー:", e)
+        raise
+
+
+def save_activity_logs(session: Session, rows: list[dict]):
+    """write_activity_logs の API 用。失敗したら 500 を返す。"""
+    try:
+        write_activity_logs(session, rows)
+    except Exception:
+        logger.exception("DB 保存中にエラー")
         raise HTTPException(status_code=500, detail="DB 保存エラーが発生しました")
-    finally:
-        session.close()
+
+
+def _flush_ingested(rows: list[dict]):
+    # キューのワーカースレッドから呼ばれる。失敗時の例外はキュー側で再試行に回す
+    with new_session() as session:
+        write_activity_logs(session, rows)
+
+
+async def store_activity_logs(db: Session, rows: list[dict]) -> bool:
+    """
+    行を保存する。write-behind モードならキューへの追記（fsync）だけで戻り True を、
+    それ以外は DB にコミットして False を返す。
+    """
+    if ingest is None:
+        await anyio.to_thread.run_sync(save_activity_logs, db, rows, limiter=db_limiter)
+        return False
+    try:
+        with tracing.span("queue.append", rows=len(rows)):
+            await anyio.to_thread.run_sync(ingest.append, rows)
+    except Exception as e:
+        logger.exception("キューへの保存中にエラー")
+        raise HTTPException(status_code=500, detail="保存エラーが発生しました")
+    return True
+
+
+@app.post("/api/record")
+async def record_feed(body: RecordIn, db: Session = Depends(get_db)):
+# === 1) GPT で構造化データを取得（非同期クライアントなのでイベントループを塞がない） ===
+    try:
+        parsed = await parse_utterance_async(body.utterance, body.recorded_at.isoformat())
+    except RecordValidationError as e:
+        # LLM が保存できない値（不明な activity_type・長すぎる文字列）を返した
+        raise HTTPException(status_code=422, detail=f"発話を記録に変換できませんでした（{e}）")
+    # parsed がどんな辞書になっているかログ出力（LOG_LEVEL=DEBUG のときだけ）
+    logger.debug("parsed: %s", parsed)
+
+# === 2) parsed の timestamp を datetime オブジェクトに変換 ===
+    with tracing.span("timestamp.parse"):
+        ts = activity_logs.parse_timestamp(parsed, body.recorded_at)
+
+# === 3) SQLAlchemy で DB に INSERT（ブロッキング処理は上限付きスレッドプールで実行） ===
+#        write-behind モードではキューに追記した時点で応答し、DB への書き込みはワーカーが行う
+    rows = [activity_logs.to_row(parsed, ts)]
+    queued = await store_activity_logs(db, rows)
 
     # === 4) レスポンスを返す ===
-    return {"parsed": parsed, "saved": True}
+    return {"parsed": parsed, "saved": True, "queued": queued}
+
+
+@app.post("/api/record/batch")
+async def record_feed_batch(body: RecordBatchIn, db: Session = Depends(get_db)):
+# === 1) まとめて構造化（ルール / キャッシュで済まないものだけ、同時実行数を絞って LLM へ） ===
+    results = await parse_utterances_async(
+        [(item.utterance, item.recorded_at.isoformat()) for item in body.items]
+    )
+
+# === 2) 成功したものだけを行データに変換し、失敗は項目ごとに記録 ===
+    rows, response_items = [], []
+    for i, (item, parsed) in enumerate(zip(body.items, results)):
+        # return_exceptions=True では CancelledError（Exception ではない）も要素として返る
+        if isinstance(parsed, BaseException):
+            logger.warning("バッチ %d 件目の解析に失敗: %r", i, parsed)
+            response_items.append({"index": i, "saved": False, "error": str(parsed) or type(parsed).__name__})
+            continue
+        ts = activity_logs.parse_timestamp(parsed, item.recorded_at)
+        rows.append(activity_logs.to_row(parsed, ts))
+        response_items.append({"index": i, "saved": True, "parsed": parsed})
+
+# === 3) 1 回のバルク INSERT・1 トランザクションで保存（write-behind モードならキューへ 1 回で追記） ===
+    queued = await store_activity_logs(db, rows)
+
+    return {"items": response_items, "saved": len(rows), "failed": len(body.items) - len(rows), "queued": queued}
+
+@app.get("/api/db/pool")
+def get_pool_status():
+    # コネクションプールの使用率とチェックアウト待ち時間（プールサイズの見積もり用）
+    return pool_status()
+
+@app.get("/api/ingest/stats")
+def get_ingest_stats():
+    # write-behind キューの滞留件数・最古の滞留時間・dead 件数
+    if ingest is None:
+        return {"mode": "sync"}
+    return {"mode": "queue", **ingest.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # プロセス内の全メトリクス（SQL の実行時間・件数、プール、パーサー、キャッシュ）を Prometheus 形式で返す
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/customers/cache/stats")
+def get_customer_cache_stats():
+    # 顧客の読み通しキャッシュのヒット率と、ミス時の DB 取得時間
+    return customer_cache.stats()
+
+@app.get("/api/llm/stats")
+def get_llm_stats():
+    # LLM ゲートウェイの待ち行列の長さ・待ち時間・再試行・相乗りの件数
+    return llm_gateway.gateway.stats()
+
+@app.get("/api/parser/stats")
+def get_parser_stats():
+    # ルールベース / LLM それぞれの処理件数・ヒット率・レイテンシ
+    return parser_stats()
+
+# 範囲取得 1 ページあたりの件数（既定値と上限）
+LOGS_PAGE_DEFAULT = 500
+LOGS_PAGE_MAX = 5000
+# サーバーサイドカーソルから一度に取り出す行数
+LOGS_STREAM_CHUNK = 500
+
+
+def _parse_day(value: str):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _json_default(o):
+    # datetime は FastAPI の通常レスポンスと同じ ISO 8601 形式にそろえる
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f"{type(o).__name__} は JSON に変換できません")
+
+
+def _log_to_dict(m, zone) -> dict:
+    r = dict(m)
+    r["timestamp"] = timeutil.from_db_time(r["timestamp"], zone)
+    return r
+
 
 @app.get("/api/logs")
-def get_logs(date: str):
-    # # 日付チェック
-    # try:
-    #     datetime.strptime(date, "%Y-%m-%d")
-    # except ValueError:
-    #     raise HTTPException(status_code=400, detail="date は YYYY-MM-DD 形式で指定してください")
-
-    conn = engine.connect()
+def get_logs(
+    date: str = Query(None, description="1 日分を種別ごとにまとめて返す（YYYY-MM-DD）"),
+    from_: str = Query(None, alias="from", description="範囲取得の開始日（YYYY-MM-DD、この日を含む）"),
+    to: str = Query(None, description="範囲取得の終了日（YYYY-MM-DD、この日を含む）"),
+    types: list[str] = Query(None, alias="type", description="activity_type の絞り込み（複数指定可）"),
+    cursor: str = Query(None, description="前ページの next_cursor"),
+    limit: int = Query(LOGS_PAGE_DEFAULT, ge=1, le=LOGS_PAGE_MAX),
+    tz: str = Query(None, description="1 日の区切りに使うタイムゾーン（既定は APP_TIMEZONE）"),
+    db: Session = Depends(get_db),
+):
+    # 日付・タイムゾーンチェック
+    try:
+        zone = timeutil.get_zone(tz)
+        if date:
+            day = _parse_day(date)
+        elif from_:
+            first = _parse_day(from_)
+            last = _parse_day(to) if to else first
+            after = activity_logs.decode_cursor(cursor) if cursor else None
+        else:
+            raise ValueError("date か from を指定してください")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date / from / to は YYYY-MM-DD 形式、tz は IANA タイムゾーン名で指定してください")
+
+    if not date:
+        # 週・月単位のダッシュボード向け：範囲をまとめて 1 回で取得する
+        # （レスポンス送信中もカーソルを読み続けるため、リクエストのセッションではなく専用の接続を使う）
+        start = timeutil.day_start(first, zone)
+        end = timeutil.day_start(last + timedelta(days=1), zone)
+        return StreamingResponse(
+            _stream_logs(start, end, types, after, limit, zone), media_type="application/json"
+        )
+
+    # DATE(timestamp) = :d だと列に関数がかかりインデックスが効かないため、半開区間で検索する
+    start, end = timeutil.day_range(day, zone)
+    # まだ DB に書かれていないキューの行も返す（read-your-writes）。取りこぼさないよう DB より先に読む
+    pending = ingest.pending(start, end, types) if ingest is not None else []
+    result: Result = activity_logs.select_logs(db, start, end, types)
+
+    feeding, diaper, sleep = [], [], []
+    for m in ingest_queue.merge_pending(result.mappings(), pending):
+        r = _log_to_dict(m, zone)
+        if r["activity_type"] == "feeding":
+            feeding.append(r)
+        elif r["activity_type"] == "diaper":
+            diaper.append(r)
+        else:
+            sleep.append(r)
+
+    return {"feeding": feeding, "diaper": diaper, "sleep": sleep}
+
+
+# 集計 API で一度に取得できる日数の上限
+SUMMARY_MAX_DAYS = 366
+
+
+@app.get("/api/summary")
+def get_summary(
+    from_: str = Query(..., alias="from", description="開始日（YYYY-MM-DD、この日を含む）"),
+    to: str = Query(None, description="終了日（YYYY-MM-DD、この日を含む。省略時は from と同じ日）"),
+    db: Session = Depends(get_db),
+):
+    # 授乳量・回数、おむつ回数、睡眠時間を日ごとに返す（日付は APP_TIMEZONE 基準）
+    try:
+        first = _parse_day(from_)
+        last = _parse_day(to) if to else first
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from / to は YYYY-MM-DD 形式で指定してください")
+    if last < first or (last - first).days >= SUMMARY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"期間は 1〜{SUMMARY_MAX_DAYS} 日で指定してください")
+
+    return {"days": summary.select_summary(db, first, last)}
+
+
+# 購入の集計 API で返す件数の上限
+ANALYTICS_MAX_LIMIT = 100
+
+
+def _analytics_range(from_: str, to: str):
+    """購入の集計 API の期間（どちらも省略可）。"""
+    try:
+        first = _parse_day(from_) if from_ else None
+        last = _parse_day(to) if to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from / to は YYYY-MM-DD 形式で指定してください")
+    if first is not None and last is not None and last < first:
+        raise HTTPException(status_code=400, detail="to は from 以降の日付を指定してください")
+    return first, last
+
+
+@app.get("/api/analytics/customers")
+def get_customer_revenue(
+    from_: str = Query(None, alias="from", description="開始日（YYYY-MM-DD、この日を含む。省略時は最初から）"),
+    to: str = Query(None, description="終了日（YYYY-MM-DD、この日を含む。省略時は最後まで）"),
+    customer_id: str = Query(None, description="指定した顧客だけを集計する"),
+    limit: int = Query(10, ge=1, le=ANALYTICS_MAX_LIMIT),
+    db: Session = Depends(get_db),
+):
+    # 顧客ごとの購入回数・数量・売上（売上の多い順）
+    first, last = _analytics_range(from_, to)
+    return {"customers": analytics.revenue_per_customer(db, first, last, customer_id, limit)}
+
+
+@app.get("/api/analytics/items")
+def get_top_items(
+    from_: str = Query(None, alias="from", description="開始日（YYYY-MM-DD、この日を含む。省略時は最初から）"),
+    to: str = Query(None, description="終了日（YYYY-MM-DD、この日を含む。省略時は最後まで）"),
+    limit: int = Query(10, ge=1, le=ANALYTICS_MAX_LIMIT),
+    db: Session = Depends(get_db),
+):
+    # 売上の多い商品（集計テーブルがあれば集計済みの日はそこから読む）
+    first, last = _analytics_range(from_, to)
+    return {"items": analytics.top_items(db, first, last, limit)}
+
+
+@app.get("/api/analytics/daily")
+def get_purchases_per_day(
+    from_: str = Query(None, alias="from", description="開始日（YYYY-MM-DD、この日を含む。省略時は最初から）"),
+    to: str = Query(None, description="終了日（YYYY-MM-DD、この日を含む。省略時は最後まで）"),
+    db: Session = Depends(get_db),
+):
+    # 日ごとの購入回数・数量・売上（購入のない日は含めない）
+    first, last = _analytics_range(from_, to)
+    return {"days": analytics.purchases_per_day(db, first, last)}
+
+
+def _stream_logs(start, end, types, after, limit, zone):
+    """
+    範囲内のログを {"items": [...], "next_cursor": ...} の JSON として少しずつ書き出す。
+    サーバーサイドカーソルで読むので、範囲が広くてもメモリ使用量は一定。
+    """
+    # write-behind キューの未書き込み行も混ぜる（DB より先に読む）。
+    # カーソルは DB の行だけで作り、キューの行は timestamp が (前ページ最後, このページ最後] のページに出す
+    # （キューの行は limit に数えない）
+    pending = ingest.pending(start, end, types) if ingest is not None else []
+    if after is not None:
+        pending = [p for p in pending if p["timestamp"] > after[0]]
+
+    conn = get_engine().connect().execution_options(stream_results=True, yield_per=LOGS_STREAM_CHUNK)
     try:
-        stmt = text("""
-            SELECT * FROM activity_logs
-            WHERE DATE(timestamp) = :d
-            ORDER BY timestamp
-        """)
-        result: Result = conn.execute(stmt, {"d": date})
-        rows = [dict(r) for r in result.mappings().all()]
-
-        feeding, diaper, sleep = [], [], []
-        for r in rows:
-            if r["activity_type"] == "feeding":
-                feeding.append(r)
-            elif r["activity_type"] == "diaper":
-                diaper.append(r)
-            else:
-                sleep.append(r)
-
-        return {"feeding": feeding, "diaper": diaper, "sleep": sleep}
+        # 次ページの有無を知るため 1 件多く読む
+        result = activity_logs.select_logs(conn, start, end, types, after, limit + 1)
+        page = {"count": 0, "last": None, "has_more": False}
+
+        def db_rows():
+            for m in result.mappings():
+                if page["count"] == limit:
+                    page["has_more"] = True
+                    return
+                page["count"] += 1
+                page["last"] = m
+                yield m
+
+        def keep_tail(p):
+            return not page["has_more"] or p["timestamp"] <= page["last"]["timestamp"]
+
+        yield '{"items":['
+        first = True
+        for m in ingest_queue.merge_pending(db_rows(), pending, keep_tail):
+            row = _log_to_dict(m, zone)
+            yield ("" if first else ",") + json.dumps(row, ensure_ascii=False, default=_json_default)
+            first = False
+        last = page["last"]
+        next_cursor = activity_logs.encode_cursor(last["timestamp"], last["id"]) if page["has_more"] else None
+        yield '],"next_cursor":' + json.dumps(next_cursor) + "}"
+        result.close()
     finally:
         conn.close()
 
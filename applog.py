@@ -0,0 +1,55 @@
+# applog.py
+"""
+リクエスト処理のスレッドで書き込み待ちをしないためのロガー設定。
+
+get_logger() で取得したロガーは QueueHandler でキューに積むだけで返り、
+実際の書式化と出力は QueueListener のバックグラウンドスレッドが行う。
+出力スレッドは最初のログが出たときに起動する（import しただけではスレッドを作らない）。
+出力レベルは環境変数 LOG_LEVEL（既定は INFO）で変える。
+"""
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+ROOT_LOGGER = "app"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+_records = queue.SimpleQueue()
+_listener = None
+_lock = threading.Lock()
+
+
+def _start_listener():
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+        _listener = QueueListener(_records, handler, respect_handler_level=True)
+        _listener.start()
+        # 終了時にキューに残ったログを書き出す
+        atexit.register(_listener.stop)
+
+
+class _LazyQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        if _listener is None:
+            _start_listener()
+        super().enqueue(record)
+
+
+_root = logging.getLogger(ROOT_LOGGER)
+_root.addHandler(_LazyQueueHandler(_records))
+_root.setLevel(LOG_LEVEL)
+# uvicorn などルートロガーに付いたハンドラーで二重に出さない
+_root.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    """app.<name> のロガーを返す。"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
@@ -0,0 +1,125 @@
+"""
+GET /customers の取得を、DB 直読み（crud.myselect）と読み通しキャッシュ（customer_cache）で比べる。
+
+SQLite の一時ファイルを DB にし、SSL 越しの MySQL の往復を --db-latency の待ちで模擬する
+（SQL を 1 文実行するごとに待つ）。偏りのあるアクセス（一部の顧客に集中）・存在しない ID・
+ときどきの更新を混ぜて、p50 / p95 / p99 レイテンシ・DB への問い合わせ回数・ヒット率を出す。
+最後に、キャッシュにない同じ ID を多数のスレッドが同時に読んだときの DB 問い合わせ回数を確かめる。
+
+    python benchmarks/bench_customer_cache.py --lookups 5000 --db-latency 0.002
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _percentiles(values):
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return statistics.median(values), q[94], q[98]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="顧客キャッシュのベンチマーク")
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--missing-rate", type=float, default=0.05, help="存在しない ID を引く割合")
+    parser.add_argument("--update-rate", type=float, default=0.01, help="読み込みの合間に更新する割合")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="SQL 1 文ごとの往復時間の模擬（秒）")
+    parser.add_argument("--threads", type=int, default=50, help="同時読み込みの確認に使うスレッド数")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'customers.db')}"
+    os.environ.setdefault("CUSTOMER_CACHE_SHARED", "")
+    with contextlib.redirect_stdout(io.StringIO()):
+        from sqlalchemy import event, insert
+
+        from db_control import crud, customer_cache
+        from db_control.connect_MySQL import get_engine, new_session
+        from db_control.mymodels_MySQL import Customers
+
+        engine = get_engine()
+        Customers.__table__.create(engine)
+
+    def customer(i, version=0):
+        return {"customer_id": f"C{i:05d}", "customer_name": f"name{i}-{version}", "age": i % 90, "gender": "女"}
+
+    with engine.begin() as conn:
+        conn.execute(insert(Customers.__table__), [customer(i) for i in range(args.customers)])
+
+    queries = {"n": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _network_latency(*_):
+        queries["n"] += 1
+        time.sleep(args.db_latency)
+
+    rng = random.Random(0)
+    workload = []
+    for _ in range(args.lookups):
+        if rng.random() < args.update_rate:
+            workload.append(("update", rng.randrange(args.customers)))
+        elif rng.random() < args.missing_rate:
+            workload.append(("read", f"X{rng.randrange(50):05d}"))
+        else:
+            # パレート分布で一部の顧客にアクセスを集中させる
+            workload.append(("read", f"C{min(int(rng.paretovariate(1.2)) - 1, args.customers - 1):05d}"))
+
+    def run(read, update):
+        latencies = []
+        before = queries["n"]
+        for op, target in workload:
+            with new_session() as db:
+                if op == "update":
+                    update(customer(target, rng.randrange(1000)), db)
+                    continue
+                started = time.perf_counter()
+                read(target, db)
+                latencies.append((time.perf_counter() - started) * 1000)
+        return latencies, queries["n"] - before
+
+    modes = [
+        ("db", lambda cid, db: crud.myselect(Customers, cid, session=db),
+         lambda values, db: crud.myupdate(Customers, values, session=db)),
+        ("cache", lambda cid, db: customer_cache.get_customer(cid, session=db),
+         lambda values, db: customer_cache.update_customer(values, session=db)),
+    ]
+    print(f"customers={args.customers} lookups={args.lookups} missing={args.missing_rate:.0%} "
+          f"updates={args.update_rate:.0%} db_latency={args.db_latency * 1000:.1f}ms")
+    print(f"{'mode':>6} {'p50[ms]':>8} {'p95[ms]':>8} {'p99[ms]':>8} {'db_queries':>10}")
+    for mode, read, update in modes:
+        latencies, db_queries = run(read, update)
+        p50, p95, p99 = _percentiles(latencies)
+        print(f"{mode:>6} {p50:>8.3f} {p95:>8.3f} {p99:>8.3f} {db_queries:>10}")
+
+    stats = customer_cache.stats()
+    print(f"\ncache: hit_ratio={stats['hit_ratio']:.1%} hit={stats['hit']} negative_hit={stats['negative_hit']} "
+          f"miss={stats['miss']} coalesced={stats['coalesced']}")
+
+    # 同じ ID のキャッシュミスが同時に来ても、DB へは 1 回だけ問い合わせる
+    customer_cache.cache.delete("C00000")
+    before = queries["n"]
+    barrier = threading.Barrier(args.threads)
+
+    def cold_read(_):
+        barrier.wait()
+        with new_session() as db:
+            return customer_cache.get_customer("C00000", session=db)
+
+    with ThreadPoolExecutor(args.threads) as pool:
+        list(pool.map(cold_read, range(args.threads)))
+    print(f"stampede: {args.threads} concurrent cold reads -> {queries['n'] - before} db queries")
+
+
+if __name__ == "__main__":
+    main()
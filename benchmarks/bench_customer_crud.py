@@ -0,0 +1,135 @@
+"""
+顧客 CRUD の 1 リクエストあたりのレイテンシとメモリ確保量を、旧実装と比較するマイクロベンチマーク。
+
+旧実装（呼び出しごとの sessionmaker、json.dumps → json.loads の往復、
+書き込み後の SELECT）をこのファイル内に再現し、現在の crud 関数と同じ操作で比べる。
+メモリは tracemalloc で 1 リクエストあたりの確保ブロック数・ピークを測る。
+
+    python benchmarks/bench_customer_crud.py --n 2000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def old_impl(engine, Customers):
+    """ベースライン時点の crud + app.py の処理を再現したもの。"""
+    from sqlalchemy import insert, update
+    from sqlalchemy.orm import sessionmaker
+
+    def myselect(customer_id):
+        session = sessionmaker(bind=engine)()
+        with session.begin():
+            result = session.query(Customers).filter(Customers.customer_id == customer_id).all()
+        out = json.dumps([{
+            "customer_id": c.customer_id, "customer_name": c.customer_name, "age": c.age, "gender": c.gender,
+        } for c in result], ensure_ascii=False)
+        session.close()
+        return out
+
+    def create(values):
+        session = sessionmaker(bind=engine)()
+        with session.begin():
+            session.execute(insert(Customers).values(values))
+        session.close()
+        return json.loads(myselect(values["customer_id"]))
+
+    def read(customer_id):
+        return json.loads(myselect(customer_id))[0]
+
+    def put(values):
+        values = dict(values)
+        cid = values.pop("customer_id")
+        session = sessionmaker(bind=engine)()
+        with session.begin():
+            session.execute(update(Customers).where(Customers.customer_id == cid).values(**values))
+        session.close()
+        return json.loads(myselect(cid))[0]
+
+    return create, read, put
+
+
+def new_impl(crud, Customers, new_session):
+    def create(values):
+        with new_session() as db:
+            return [crud.myinsert(Customers, values, session=db)]
+
+    def read(customer_id):
+        with new_session() as db:
+            return crud.myselect(Customers, customer_id, session=db)
+
+    def put(values):
+        with new_session() as db:
+            return crud.myupdate(Customers, values, session=db)
+
+    return create, read, put
+
+
+def measure(label, fn, args_list, sample):
+    # レイテンシ
+    t0 = time.perf_counter()
+    for a in args_list:
+        fn(a)
+    per_req = (time.perf_counter() - t0) / len(args_list) * 1e6
+
+    # メモリ確保（件数を絞って tracemalloc で計測）
+    tracemalloc.start()
+    snap0 = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    for a in sample:
+        fn(a)
+    _, peak = tracemalloc.get_traced_memory()
+    snap1 = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = snap1.compare_to(snap0, "filename")
+    blocks = sum(max(s.count_diff, 0) for s in stats)
+    print(f"  {label:<7} {per_req:9.1f} us/req   peak={peak / 1024:7.1f} KiB   net_blocks/req={blocks / len(sample):6.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'crud.db')}"
+    with contextlib.redirect_stdout(io.StringIO()):
+        from db_control import crud
+        from db_control.connect_MySQL import get_engine, new_session
+        from db_control.mymodels_MySQL import Customers
+        engine = get_engine()
+        engine.echo = False
+        Customers.__table__.create(engine)
+
+    old = old_impl(engine, Customers)
+    new = new_impl(crud, Customers, new_session)
+
+    def customer(cid, i=0):
+        return {"customer_id": cid, "customer_name": f"n{i}", "age": i % 90, "gender": "女"}
+
+    n, m = args.n, 200
+    for op_index, op in enumerate(("create", "read", "update")):
+        print(f"[{op}]")
+        for label, impl, prefix in (("before", old, "O"), ("after", new, "N")):
+            if op == "create":
+                # 計測用とメモリ計測用で ID を分け、一意制約違反を起こさないようにする
+                args_list = [customer(f"{prefix}{i}") for i in range(n)]
+                sample = [customer(f"{prefix}m{i}") for i in range(m)]
+            elif op == "read":
+                args_list = [f"{prefix}{i % (n // 4)}" for i in range(n)]
+                sample = args_list[:m]
+            else:
+                args_list = [customer(f"{prefix}{i % (n // 4)}", i) for i in range(n)]
+                sample = args_list[:m]
+            measure(label, impl[op_index], args_list, sample)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+customers の一括取り込み（db_control.customer_import）の速度とメモリを測る。
+
+SQLite の一時ファイルに、
+- 従来の 1 行ずつの登録（crud.myinsert。POST /customers と同じ）
+- import_stream（チャンクごとの upsert）をチャンクサイズを変えて
+- POST /customers/import（TestClient で本文を少しずつ送る）
+で同じ形の CSV を取り込み、行/秒を比べる。最後に --rows 行（既定 100 万行）を取り込み、
+取り込みの前後で最大 RSS がほとんど増えない（行数に比例しない）ことを確かめる。
+CSV はその場で生成して流すので、ファイルもメモリ上の全体も作らない。
+
+    python benchmarks/bench_customer_import.py --rows 1000000
+"""
+import argparse
+import contextlib
+import io
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def csv_chunks(rows: int, start: int = 0, chunk_bytes: int = 64 * 1024):
+    """customers の CSV を chunk_bytes 程度ずつ bytes で返す。"""
+    buffer = ["customer_id,customer_name,age,gender\n"]
+    size = 0
+    for i in range(start, start + rows):
+        line = f"C{i:07d},顧客{i},{i % 90},{'女' if i % 2 else '男'}\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def max_rss_mb() -> float:
+    # Linux の ru_maxrss は KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="顧客の一括取り込みのベンチマーク")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="メモリ確認で取り込む行数")
+    parser.add_argument("--compare-rows", type=int, default=20_000, help="方式の比較で取り込む行数")
+    parser.add_argument("--baseline-rows", type=int, default=2_000, help="1 行ずつの登録で取り込む行数")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'customers.db')}"
+    os.environ.setdefault("CUSTOMER_CACHE_SHARED", "")
+    with contextlib.redirect_stdout(io.StringIO()):
+        from fastapi.testclient import TestClient
+
+        import app
+        from db_control import crud, customer_import
+        from db_control.connect_MySQL import get_engine
+        from db_control.mymodels_MySQL import Customers
+
+        engine = get_engine()
+        Customers.__table__.create(engine)
+
+    def rate(label, rows, fn):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        print(f"{label:>24} {rows:>9} {elapsed:>8.2f} {rows / elapsed:>10.0f}")
+
+    print(f"{'method':>24} {'rows':>9} {'sec':>8} {'rows/s':>10}")
+    offset = 0
+
+    def one_by_one(start, rows):
+        for i in range(start, start + rows):
+            crud.myinsert(Customers, {"customer_id": f"C{i:07d}", "customer_name": f"顧客{i}", "age": i % 90,
+                                      "gender": "女"})
+
+    rate("crud.myinsert (per row)", args.baseline_rows, lambda: one_by_one(offset, args.baseline_rows))
+    offset += args.baseline_rows
+
+    for chunk_size in (100, 1000, 5000):
+        start = offset
+        rate(f"import_stream chunk={chunk_size}", args.compare_rows,
+             lambda: customer_import.import_stream(csv_chunks(args.compare_rows, start), "csv",
+                                                   chunk_size=chunk_size))
+        offset += args.compare_rows
+
+    client = TestClient(app.app)
+    start = offset
+    rate("POST /customers/import", args.compare_rows,
+         lambda: client.post("/customers/import", content=csv_chunks(args.compare_rows, start),
+                             headers={"content-type": "text/csv"}).raise_for_status())
+    offset += args.compare_rows
+
+    # 既存の行を上書きする（ON CONFLICT DO UPDATE の経路）
+    rate("import_stream (update)", args.compare_rows,
+         lambda: customer_import.import_stream(csv_chunks(args.compare_rows, args.baseline_rows), "csv"))
+
+    before = max_rss_mb()
+    start = offset
+    rate("import_stream (large)", args.rows,
+         lambda: customer_import.import_stream(csv_chunks(args.rows, start), "csv"))
+    print(f"\nmax RSS: {before:.1f} MB before -> {max_rss_mb():.1f} MB after {args.rows} rows")
+
+
+if __name__ == "__main__":
+    main()
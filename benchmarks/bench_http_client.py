@@ -0,0 +1,106 @@
+"""
+/fetchtest の外部呼び出しを、従来の requests.get（呼び出しごとに接続）と
+共有の http_client（キープアライブで接続を再利用、任意で応答キャッシュ）で比べるベンチマーク。
+
+ローカルのスタブサーバー（stub_llm_server の GET /users）に同時に N 件投げ、
+所要時間・p50 / p95 レイテンシ・スタブ側で数えた TCP 接続数を出す。
+requests.get は同期 API なので、FastAPI の同期エンドポイントと同じくスレッドプールで動かす。
+ローカルの接続は安いので、--connect-delay で新しい接続ごとに待たせて
+リモートの API での TCP / TLS ハンドシェイクの往復を模擬する（0 なら純粋な CPU コストの比較）。
+
+    python benchmarks/bench_http_client.py --requests 500 --concurrency 20 --connect-delay 0.05
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_llm_server import start_subprocess
+
+
+def _stats(port):
+    import httpx
+
+    return httpx.get(f"http://127.0.0.1:{port}/stats").json()
+
+
+def run_requests(url, n, concurrency):
+    import requests
+
+    def one(_):
+        started = time.perf_counter()
+        requests.get(url, timeout=10).json()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(one, range(n)))
+
+
+async def run_http_client(url, n, concurrency, ttl):
+    import http_client
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            started = time.perf_counter()
+            await http_client.get_json(url, ttl=ttl)
+            return time.perf_counter() - started
+
+    await http_client.start()
+    try:
+        return await asyncio.gather(*(one() for _ in range(n)))
+    finally:
+        await http_client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共有 HTTP クライアントのベンチマーク")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.02, help="スタブの応答遅延（秒）")
+    parser.add_argument("--connect-delay", type=float, default=0.05,
+                        help="新しい接続で最初の応答に足す遅延（秒、ハンドシェイクの往復の模擬）")
+    parser.add_argument("--port", type=int, default=8769)
+    args = parser.parse_args()
+
+    # import の時間を計測に含めない
+    import httpx  # noqa: F401
+    import requests  # noqa: F401
+
+    import http_client  # noqa: F401
+
+    stub = start_subprocess(args.port, args.delay, connect_delay=args.connect_delay)
+    url = f"http://127.0.0.1:{args.port}/users"
+    try:
+        print(f"requests={args.requests} concurrency={args.concurrency} delay={args.delay * 1000:.0f}ms "
+              f"connect_delay={args.connect_delay * 1000:.0f}ms")
+        print(f"{'mode':>18} {'elapsed[s]':>10} {'p50[ms]':>8} {'p95[ms]':>8} {'upstream':>8} {'conns':>6}")
+        modes = [
+            ("requests.get", lambda: run_requests(url, args.requests, args.concurrency)),
+            ("http_client", lambda: asyncio.run(run_http_client(url, args.requests, args.concurrency, 0))),
+            ("http_client+cache", lambda: asyncio.run(run_http_client(url, args.requests, args.concurrency, 60))),
+        ]
+        for mode, run in modes:
+            before = _stats(args.port)
+            started = time.perf_counter()
+            latencies = sorted(run())
+            elapsed = time.perf_counter() - started
+            after = _stats(args.port)
+            p50 = statistics.median(latencies) * 1000
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+            print(f"{mode:>18} {elapsed:>10.2f} {p50:>8.1f} {p95:>8.1f} "
+                  f"{after['user_calls'] - before['user_calls']:>8} {after['connections'] - before['connections']:>6}")
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
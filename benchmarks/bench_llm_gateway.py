@@ -0,0 +1,96 @@
+"""
+llm_gateway の効果を、429 を一定割合で返すローカルの LLM スタブサーバーで確かめるベンチマーク。
+
+同じ発話を含むリクエストを一斉に投げ、
+  1) 直接呼び出し（SDK の再試行なし・上限なし）
+  2) ゲートウェイ経由（同時実行数の上限・流量制限・再試行・相乗り）
+の成功件数、上流への呼び出し回数、所要時間を比べる。
+
+    python benchmarks/bench_llm_gateway.py --requests 200 --distinct 50 --fail-rate 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_llm_server import start_subprocess
+
+
+def _kwargs(i: int, distinct: int) -> dict:
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": f"今日の日記 {i % distinct}"}],
+        "max_tokens": 50,
+    }
+
+
+async def _direct(n, distinct):
+    import openai
+
+    client = openai.AsyncOpenAI(api_key="stub", max_retries=0)
+
+    async def one(i):
+        await client.chat.completions.create(**_kwargs(i, distinct))
+
+    return await asyncio.gather(*(one(i) for i in range(n)), return_exceptions=True)
+
+
+async def _gateway(gateway, n, distinct):
+    async def one(i):
+        await gateway.chat(**_kwargs(i, distinct))
+
+    return await asyncio.gather(*(one(i) for i in range(n)), return_exceptions=True)
+
+
+def _calls(port):
+    import httpx
+
+    return httpx.get(f"http://127.0.0.1:{port}/stats").json()["calls"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM ゲートウェイのベンチマーク")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=50, help="異なるプロンプトの数（残りは重複）")
+    parser.add_argument("--fail-rate", type=float, default=0.2, help="スタブが 429 を返す割合")
+    parser.add_argument("--llm-delay", type=float, default=0.1)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=float, default=6000)
+    parser.add_argument("--port", type=int, default=8767)
+    args = parser.parse_args()
+
+    stub = start_subprocess(args.port, args.llm_delay, args.fail_rate)
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    try:
+        import llm_gateway
+
+        print(f"requests={args.requests} distinct={args.distinct} fail_rate={args.fail_rate} "
+              f"delay={args.llm_delay * 1000:.0f}ms")
+        print(f"{'mode':>8} {'ok':>5} {'failed':>6} {'upstream':>8} {'elapsed[s]':>10}")
+        for mode in ("direct", "gateway"):
+            before = _calls(args.port)
+            started = time.perf_counter()
+            if mode == "direct":
+                results = asyncio.run(_direct(args.requests, args.distinct))
+            else:
+                gateway = llm_gateway.LLMGateway(max_concurrency=args.concurrency, rpm=args.rpm,
+                                                 burst=args.concurrency, deadline=30)
+                results = asyncio.run(_gateway(gateway, args.requests, args.distinct))
+            elapsed = time.perf_counter() - started
+            failed = sum(isinstance(r, Exception) for r in results)
+            print(f"{mode:>8} {len(results) - failed:>5} {failed:>6} {_calls(args.port) - before:>8} {elapsed:>10.2f}")
+        stats = gateway.stats()
+        print(f"\ngateway: coalesced={stats['coalesced']} retries={stats['retries']} "
+              f"wait_p95={stats['wait_p95_ms']:.0f}ms failures={stats['failures']}")
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+activity_logs の月ごとのパーティション（db_control.partitions、SQLite では月ごとのテーブル）の効果を測る。
+
+一時 SQLite DB を 2 つ作り、同じ合成ログ（既定で 500 万行、24 か月分）を SQL だけで入れる。
+片方はそのまま 1 テーブル、もう片方は partitions.init で月ごとのテーブルに分けて、
+  1) 1 日分の取得（GET /api/logs と同じ select_logs）
+  2) 7 日分を 100 行ずつキーセットページングで最後まで読む（GET /api/logs の cursor と同じ）
+  3) 月をまたぐ 7 日分を activity_type で絞って取得
+の所要時間と、SQLite の実行計画を比べる。最後に古い 12 か月分の保持期間切れの処理として、
+1 テーブルでの書き出し + DELETE と、archive（gzip の NDJSON に書き出して月ごとのテーブルを DROP）を比べる。
+
+    python benchmarks/bench_log_partitions.py --rows 5000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ["LOG_PARTITIONS"] = "1"
+
+from sqlalchemy import create_engine, event, select, text
+
+from db_control import activity_logs, partitions
+from db_control.mymodels_MySQL import ActivityLog
+
+FIRST_DAY = date(2025, 1, 1)
+
+# timestamp は SQLAlchemy の SQLite の保存形式（マイクロ秒まで）にそろえる
+SEED_SQL = """
+    INSERT INTO activity_logs (activity_type, milktype, volume, diaper_type, hardness, diaper_amount, sleep_state,
+                               timestamp, created_at)
+    WITH RECURSIVE n(x) AS (SELECT 0 UNION ALL SELECT x + 1 FROM n WHERE x + 1 < :rows)
+    SELECT CASE x % 4 WHEN 0 THEN 'milk' WHEN 1 THEN 'diaper' WHEN 2 THEN 'sleep' ELSE 'wake' END,
+           '', x % 200, '', '', '', '',
+           datetime(:first_day, '+' || (x * :seconds / :rows) || ' seconds') || '.000000',
+           datetime(:first_day, '+' || (x * :seconds / :rows) || ' seconds') || '.000000'
+    FROM n
+"""
+
+
+def timed(fn, repeat=1):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - t0) / repeat * 1000, result
+
+
+def make_engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_conn, _):
+        # 投入を速くするための設定（2 つの DB で同じ）
+        dbapi_conn.execute("PRAGMA journal_mode=WAL")
+        dbapi_conn.execute("PRAGMA synchronous=OFF")
+        dbapi_conn.execute("PRAGMA cache_size=-262144")
+
+    return engine
+
+
+def day_logs(conn, day):
+    start = datetime.combine(day, datetime.min.time())
+    return activity_logs.select_logs(conn, start, start + timedelta(days=1)).all()
+
+
+def paged(conn, first, days, page=100):
+    """[first, first + days) を page 行ずつ読み、(行数, クエリ数) を返す。"""
+    start = datetime.combine(first, datetime.min.time())
+    end = start + timedelta(days=days)
+    after, rows, queries = None, 0, 0
+    while True:
+        result = activity_logs.select_logs(conn, start, end, after=after, limit=page).all()
+        queries += 1
+        rows += len(result)
+        if len(result) < page:
+            return rows, queries
+        after = (result[-1].timestamp, result[-1].id)
+
+
+def filtered(conn, first, days):
+    start = datetime.combine(first, datetime.min.time())
+    return activity_logs.select_logs(conn, start, start + timedelta(days=days), types=["sleep", "wake"]).all()
+
+
+def plan(conn, first):
+    start = datetime.combine(first, datetime.min.time())
+    tables = partitions.log_tables(conn, start, start + timedelta(days=1))
+    stmt = activity_logs.logs_query(start, start + timedelta(days=1), limit=100, tables=tables)
+    sql = str(stmt.compile(conn, compile_kwargs={"literal_binds": True}))
+    return " / ".join(r[-1] for r in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="activity_logs のパーティションのベンチマーク")
+    parser.add_argument("--rows", type=int, default=5_000_000, help="activity_logs の行数")
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--retention", type=int, default=12, help="残す月数（それより古い月を削除する）")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    last_month = partitions.add_months(FIRST_DAY, args.months - 1)
+    seconds = (datetime.combine(partitions.add_months(FIRST_DAY, args.months), datetime.min.time())
+               - datetime.combine(FIRST_DAY, datetime.min.time())).total_seconds()
+    engines = {}
+    for name in ("single", "monthly"):
+        engine = make_engine(os.path.join(workdir, f"{name}.db"))
+        ActivityLog.__table__.create(engine)
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(text(SEED_SQL), {"rows": args.rows, "first_day": FIRST_DAY.isoformat(),
+                                          "seconds": int(seconds)})
+        print(f"{name:<8} seeded {args.rows:,} rows over {args.months} months in {time.perf_counter() - t0:.1f}s")
+        engines[name] = engine
+
+    with engines["monthly"].begin() as conn:
+        ms, months = timed(lambda: partitions.init(conn, today=last_month))
+    print(f"monthly  partitions.init moved rows into {len(months)} tables in {ms / 1000:.1f}s")
+    for engine in engines.values():
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+
+    day = last_month + timedelta(days=14)
+    boundary = partitions.add_months(last_month, -1) + timedelta(days=27)
+    print()
+    results = {}
+    for name, engine in engines.items():
+        with engine.connect() as conn:
+            cells = []
+            for label, fn in (("1 day", lambda: day_logs(conn, day)),
+                              ("7 days paged", lambda: paged(conn, day, 7)),
+                              ("7 days sleep/wake across months", lambda: filtered(conn, boundary, 7))):
+                ms, result = timed(fn, args.repeat)
+                results[(name, label)] = result
+                cells.append(f"{label}={ms:7.1f}ms")
+            print(f"{name:<8} " + "  ".join(cells))
+    same = all(results[("single", label)] == results[("monthly", label)]
+               for label in ("1 day", "7 days paged", "7 days sleep/wake across months"))
+    print(f"         same results: {same}  (paged: {results[('single', '7 days paged')]} rows/queries)")
+
+    for name, engine in engines.items():
+        with engine.connect() as conn:
+            print(f"plan {name:<8}", plan(conn, day))
+
+    # 保持期間切れ: 古い retention か月分を消す
+    cutoff = partitions.add_months(last_month, 1 - args.retention)
+    print(f"\nretention: drop logs before {cutoff:%Y-%m}")
+    table = ActivityLog.__table__
+    start = datetime.combine(cutoff, datetime.min.time())
+    with engines["single"].connect() as conn:
+        # archive と同じ形式で書き出す時間（1 テーブルでも書き出してから消すなら同じだけかかる）
+        ms, rows = timed(lambda: partitions._export(
+            conn, select(table).where(table.c.timestamp < start).order_by(table.c.timestamp, table.c.id),
+            os.path.join(workdir, "single.ndjson.gz")))
+    print(f"single   export {rows:,} rows                           {ms / 1000:7.1f}s")
+    with engines["single"].begin() as conn:
+        ms, result = timed(lambda: conn.execute(table.delete().where(table.c.timestamp < start)))
+    print(f"single   DELETE {result.rowcount:,} rows                           {ms / 1000:7.1f}s")
+    ms, archived = timed(lambda: partitions.archive(engines["monthly"], cutoff, os.path.join(workdir, "archive")))
+    size = sum(os.path.getsize(a["path"]) for a in archived)
+    print(f"monthly  archive (export + DROP) {sum(a['rows'] for a in archived):,} rows in {len(archived)} files "
+          f"({size / 2 ** 20:.1f} MB gz) {ms / 1000:7.1f}s")
+    with engines["monthly"].connect() as conn:
+        oldest = activity_logs.oldest_timestamp(conn)
+    print(f"         oldest remaining log: {oldest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+/api/logs の日付検索について、クエリ形とインデックスの効果を比較するベンチマーク。
+
+一時 SQLite DB の activity_logs に大量の行を投入し、
+  1) 旧クエリ  WHERE DATE(timestamp) = :d（インデックスなし）
+  2) 旧クエリ  WHERE DATE(timestamp) = :d（インデックスあり）
+  3) 新クエリ  WHERE timestamp >= :start AND timestamp < :end（インデックスあり）
+の実行計画と所要時間を表示する。関数をかけた 1), 2) は全件走査、3) はインデックス範囲走査になる。
+
+    python benchmarks/bench_logs_index.py --rows 2000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import create_engine, select
+
+from db_control import activity_logs, timeutil
+from db_control.mymodels_MySQL import ActivityLog
+
+OLD_SQL = "SELECT * FROM activity_logs WHERE DATE(timestamp) = :d ORDER BY timestamp"
+TYPES = ("feeding", "diaper", "sleep", "wake")
+
+
+def seed(engine, rows: int, days: int):
+    start = datetime(2025, 1, 1)
+    span = days * 86400
+    rnd = random.Random(0)
+    table = ActivityLog.__table__
+    with engine.begin() as conn:
+        batch = []
+        for _ in range(rows):
+            ts = start + timedelta(seconds=rnd.randrange(span))
+            batch.append({
+                "activity_type": rnd.choice(TYPES), "milktype": "", "volume": 0,
+                "diaper_type": "", "hardness": "", "diaper_amount": "", "sleep_state": "",
+                "timestamp": ts, "created_at": ts,
+            })
+            if len(batch) == 50000:
+                conn.execute(table.insert(), batch)
+                batch.clear()
+        if batch:
+            conn.execute(table.insert(), batch)
+
+
+def timed(conn, stmt, params, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        n = len(conn.exec_driver_sql(stmt, params).fetchall()) if isinstance(stmt, str) else len(conn.execute(stmt).fetchall())
+    return (time.perf_counter() - t0) / repeat * 1000, n
+
+
+def plan(conn, sql, params):
+    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return " / ".join(r[-1] for r in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--days", type=int, default=365 * 3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "logs.db")
+    engine = create_engine(f"sqlite:///{path}")
+    table = ActivityLog.__table__
+    index = next(iter(table.indexes))
+
+    # まずインデックスなしでテーブルを作って投入する
+    table.indexes.discard(index)
+    table.create(engine)
+    table.indexes.add(index)
+    t0 = time.perf_counter()
+    seed(engine, args.rows, args.days)
+    print(f"seeded {args.rows:,} rows over {args.days} days in {time.perf_counter() - t0:.1f}s")
+
+    day = date(2025, 6, 2)
+    old_sql = OLD_SQL.replace(":d", "?")
+    old_params = (day.isoformat(),)
+    start, end = timeutil.day_range(day, timeutil.DB_TIMEZONE)
+    new_stmt = (
+        select(table)
+        .where(table.c.timestamp >= start, table.c.timestamp < end)
+        .order_by(table.c.timestamp, table.c.id)
+    )
+    new_sql = str(new_stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+
+    with engine.connect() as conn:
+        ms, n = timed(conn, old_sql, old_params, args.repeat)
+        print(f"\n[1] DATE(timestamp) = :d, no index      {ms:8.1f} ms  rows={n}")
+        print("    plan:", plan(conn, old_sql, old_params))
+
+    index.create(engine)
+    with engine.connect() as conn:
+        ms, n = timed(conn, old_sql, old_params, args.repeat)
+        print(f"[2] DATE(timestamp) = :d, with index    {ms:8.1f} ms  rows={n}")
+        print("    plan:", plan(conn, old_sql, old_params))
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            n = len(activity_logs.select_logs(conn, start, end).fetchall())
+        ms = (time.perf_counter() - t0) / args.repeat * 1000
+        print(f"[3] half-open range, with index        {ms:8.1f} ms  rows={n}")
+        print("    plan:", plan(conn, new_sql, ()))
+
+
+if __name__ == "__main__":
+    main()
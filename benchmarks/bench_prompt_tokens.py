@@ -0,0 +1,109 @@
+"""
+gpt_parser のプロンプトの種類（PROMPT_MODE = full / compact）ごとに、
+1 リクエストあたりの入力トークン数と解析の正解率を比べる。
+
+トークン数は tiktoken（gpt-4o 系の o200k_base）が使えればそれで数え、
+使えなければ文字数で近似する。functions は API 側で別の書式に直されてから
+プロンプトに入るため、ここでは JSON にした長さで近似する。
+
+--live を付けると、benchmarks/corpus/utterances.jsonl の発話を実際の API に送り、
+ルールベースとキャッシュを通さずに LLM の正解率と usage（prompt_tokens と
+プロンプトキャッシュに載った cached_tokens）を集計する（OPENAI_API_KEY が必要）。
+
+    python benchmarks/bench_prompt_tokens.py
+    python benchmarks/bench_prompt_tokens.py --live --repeat 2
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+from bench_rule_parser import load_corpus
+
+FIELDS = ["activity_type", "milktype", "volume", "diaper_type", "hardness", "diaper_amount", "sleep_state"]
+
+
+def _token_counter():
+    try:
+        import tiktoken
+
+        # 初回は語彙ファイルをダウンロードするため、オフラインでは失敗する
+        encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return len, "chars (tiktoken が使えないため文字数で近似)"
+    return lambda text: len(encoding.encode(text)), "o200k_base"
+
+
+def static_tokens(gpt_parser, mode, corpus, count):
+    """システムプロンプト・スキーマ（毎回同じ先頭部分）と発話部分のトークン数。"""
+    kwargs = gpt_parser._request_kwargs("", mode)
+    prefix = count(kwargs["messages"][0]["content"]) + count(
+        json.dumps(kwargs["functions"], ensure_ascii=False, separators=(",", ":")))
+    utterance = sum(count(item["utterance"]) for item in corpus) / len(corpus)
+    return prefix, utterance
+
+
+def live_eval(gpt_parser, llm_gateway, mode, corpus, repeat):
+    """実際の API で解析し、完全一致率・項目ごとの正解数・usage を集計する。"""
+    exact = 0
+    field_ok = dict.fromkeys(FIELDS, 0)
+    prompt_tokens = cached_tokens = calls = 0
+    for _ in range(repeat):
+        for item in corpus:
+            resp = llm_gateway.chat_sync(**gpt_parser._request_kwargs(item["utterance"], mode))
+            calls += 1
+            usage = resp.usage
+            prompt_tokens += usage.prompt_tokens
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached_tokens += getattr(details, "cached_tokens", None) or 0
+            try:
+                data = gpt_parser._to_record(resp, "2025-06-02T10:00:00Z")
+            except ValueError:
+                continue
+            got = {k: data.get(k) for k in FIELDS}
+            exact += got == item["expected"]
+            for k in FIELDS:
+                field_ok[k] += got[k] == item["expected"][k]
+    return {
+        "accuracy": exact / calls,
+        "fields": {k: v / calls for k, v in field_ok.items()},
+        "prompt_tokens": prompt_tokens / calls,
+        "cached_tokens": cached_tokens / calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="プロンプトの種類ごとのトークン数と正解率")
+    parser.add_argument("--live", action="store_true", help="実際の API で正解率と usage を測る")
+    parser.add_argument("--repeat", type=int, default=1, help="--live でコーパスを繰り返す回数")
+    args = parser.parse_args()
+
+    import gpt_parser
+
+    corpus = load_corpus()
+    count, encoding = _token_counter()
+    print(f"corpus={len(corpus)} utterances  tokenizer={encoding}")
+    print(f"{'mode':>8} {'prefix':>7} {'utterance':>9} {'total':>7}")
+    for mode in gpt_parser.PROMPTS:
+        prefix, utterance = static_tokens(gpt_parser, mode, corpus, count)
+        print(f"{mode:>8} {prefix:>7} {utterance:>9.1f} {prefix + utterance:>7.1f}")
+
+    if not args.live:
+        return
+    import llm_gateway
+
+    print(f"\n{'mode':>8} {'exact':>6} {'prompt_tok':>10} {'cached_tok':>10}  per-field accuracy")
+    for mode in gpt_parser.PROMPTS:
+        result = live_eval(gpt_parser, llm_gateway, mode, corpus, args.repeat)
+        fields = " ".join(f"{k}={v:.0%}" for k, v in result["fields"].items())
+        print(f"{mode:>8} {result['accuracy']:>6.1%} {result['prompt_tokens']:>10.1f} "
+              f"{result['cached_tokens']:>10.1f}  {fields}")
+
+
+if __name__ == "__main__":
+    main()
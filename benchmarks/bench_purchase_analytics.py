@@ -0,0 +1,205 @@
+"""
+購入の集計（db_control.analytics）について、書き方・インデックス・集計テーブルの効果を比べるベンチマーク。
+
+一時 SQLite DB に合成データ（既定で明細 1000 万行、約 3.3 明細 / 購入、2 年分）を SQL だけで生成し、
+  1) 集約 SQL 1 本、インデックスなし
+  2) 集約 SQL 1 本、インデックスあり
+  3) N+1: 購入ごとに明細を、明細ごとに商品を SELECT してアプリケーションで足す（1 日分だけ）
+  4) 集計テーブル（daily_purchase_summary / daily_item_sales）+ 集計後の日だけ明細から
+の所要時間を、直近 30 日と全期間の 3 種類の集計（顧客別売上・売れ筋商品・日別購入）で表示する。
+最後に 1 日分の購入を追加して、差分更新（refresh_rollup）と全体の作り直しの時間を比べる。
+
+    python benchmarks/bench_purchase_analytics.py --details 10000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import create_engine, event, select
+
+from db_control import analytics
+from db_control.mymodels_MySQL import Base
+
+FIRST_DAY = date(2024, 1, 1)
+
+# 生成は SQLite の再帰 CTE で行い、Python に行を持ち込まない。
+# 商品は 2 つの一様乱数の積で小さい ID に偏らせ、売れ筋の差をつける
+SEED_SQL = [
+    """
+    INSERT INTO items (item_id, item_name, price)
+    WITH RECURSIVE n(x) AS (SELECT 0 UNION ALL SELECT x + 1 FROM n WHERE x + 1 < :items)
+    SELECT printf('I%06d', x), '商品' || x, 100 + (x * 37) % 4900 FROM n
+    """,
+    """
+    INSERT INTO customers (customer_id, customer_name, age, gender)
+    WITH RECURSIVE n(x) AS (SELECT 0 UNION ALL SELECT x + 1 FROM n WHERE x + 1 < :customers)
+    SELECT printf('C%07d', x), '顧客' || x, x % 90, CASE x % 2 WHEN 0 THEN '男' ELSE '女' END FROM n
+    """,
+    """
+    INSERT INTO purchases (purchase_id, customer_id, purchase_date)
+    WITH RECURSIVE n(x) AS (SELECT :first_purchase UNION ALL SELECT x + 1 FROM n WHERE x + 1 < :last_purchase)
+    SELECT printf('P%08d', x), printf('C%07d', (x * 7919) % :customers),
+           date(:first_day, '+' || (:day_offset + (x - :first_purchase) * :days / (:last_purchase - :first_purchase))
+                || ' days')
+    FROM n
+    """,
+    """
+    INSERT INTO purchase_details (detail_id, purchase_id, item_id, quantity)
+    WITH RECURSIVE n(x) AS (SELECT :first_detail UNION ALL SELECT x + 1 FROM n WHERE x + 1 < :last_detail)
+    SELECT printf('D%08d', x),
+           printf('P%08d', :first_purchase + (x - :first_detail) * (:last_purchase - :first_purchase)
+                           / (:last_detail - :first_detail)),
+           printf('I%06d', ((x * 2654435761) % :items) * ((x * 40503) % :items) / :items),
+           1 + x % 5
+    FROM n
+    """,
+]
+
+
+def seed(engine, params):
+    with engine.begin() as conn:
+        for sql in SEED_SQL:
+            conn.exec_driver_sql(sql, params)
+
+
+def timed(fn, repeat=1):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - t0) / repeat * 1000, result
+
+
+def n_plus_one_daily(conn, day: date):
+    """ORM のループで書いた場合の 1 日分の購入回数・数量・売上（N+1 クエリ）。"""
+    p, d, i = analytics.purchases, analytics.details, analytics.items
+    count = quantity = revenue = 0
+    for purchase in conn.execute(select(p).where(p.c.purchase_date == day.isoformat())).mappings().all():
+        count += 1
+        for detail in conn.execute(select(d).where(d.c.purchase_id == purchase["purchase_id"])).mappings().all():
+            price = conn.execute(select(i.c.price).where(i.c.item_id == detail["item_id"])).scalar()
+            quantity += detail["quantity"]
+            revenue += detail["quantity"] * price
+    return {"purchase_date": day.isoformat(), "purchase_count": count, "quantity": quantity, "revenue": revenue}
+
+
+def reports(conn, first, last, use_rollup):
+    return {
+        "customers": lambda: analytics.revenue_per_customer(conn, first, last, limit=10),
+        "items": lambda: analytics.top_items(conn, first, last, limit=10, use_rollup=use_rollup),
+        "daily": lambda: analytics.purchases_per_day(conn, first, last, use_rollup=use_rollup),
+    }
+
+
+def run_reports(engine, label, ranges, use_rollup, repeat):
+    results = {}
+    with engine.connect() as conn:
+        for range_label, (first, last) in ranges.items():
+            cells = []
+            for name, fn in reports(conn, first, last, use_rollup).items():
+                ms, result = timed(fn, repeat)
+                results[(range_label, name)] = result
+                cells.append(f"{name}={ms:9.1f}ms")
+            print(f"{label:<28} {range_label:<5} " + "  ".join(cells))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="購入の集計のベンチマーク")
+    parser.add_argument("--details", type=int, default=10_000_000, help="purchase_details の行数")
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--items", type=int, default=2_000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--repeat", type=int, default=3, help="インデックスありの計測の繰り返し回数")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "purchases.db")
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_conn, _):
+        # 投入を速くするための設定（計測するクエリには影響しない）
+        dbapi_conn.execute("PRAGMA journal_mode=WAL")
+        dbapi_conn.execute("PRAGMA synchronous=OFF")
+        dbapi_conn.execute("PRAGMA cache_size=-262144")
+
+    tables = [analytics.customers, analytics.items, analytics.purchases, analytics.details, analytics.daily,
+              analytics.item_sales]
+    indexes = {t: set(t.indexes) for t in tables}
+    for t in tables:
+        t.indexes.clear()
+    Base.metadata.create_all(engine, tables=tables)
+    for t in tables:
+        t.indexes.update(indexes[t])
+
+    purchases = args.details * 3 // 10
+    t0 = time.perf_counter()
+    seed(engine, {"items": args.items, "customers": args.customers, "first_day": FIRST_DAY.isoformat(),
+                  "days": args.days, "day_offset": 0, "first_purchase": 0, "last_purchase": purchases,
+                  "first_detail": 0, "last_detail": args.details})
+    print(f"seeded {args.details:,} details / {purchases:,} purchases over {args.days} days "
+          f"in {time.perf_counter() - t0:.1f}s")
+
+    last_day = FIRST_DAY + timedelta(days=args.days - 1)
+    ranges = {"30d": (last_day - timedelta(days=29), last_day), "all": (None, None)}
+
+    print()
+    run_reports(engine, "[1] SQL, no index", ranges, False, 1)
+
+    t0 = time.perf_counter()
+    for t in tables:
+        for index in t.indexes:
+            index.create(engine)
+    with engine.begin() as conn:
+        # MySQL（InnoDB）と同じく、プランナーが統計を使えるようにする
+        conn.exec_driver_sql("ANALYZE")
+    print(f"    (created indexes in {time.perf_counter() - t0:.1f}s)")
+    raw = run_reports(engine, "[2] SQL, indexes", ranges, False, args.repeat)
+
+    # N+1 はインデックスがないと購入ごとに明細を全件走査するので、インデックスを作ってから比べる
+    with engine.connect() as conn:
+        ms, expected = timed(lambda: n_plus_one_daily(conn, last_day))
+        print(f"[3] N+1 loop, 1 day             {ms:9.1f}ms  ({expected['purchase_count']} purchases)")
+        ms, (sql_row,) = timed(lambda: analytics.purchases_per_day(conn, last_day, last_day, use_rollup=False))
+        print(f"    aggregated SQL, 1 day        {ms:9.1f}ms  same result: {sql_row == expected}")
+
+    with engine.begin() as conn:
+        ms, days = timed(lambda: analytics.refresh_rollup(conn))
+    print(f"    (built rollup for {days} days in {ms / 1000:.1f}s)")
+    rolled = run_reports(engine, "[4] rollup + live tail", ranges, True, args.repeat)
+    print(f"    rollup results match raw SQL: {rolled == raw}")
+
+    # 翌日分の購入を追加し、差分更新と全体の作り直しを比べる
+    per_day = purchases // args.days
+    with engine.begin() as conn:
+        params = {"items": args.items, "customers": args.customers, "first_day": FIRST_DAY.isoformat(),
+                  "days": 1, "day_offset": args.days, "first_purchase": purchases,
+                  "last_purchase": purchases + per_day, "first_detail": args.details,
+                  "last_detail": args.details + per_day * 10 // 3}
+        for sql in SEED_SQL[2:]:
+            conn.exec_driver_sql(sql, params)
+    print(f"\nappended {per_day} purchases for {last_day + timedelta(days=1)}")
+    with engine.connect() as conn:
+        ms, _ = timed(lambda: analytics.top_items(conn, limit=10, use_rollup=True), args.repeat)
+        print(f"    top items before refresh (rollup + 1 live day)  {ms:9.1f}ms")
+    with engine.begin() as conn:
+        ms, days = timed(lambda: analytics.refresh_rollup(conn))
+        print(f"    incremental refresh ({days} days)                {ms:9.1f}ms")
+    with engine.begin() as conn:
+        ms, days = timed(lambda: analytics.refresh_rollup(conn, FIRST_DAY, last_day + timedelta(days=1)))
+        print(f"    full rebuild ({days} days)                     {ms:9.1f}ms")
+
+    with engine.connect() as conn:
+        top = analytics._item_lines(*ranges["30d"], None)
+        plan = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + str(select(top).compile(engine, compile_kwargs={"literal_binds": True}))).fetchall()
+        print("\nplan (top items, 30d, raw):", " / ".join(r[-1] for r in plan))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+/api/record の同時実行スループットを計測するベンチマーク。
+
+ローカルの LLM スタブサーバー（一定の遅延で応答）と一時 SQLite DB を使い、
+同時実行数を変えながら /api/record を叩く。
+LLM 呼び出しがイベントループを塞がなければ、スループットは同時実行数にほぼ比例して伸びる。
+発話はルールベースのパーサーで判定できないもの（起床と就寝の両方を含む）にし、リクエストごとに
+番号を変えて、キャッシュや同じ発話の相乗りで LLM 呼び出しが省かれないようにする。
+
+    python benchmarks/bench_record_concurrency.py --requests 100 --concurrency 1 10 50
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _run(app, n_requests: int, concurrency: int):
+    import httpx
+
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(client, i):
+        async with sem:
+            t0 = time.perf_counter()
+            r = await client.post("/api/record", json={
+                "utterance": f"起きたけどまた寝た（{concurrency}-{i}）",
+                "recorded_at": "2025-06-02T10:00:00+09:00",
+            })
+            r.raise_for_status()
+            latencies.append(time.perf_counter() - t0)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(n_requests)))
+        elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--llm-delay", type=float, default=0.2, help="スタブ LLM の応答遅延（秒）")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    from stub_llm_server import start_subprocess
+    stub = start_subprocess(args.port, args.llm_delay)
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    # LLM ゲートウェイの同時実行数・レート制限で頭打ちにならないようにする（計測したいのはイベントループの詰まり）
+    os.environ.setdefault("LLM_MAX_CONCURRENCY", "1000")
+    os.environ.setdefault("LLM_RPM", "1000000")
+    os.environ.setdefault("LLM_BURST", "1000")
+    # 遅いリクエスト・クエリのログで計測結果が埋もれないようにする
+    os.environ.setdefault("TRACE_SLOW_MS", "1000000")
+    os.environ.setdefault("DB_SLOW_QUERY_MS", "1000000")
+
+    # import 時の print や SQL ログで計測結果が埋もれないようにする
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as app_module
+        from db_control.mymodels_MySQL import Base
+        engine = app_module.get_engine()
+        engine.echo = False
+        # /api/record は daily_activity_summary も同じトランザクションで更新する
+        Base.metadata.create_all(engine)
+
+    print(f"LLM stub delay={args.llm_delay * 1000:.0f}ms requests={args.requests}")
+    print(f"{'concurrency':>11} {'elapsed[s]':>10} {'req/s':>8} {'p50[ms]':>8} {'p95[ms]':>8}")
+    for c in args.concurrency:
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, lat = asyncio.run(_run(app_module.app, args.requests, c))
+        p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+        print(f"{c:>11} {elapsed:>10.2f} {args.requests / elapsed:>8.1f} "
+              f"{statistics.median(lat) * 1000:>8.1f} {p95 * 1000:>8.1f}")
+
+    import httpx
+    calls = httpx.get(f"http://127.0.0.1:{args.port}/stats").json()["calls"]
+    print(f"LLM calls (including retries): {calls} / {args.requests * len(args.concurrency)} requests")
+    stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+record_validator の 1 件ずつの検証（validate_record）と、辞書のリスト（validate_records）・
+列形式（validate_columns）の一括検証の速さを比べる。
+
+一括取り込みを想定して、同義語・範囲外の量・不正な値を混ぜたレコードを N 件作り、
+それぞれの方法で正規化したときの処理時間と 1 件あたりの時間を出す。
+計測の前に、volume の境界値（VOLUME_CASES）が 3 つの方法で同じ結果になることを確かめる。
+
+    python benchmarks/bench_record_validator.py --records 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import record_validator
+
+SAMPLES = [
+    {"activity_type": "feeding", "milktype": "ミルク", "volume": 120},
+    {"activity_type": "feeding", "milktype": "おっぱい", "volume": "80ml"},
+    {"activity_type": "feeding", "milktype": "", "volume": 9999},
+    {"activity_type": "diaper", "diaper_type": "うんち", "hardness": "やや固い", "diaper_amount": "多い"},
+    {"activity_type": "diaper", "diaper_type": "おしっこ", "hardness": "普通"},
+    {"activity_type": "sleep", "sleep_state": ""},
+    {"activity_type": "wake", "sleep_state": "wake"},
+    {"activity_type": "お風呂"},
+    {"activity_type": "feeding", "volume": 1e20},
+    {"activity_type": "feeding", "volume": [1]},
+]
+
+# volume の値と期待する結果（None は不正として弾く）
+VOLUME_CASES = [
+    (120, 120), (80.7, 80), ("80ml", 80), ("１２０ｍｌ", 120), ("1e20", 500), (1e20, 500), (9999, 500),
+    (-5, 0), ("abc", 0), (None, 0),
+    (float("nan"), None), (float("inf"), None), ("nan", None), (True, None), ([1], None), ({"ml": 80}, None),
+]
+
+
+def check_volume_cases():
+    """VOLUME_CASES を validate_record と validate_records で検証し、期待と違えば AssertionError。"""
+    records = [{"activity_type": "feeding", "volume": value} for value, _ in VOLUME_CASES]
+    rows, errors = record_validator.validate_records(records)
+    rejected = {i for i, _ in errors}
+    batch = dict(zip([i for i in range(len(records)) if i not in rejected], (r["volume"] for r in rows)))
+    for i, (value, expected) in enumerate(VOLUME_CASES):
+        try:
+            single = record_validator.validate_record(records[i])["volume"]
+        except record_validator.RecordValidationError:
+            single = None
+        assert single == expected, (value, single, expected)
+        assert batch.get(i) == expected, (value, batch.get(i), expected)
+
+
+def make_records(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [dict(rng.choice(SAMPLES), timestamp=f"2025-06-02T{i % 24:02d}:00:00") for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="record_validator のベンチマーク")
+    parser.add_argument("--records", type=int, default=100000)
+    args = parser.parse_args()
+
+    check_volume_cases()
+    records = make_records(args.records)
+
+    started = time.perf_counter()
+    ok = 0
+    for record in records:
+        try:
+            record_validator.validate_record(record)
+            ok += 1
+        except record_validator.RecordValidationError:
+            pass
+    per_record = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rows, errors = record_validator.validate_records(records)
+    from_dicts = time.perf_counter() - started
+    assert len(rows) == ok, (len(rows), ok)
+
+    # CSV などから最初から列形式で読み込んだ場合
+    names = list(dict.fromkeys(name for record in records for name in record))
+    columns = {name: [record.get(name) for record in records] for name in names}
+    started = time.perf_counter()
+    record_validator.validate_columns(columns)
+    columnar = time.perf_counter() - started
+
+    print(f"records={args.records} valid={ok} rejected={len(errors)}")
+    print(f"{'mode':>16} {'total[ms]':>10} {'per record[us]':>15}")
+    for mode, elapsed in (("validate_record", per_record), ("validate_records", from_dicts),
+                          ("validate_columns", columnar)):
+        print(f"{mode:>16} {elapsed * 1000:>10.1f} {elapsed / args.records * 1e6:>15.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+ルールベースの高速パスのヒット率・正解率・経路ごとのレイテンシを計測する。
+
+benchmarks/corpus/utterances.jsonl（SYSTEM_PROMPT の例とその言い換え）を
+parse_utterance に通し、ルールで確定した発話と LLM にフォールバックした発話を集計する。
+source が fallback の発話（expected が null のものは記録すべき活動がない発話）を
+ルールで確定してしまった場合も不一致として数える。
+LLM はローカルのスタブサーバーで代用するため、ネットワークなしで実行できる。
+
+    python benchmarks/bench_rule_parser.py --repeat 20
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+CORPUS = os.path.join(HERE, "corpus", "utterances.jsonl")
+
+
+def load_corpus(path=CORPUS):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10, help="コーパスを繰り返す回数")
+    parser.add_argument("--llm-delay", type=float, default=0.3, help="スタブ LLM の応答遅延（秒）")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    from stub_llm_server import start_subprocess
+    stub = start_subprocess(args.port, args.llm_delay)
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+
+    import gpt_parser
+    import rule_parser
+
+    corpus = load_corpus()
+
+    # ルールで確定した発話がラベルと一致するか（LLM の結果はスタブなので評価しない）
+    hits = correct = 0
+    misses = []
+    for item in corpus:
+        data, confidence = rule_parser.parse(item["utterance"])
+        if data is None or confidence < gpt_parser.RULE_MIN_CONFIDENCE:
+            continue
+        hits += 1
+        if item["source"] != "fallback" and data == item["expected"]:
+            correct += 1
+        else:
+            misses.append((item["utterance"], data))
+
+    for _ in range(args.repeat):
+        for item in corpus:
+            gpt_parser.parse_utterance(item["utterance"], "2025-06-02T10:00:00Z")
+    stub.terminate()
+
+    print(f"corpus={len(corpus)} utterances x {args.repeat}")
+    print(f"rule accuracy on hits: {correct}/{hits}")
+    for utterance, data in misses:
+        print(f"  mismatch: {utterance} -> {data}")
+    stats = gpt_parser.parser_stats()
+    print(f"{'path':>5} {'count':>6} {'hit_rate':>8} {'p50[ms]':>9} {'p95[ms]':>9}")
+    for path, s in stats["paths"].items():
+        p50 = f"{s['p50_ms']:.3f}" if s["p50_ms"] is not None else "-"
+        p95 = f"{s['p95_ms']:.3f}" if s["p95_ms"] is not None else "-"
+        print(f"{path:>5} {s['count']:>6} {s['hit_rate']:>8.1%} {p50:>9} {p95:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+`import app` にかかる時間を計測し、予算を超えたら終了コード 1 で失敗させるベンチマーク。
+
+python -X importtime の出力を集計して、累積時間の大きいモジュールを表示する。
+import 時の副作用がないことも確認する（標準出力への print、OPENAI_API_KEY 未設定での失敗）。
+コールドスタートで重い import が紛れ込んでいないかを CI やデプロイ前に確かめる用途。
+
+    python benchmarks/bench_startup.py --budget-ms 1500
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_import(module: str):
+    """新しいプロセスで module を import し、(importtime の行, 標準出力, 経過秒) を返す。"""
+    env = dict(os.environ)
+    # 接続先は使われないはずだが、念のため実在しない MySQL ではなく SQLite にしておく
+    env.setdefault("DATABASE_URL", "sqlite://")
+    # キー未設定でも import できること（クライアントは初回利用時に作る）を確認する
+    env.pop("OPENAI_API_KEY", None)
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f"import {module} に失敗しました")
+    rows = []
+    for line in proc.stderr.splitlines():
+        # "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us), len(name) - len(name.lstrip())))
+    return rows, proc.stdout, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="import app の起動時間ベンチマーク")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget-ms", type=float, default=1500,
+                        help="import の累積時間の上限（最良値で判定）")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    results = [run_import(args.module) for _ in range(args.runs)]
+    # ディスクキャッシュなどの揺らぎを除くため、最も速かった回で判定する
+    rows, stdout, elapsed = min(results, key=lambda r: r[2])
+    top_level = [r for r in rows if r[0] == args.module]
+    total_ms = top_level[-1][2] / 1000 if top_level else float("nan")
+
+    print(f"import {args.module}: {total_ms:.0f}ms (process {elapsed * 1000:.0f}ms, best of {args.runs})")
+    print(f"{'cumulative[ms]':>14} {'self[ms]':>9}  module")
+    # 直下の依存（インデント 2 段目まで）のうち重いものを表示する
+    direct = sorted((r for r in rows if r[3] <= 3), key=lambda r: r[2], reverse=True)
+    for name, self_us, cumulative_us, _ in direct[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+    failed = False
+    if stdout.strip():
+        print(f"\n🔴 import 時に標準出力へ書き込みがあります:\n{stdout[:500]}")
+        failed = True
+    if not total_ms <= args.budget_ms:
+        print(f"\n🔴 予算 {args.budget_ms:.0f}ms を超えています")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print(f"\n🟢 予算 {args.budget_ms:.0f}ms 以内")
+
+
+if __name__ == "__main__":
+    main()
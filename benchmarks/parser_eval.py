@@ -0,0 +1,268 @@
+"""
+parse_utterance の正解率とレイテンシを、ネットワークなしで再現可能に測る評価ハーネス。
+
+benchmarks/corpus/utterances.jsonl（ラベル付きの発話。expected が null のルールの回帰確認用の発話は除く）を
+parse_utterance に通し、
+項目ごとの正解率、p50 / p95 / p99 レイテンシ、LLM 呼び出し 1 回あたりのトークン数を出す。
+ルールベース・キャッシュ・プロンプトの変更の効果を同じ条件で比べるためのもの。
+
+LLM の応答は「カセット」（JSONL）に記録して再生する:
+    --mode record  カセットにないリクエストだけ実際の API を呼んで記録する（OPENAI_API_KEY が必要）
+    --mode replay  カセットの応答だけを返す（既定）。記録時の上流レイテンシを再現して待つ
+                   （--replay-latency 0 で待たない）。カセットにないリクエストはエラーとして数える
+    --mode seed    カセットにないリクエストを、コーパスのラベルをそのまま返す応答として記録する
+                   （API を呼べない環境でカセットを用意する用。記録した応答には "seeded": true が付き、
+                   上流レイテンシは --seed-latency 秒、トークン数は記録しない）
+    --mode stub    stub_llm_server を使う（正解率はスタブの判定なので参考にならない）
+
+カセットはリクエスト（モデル・メッセージ・スキーマ）のハッシュで引くので、
+PROMPT_MODE ごとに別の応答として記録される。
+リポジトリの benchmarks/cassettes/ は seed で作ったもの（LLM 経路の正解率はラベルどおりになるので、
+ルール・キャッシュの経路とレイテンシの比較に使う）。実際の応答で測るときは、カセットを消してから record で取り直す。
+エラー（カセットにないリクエストを含む）が 1 件でもあれば終了コード 1 で終わる。
+
+    python benchmarks/parser_eval.py --mode record --prompt-mode compact
+    python benchmarks/parser_eval.py --mode seed --prompt-mode compact --no-rules
+    python benchmarks/parser_eval.py --prompt-mode compact --no-rules --no-cache --repeat 3
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+from bench_rule_parser import load_corpus
+
+FIELDS = ["activity_type", "milktype", "volume", "diaper_type", "hardness", "diaper_amount", "sleep_state"]
+PATHS = ("rule", "cache", "llm")
+RECORDED_AT = "2025-06-02T10:00:00Z"
+
+
+class CassetteMissError(LookupError):
+    """replay でカセットに記録のないリクエストが来た。"""
+
+
+class LabelClient:
+    """seed 用に、コーパスのラベルを function_call の引数として返すクライアント。"""
+
+    seeded = True
+
+    def __init__(self, corpus, latency: float):
+        from openai.types.chat import ChatCompletion
+
+        self._response_type = ChatCompletion
+        self.labels = {item["utterance"]: item["expected"] for item in corpus}
+        self.latency = latency
+        self.chat = self
+        self.completions = self
+
+    def create(self, timeout=None, **kwargs):
+        utterance = kwargs["messages"][-1]["content"]
+        return self._response_type.model_validate({
+            "id": "chatcmpl-seed", "object": "chat.completion", "created": 0, "model": kwargs["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                "role": "assistant", "content": None,
+                "function_call": {"name": kwargs["function_call"]["name"],
+                                  "arguments": json.dumps(self.labels[utterance], ensure_ascii=False)},
+            }}],
+        })
+
+
+class CassetteClient:
+    """
+    OpenAI クライアントと同じ形（client.chat.completions.create）で、
+    カセットに記録した応答を返すクライアント。inner を渡すと記録のないリクエストを inner に流して記録する。
+    """
+
+    def __init__(self, path: str, inner=None, replay_latency: float = 1.0):
+        # 計測に import の時間が混ざらないよう、ここで読み込んでおく
+        from openai.types.chat import ChatCompletion
+
+        import llm_gateway
+
+        self._response_type = ChatCompletion
+        self._request_key = llm_gateway._request_key
+        self.path = path
+        self.inner = inner
+        self.replay_latency = replay_latency
+        self.entries = {}
+        self.recorded = self.replayed = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+        self.chat = self
+        self.completions = self
+
+    def create(self, timeout=None, **kwargs):
+        key = self._request_key(kwargs)
+        entry = self.entries.get(key)
+        if entry is None:
+            if self.inner is None:
+                raise CassetteMissError(f"カセットに記録がありません: {kwargs['messages'][-1]['content']}")
+            started = time.perf_counter()
+            resp = self.inner.chat.completions.create(timeout=timeout, **kwargs)
+            entry = {
+                "key": key,
+                "utterance": kwargs["messages"][-1]["content"],
+                "latency": getattr(self.inner, "latency", None) or time.perf_counter() - started,
+                "response": resp.model_dump(mode="json", exclude_none=True),
+            }
+            if getattr(self.inner, "seeded", False):
+                entry["seeded"] = True
+            self.entries[key] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.recorded += 1
+            return resp
+        if self.replay_latency:
+            time.sleep(entry["latency"] * self.replay_latency)
+        self.replayed += 1
+        return self._response_type.model_validate(entry["response"])
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def evaluate(gpt_parser, corpus, repeat: int, no_cache: bool):
+    """コーパスを repeat 回解析し、正解率・レイテンシ・経路ごとの件数を集計する。"""
+    rows = []
+    for _ in range(repeat):
+        for item in corpus:
+            if no_cache:
+                gpt_parser.parse_cache.local.clear()
+            before = {p: gpt_parser.PARSE_REQUESTS.value(path=p) for p in PATHS}
+            started = time.perf_counter()
+            try:
+                data, error = gpt_parser.parse_utterance(item["utterance"], RECORDED_AT), None
+            except Exception as e:
+                data, error = None, e
+            elapsed = time.perf_counter() - started
+            path = next((p for p in PATHS if gpt_parser.PARSE_REQUESTS.value(path=p) > before[p]), "error")
+            rows.append({"item": item, "data": data, "error": error, "elapsed": elapsed, "path": path})
+    return rows
+
+
+def report(gpt_parser, rows, tokens_before):
+    """結果を表示し、エラーの件数を返す。"""
+    total = len(rows)
+    errors = [r for r in rows if r["error"] is not None]
+    exact = sum(r["data"] is not None and {k: r["data"].get(k) for k in FIELDS} == r["item"]["expected"]
+                for r in rows)
+    print(f"calls={total} errors={len(errors)} exact_match={exact / total:.1%}")
+
+    print("\nper-field accuracy")
+    for field in FIELDS:
+        ok = sum(r["data"] is not None and r["data"].get(field) == r["item"]["expected"][field] for r in rows)
+        print(f"  {field:>14} {ok / total:>7.1%}")
+
+    print(f"\n{'path':>6} {'count':>6} {'p50[ms]':>9} {'p95[ms]':>9} {'p99[ms]':>9}")
+    for path in PATHS + ("error", "all"):
+        values = sorted(r["elapsed"] * 1000 for r in rows if path == "all" or r["path"] == path)
+        if not values:
+            continue
+        p50, p95, p99 = (_percentile(values, q) for q in (50, 95, 99))
+        print(f"{path:>6} {len(values):>6} {p50:>9.3f} {p95:>9.3f} {p99:>9.3f}")
+
+    llm_calls = sum(r["path"] == "llm" for r in rows)
+    if llm_calls:
+        mode = gpt_parser.PROMPT_MODE
+        tokens = {kind: gpt_parser.LLM_TOKENS.value(mode=mode, kind=kind) - tokens_before[kind]
+                  for kind in tokens_before}
+        print(f"\ntokens per llm call (prompt_mode={mode}): "
+              + " ".join(f"{kind}={value / llm_calls:.1f}" for kind, value in tokens.items()))
+
+    mismatches = [r for r in rows if r["data"] is not None
+                  and {k: r["data"].get(k) for k in FIELDS} != r["item"]["expected"]]
+    seen = set()
+    for r in mismatches + errors:
+        utterance = r["item"]["utterance"]
+        if utterance in seen:
+            continue
+        seen.add(utterance)
+        detail = r["error"] if r["error"] is not None else {
+            k: r["data"].get(k) for k in FIELDS if r["data"].get(k) != r["item"]["expected"][k]}
+        print(f"  miss [{r['path']}] {utterance} -> {detail}")
+    return len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parse_utterance のオフライン評価")
+    parser.add_argument("--mode", choices=["replay", "record", "seed", "stub"], default="replay")
+    parser.add_argument("--cassette", help="既定は benchmarks/cassettes/parser_<prompt-mode>.jsonl")
+    parser.add_argument("--prompt-mode", default=os.getenv("PROMPT_MODE", "full"))
+    parser.add_argument("--repeat", type=int, default=1, help="コーパスを繰り返す回数")
+    parser.add_argument("--no-rules", action="store_true", help="ルールベースを使わず全件 LLM（カセット）に回す")
+    parser.add_argument("--no-cache", action="store_true", help="発話ごとに解析結果キャッシュを空にする")
+    parser.add_argument("--replay-latency", type=float, default=1.0,
+                        help="replay で記録時の上流レイテンシに掛ける係数（0 で待たない）")
+    parser.add_argument("--seed-latency", type=float, default=0.8, help="seed で記録する上流レイテンシ（秒）")
+    parser.add_argument("--port", type=int, default=8768)
+    args = parser.parse_args()
+
+    # gpt_parser は import 時に PROMPT_MODE を読むので先に設定する
+    os.environ["PROMPT_MODE"] = args.prompt_mode
+    os.environ.setdefault("PARSE_CACHE_SHARED", "")
+    if args.mode in ("replay", "seed"):
+        # 再生では上流の流量制限がないので、ゲートウェイの間隔調整で待たない
+        os.environ.setdefault("LLM_RPM", "1000000")
+    cassette_path = args.cassette or os.path.join(HERE, "cassettes", f"parser_{args.prompt_mode}.jsonl")
+
+    stub = None
+    if args.mode == "stub":
+        from stub_llm_server import start_subprocess
+
+        stub = start_subprocess(args.port, 0.05)
+        os.environ["OPENAI_API_KEY"] = "stub"
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+
+    import gpt_parser
+    import llm_gateway
+
+    if args.mode == "replay":
+        client = CassetteClient(cassette_path, replay_latency=args.replay_latency)
+        llm_gateway.gateway.set_clients(client=client)
+    elif args.mode == "record":
+        client = CassetteClient(cassette_path, inner=llm_gateway.gateway.get_client())
+        llm_gateway.gateway.set_clients(client=client)
+    corpus = [item for item in load_corpus() if item["expected"] is not None]
+    if args.mode == "seed":
+        client = CassetteClient(cassette_path, inner=LabelClient(corpus, args.seed_latency))
+        llm_gateway.gateway.set_clients(client=client)
+    if args.no_rules:
+        gpt_parser.RULE_MIN_CONFIDENCE = float("inf")
+
+    tokens_before = {kind: gpt_parser.LLM_TOKENS.value(mode=args.prompt_mode, kind=kind)
+                     for kind in ("prompt", "cached", "completion")}
+    try:
+        rows = evaluate(gpt_parser, corpus, args.repeat, args.no_cache)
+    finally:
+        if stub is not None:
+            stub.terminate()
+
+    print(f"corpus={len(corpus)} x {args.repeat}  mode={args.mode} prompt_mode={args.prompt_mode} "
+          f"rules={'off' if args.no_rules else 'on'} cache={'off' if args.no_cache else 'on'}")
+    if args.mode != "stub":
+        seeded = sum(bool(entry.get("seeded")) for entry in client.entries.values())
+        print(f"cassette={os.path.relpath(cassette_path)} entries={len(client.entries)} seeded={seeded} "
+              f"recorded={client.recorded} replayed={client.replayed}")
+    if report(gpt_parser, rows, tokens_before):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+ベンチマーク用のローカル LLM スタブサーバー。
+
+OpenAI の Chat Completions API (/v1/chat/completions) と同じ形のレスポンスを、
+指定した遅延のあとで返す。OPENAI_BASE_URL をこのサーバーに向ければ、
+実際の API を呼ばずに gpt_parser や /ai_gpt の挙動・スループットを計測できる。
+
+"stream": true のリクエストには、遅延を文字ごとに分けて SSE でチャンクを返す。
+--fail-rate を指定すると、その割合のリクエストに 429（Retry-After 付き）を返す。
+呼び出し回数は GET /stats で取れる。
+/fetchtest の計測用に、jsonplaceholder の /users と同じ形の JSON を返す GET /users もある
+（/stats の connections は /users を呼んだクライアントの接続数 = 送信元ポートの種類）。
+--connect-delay を指定すると、新しい接続での最初の /users だけその分待たせる
+（リモートの API で接続ごとにかかる TCP / TLS ハンドシェイクの往復を模擬する）。
+
+単体で起動する場合:
+    python benchmarks/stub_llm_server.py --port 8765 --delay 0.2 --fail-rate 0.1 --connect-delay 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 発話に含まれるキーワードから、それらしい function_call の引数を作る
+_RULES = [
+    ("おしっこ", {"activity_type": "diaper", "diaper_type": "おしっこ"}),
+    ("うんち", {"activity_type": "diaper", "diaper_type": "うんち", "hardness": "普通", "diaper_amount": "普通"}),
+    ("起き", {"activity_type": "wake", "sleep_state": "wake"}),
+    ("寝", {"activity_type": "sleep", "sleep_state": "sleep"}),
+]
+
+
+def _fake_arguments(utterance: str) -> dict:
+    data = {
+        "activity_type": "feeding", "milktype": "ミルク", "volume": 100,
+        "diaper_type": "", "hardness": "", "diaper_amount": "", "sleep_state": "",
+        "timestamp": "2025-06-02T10:00:00Z",
+    }
+    for keyword, fields in _RULES:
+        if keyword in utterance:
+            data.update({"milktype": "", "volume": 0}, **fields)
+            break
+    return data
+
+
+def create_app(delay: float = 0.2, fail_rate: float = 0.0, connect_delay: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    app.state.delay = delay
+    app.state.connect_delay = connect_delay
+    app.state.fail_rate = fail_rate
+    app.state.calls = 0
+    app.state.rejected = 0
+    app.state.streams_cancelled = 0
+    app.state.user_calls = 0
+    app.state.client_ports = set()
+
+    @app.get("/stats")
+    async def stats():
+        return {"calls": app.state.calls, "rejected": app.state.rejected,
+                "streams_cancelled": app.state.streams_cancelled,
+                "user_calls": app.state.user_calls, "connections": len(app.state.client_ports)}
+
+    @app.get("/users")
+    async def users(request: Request):
+        app.state.user_calls += 1
+        delay = app.state.delay
+        if request.client.port not in app.state.client_ports:
+            app.state.client_ports.add(request.client.port)
+            delay += app.state.connect_delay
+        await asyncio.sleep(delay)
+        return [{"id": i, "name": f"User {i}", "username": f"user{i}", "email": f"user{i}@example.com",
+                 "address": {"city": "Tokyo", "zipcode": f"100-000{i % 10}"}} for i in range(1, 11)]
+
+    async def stream_chunks(model: str, text: str):
+        try:
+            for ch in text:
+                await asyncio.sleep(app.state.delay / len(text))
+                chunk = {
+                    "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": {"content": ch}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        except asyncio.CancelledError:
+            # クライアントが接続を閉じた（生成の打ち切り）
+            app.state.streams_cancelled += 1
+            raise
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        # 上流のレート制限を模擬する
+        if random.random() < app.state.fail_rate:
+            app.state.rejected += 1
+            return JSONResponse(
+                status_code=429, headers={"retry-after": "0.1"},
+                content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            )
+        if body.get("stream"):
+            text = "スタブの応答です。" * 5
+            return StreamingResponse(stream_chunks(body.get("model", "gpt-4o-mini"), text),
+                                     media_type="text/event-stream")
+
+        # 上流 LLM の生成時間を模擬する
+        await asyncio.sleep(app.state.delay)
+
+        utterance = body["messages"][-1]["content"]
+        message = {"role": "assistant", "content": None}
+        if body.get("functions"):
+            message["function_call"] = {
+                "name": body["functions"][0]["name"],
+                "arguments": json.dumps(_fake_arguments(utterance), ensure_ascii=False),
+            }
+        else:
+            message["content"] = "スタブの応答です。"
+
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+def start_subprocess(port: int, delay: float = 0.2, fail_rate: float = 0.0,
+                     connect_delay: float = 0.0) -> subprocess.Popen:
+    """
+    スタブサーバーを別プロセスで起動し、ポートが開くまで待ってから返す。
+    計測対象と GIL を取り合わないよう、スレッドではなくプロセスで動かす。
+    """
+    proc = subprocess.Popen(
+        [sys.executable, __file__, "--port", str(port), "--delay", str(delay), "--fail-rate", str(fail_rate),
+         "--connect-delay", str(connect_delay)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("スタブ LLM サーバーの起動を確認できませんでした。")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.2)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--connect-delay", type=float, default=0.0)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.delay, args.fail_rate, args.connect_delay), host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,122 @@
+import base64
+from datetime import datetime
+
+from sqlalchemy import and_, func, insert, literal_column, or_, select, union_all
+
+from db_control import partitions
+from db_control.mymodels_MySQL import ActivityLog
+from db_control.timeutil import to_db_time
+
+
+def parse_timestamp(parsed: dict, fallback: datetime) -> datetime:
+    """parsed の timestamp を datetime に変換する。不正な形式なら fallback を使う。"""
+    ts_str = parsed.get("timestamp")
+    try:
+        # 末尾に "Z" がついている場合、"+00:00" に置き換えてから fromisoformat で UTC として扱う
+        return datetime.fromisoformat(ts_str.replace("Z", "+00:00"))
+    except Exception:
+        # もし不正な形式なら、API に送られてきた recorded_at（リクエスト送信時刻）を使う
+        return fallback
+
+
+def to_row(parsed: dict, ts: datetime) -> dict:
+    """構造化済みの辞書を activity_logs の 1 行分の値に変換する。"""
+    return {
+        "activity_type": parsed.get("activity_type", ""),
+        "milktype":      parsed.get("milktype", ""),
+        "volume":        parsed.get("volume", 0),
+        "diaper_type":   parsed.get("diaper_type", ""),
+        "hardness":      parsed.get("hardness", ""),
+        "diaper_amount": parsed.get("diaper_amount", ""),
+        "sleep_state":   parsed.get("sleep_state", ""),
+        # タイムゾーン付きの時刻は DB_TIMEZONE 基準にそろえて保存する
+        "timestamp":     to_db_time(ts),
+        # created_at は server_default で自動設定
+    }
+
+
+def insert_logs(conn, rows):
+    """
+    activity_logs へ複数行をまとめて INSERT する（executemany の 1 文）。
+    conn は Connection / Session のどちらでもよい。トランザクション制御は呼び出し側で行う。
+    SQLite の月ごとのテーブル（partitions）では、timestamp の月のテーブルに振り分ける。
+    """
+    if not rows:
+        return
+    if partitions.mode(conn) == "tables":
+        partitions.insert_rows(conn, rows)
+        return
+    conn.execute(insert(ActivityLog), rows)
+
+
+def encode_cursor(ts: datetime, log_id: int) -> str:
+    """キーセットページング用のカーソル（最後に返した行の timestamp と id）を文字列にする。"""
+    raw = f"{ts.isoformat()}|{log_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """encode_cursor の逆変換。不正な値は ValueError。"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts_str, id_str = raw.split("|")
+        return datetime.fromisoformat(ts_str), int(id_str)
+    except Exception:
+        raise ValueError("cursor が不正です")
+
+
+def _conditions(table, start, end, types, after):
+    conditions = [table.c.timestamp >= start, table.c.timestamp < end]
+    if types:
+        conditions.append(table.c.activity_type.in_(types))
+    if after is not None:
+        after_ts, after_id = after
+        # OFFSET を使わず、前ページ最後の行から続きを読む
+        conditions.append(table.c.timestamp >= after_ts)
+        conditions.append(or_(
+            table.c.timestamp > after_ts,
+            and_(table.c.timestamp == after_ts, table.c.id > after_id),
+        ))
+    return conditions
+
+
+def logs_query(start: datetime, end: datetime, types=None, after=None, limit: int = None, tables=None):
+    """
+    timestamp が [start, end) に入るログを (timestamp, id) 順に取得する SELECT 文を作る。
+    start / end は DB 基準の naive datetime（timeutil.day_range などで作る）。
+    types: activity_type の絞り込み（None なら全種別）
+    after: (timestamp, id)。この行より後ろだけを返す（キーセットページング）
+    limit: 取得件数の上限
+    tables: 読むテーブル（partitions.log_tables の結果）。省略時は activity_logs だけ。
+            複数なら UNION ALL でつなぎ、全体を (timestamp, id) 順に並べる
+    """
+    tables = tables or [ActivityLog.__table__]
+    if len(tables) == 1:
+        table = tables[0]
+        stmt = (
+            select(table)
+            .where(*_conditions(table, start, end, types, after))
+            .order_by(table.c.timestamp, table.c.id)
+        )
+    else:
+        stmt = union_all(*[select(t).where(*_conditions(t, start, end, types, after)) for t in tables])
+        stmt = stmt.order_by(literal_column("timestamp"), literal_column("id"))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def select_logs(conn, start: datetime, end: datetime, types=None, after=None, limit: int = None,
+                execution_options=None):
+    """logs_query の条件でログを取得する。[start, end) に重なるパーティションだけを読む。"""
+    # ページングの続きなら、カーソルより前の月は読まない
+    tables = partitions.log_tables(conn, max(start, after[0]) if after is not None else start, end)
+    stmt = logs_query(start, end, types, after, limit, tables)
+    return conn.execute(stmt, execution_options=execution_options or {})
+
+
+def oldest_timestamp(conn):
+    """最も古いログの timestamp。ログがなければ None。"""
+    tables = partitions.log_tables(conn)
+    return min(filter(None, (conn.execute(select(func.min(t.c.timestamp))).scalar() for t in tables)),
+               default=None)
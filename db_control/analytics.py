@@ -0,0 +1,260 @@
+"""
+購入データ（purchases / purchase_details / items）の集計。
+
+どの集計も 1 本の集約 SQL（JOIN + GROUP BY）で DB 側に計算させ、結果の行だけを受け取る。
+売上は 数量 × items.price（現在の価格）で計算する。purchase_date は YYYY-MM-DD の文字列。
+
+- revenue_per_customer: 顧客ごとの購入回数・数量・売上（売上の多い順）
+- top_items: 商品ごとの数量・売上（売上の多い順）
+- purchases_per_day: 日ごとの購入回数・数量・売上
+
+集計テーブル（daily_purchase_summary / daily_item_sales）を refresh_rollup で作っておくと、
+top_items と purchases_per_day は集計済みの範囲（集計テーブルの最初の日〜最後の日）をそこから読み、
+範囲外の日だけを明細から計算して足す（集計テーブルが無ければすべて明細から計算する）。
+refresh_rollup は集計済みの範囲と離れた期間を指定されたら、間の日も集計して範囲を連続させる。集計済みの日に後から明細が追加・変更された場合は、次の refresh_rollup
+（直近 ANALYTICS_REFRESH_LOOKBACK_DAYS 日を作り直す）か、期間を指定した作り直しまで反映されない。
+集計済みの売上は集計した時点の価格で固定される（items.price を変えたら期間を指定して作り直す）。
+
+    python -m db_control.analytics refresh                              # 前回の続きから
+    python -m db_control.analytics refresh --from 2025-01-01 --to 2025-06-30
+
+    ANALYTICS_USE_ROLLUP             auto（既定。集計テーブルがあれば使う）/ 0（常に明細から計算）
+    ANALYTICS_REFRESH_LOOKBACK_DAYS  refresh で最後に集計した日から遡って作り直す日数（既定 2）
+"""
+import argparse
+import os
+from datetime import date, timedelta
+from decimal import Decimal
+
+from sqlalchemy import delete, func, insert, inspect, literal_column, or_, select, union_all
+
+from db_control.mymodels_MySQL import (Customers, DailyItemSales, DailyPurchaseSummary, Items, PurchaseDetails,
+                                       Purchases)
+
+ANALYTICS_USE_ROLLUP = os.getenv("ANALYTICS_USE_ROLLUP", "auto")
+ANALYTICS_REFRESH_LOOKBACK_DAYS = int(os.getenv("ANALYTICS_REFRESH_LOOKBACK_DAYS", "2"))
+
+purchases = Purchases.__table__
+details = PurchaseDetails.__table__
+items = Items.__table__
+customers = Customers.__table__
+daily = DailyPurchaseSummary.__table__
+item_sales = DailyItemSales.__table__
+
+# 明細 1 行の売上
+LINE_REVENUE = details.c.quantity * items.c.price
+
+
+def _lines():
+    """購入・明細・商品を結合した FROM 句。"""
+    return (purchases
+            .join(details, details.c.purchase_id == purchases.c.purchase_id)
+            .join(items, items.c.item_id == details.c.item_id))
+
+
+def _between(column, first: date = None, last: date = None):
+    """[first, last] の条件（YYYY-MM-DD の文字列として比較する）。"""
+    conditions = []
+    if first is not None:
+        conditions.append(column >= first.isoformat())
+    if last is not None:
+        conditions.append(column <= last.isoformat())
+    return conditions
+
+
+def _as_dict(row) -> dict:
+    # MySQL の SUM は DECIMAL で返るので、JSON にしやすいよう整数にそろえる
+    return {k: int(v) if isinstance(v, Decimal) else v for k, v in row.items()}
+
+
+def watermark(conn):
+    """
+    集計テーブルで集計済みの範囲 (最初の日, 最後の日)（YYYY-MM-DD）。まだ集計していなければ None。
+    範囲の外（購入のない日）まで集計していても、明細から計算すれば同じ結果になるので問題ない。
+    """
+    low, high = conn.execute(select(func.min(daily.c.purchase_date), func.max(daily.c.purchase_date))).one()
+    return None if high is None else (low, high)
+
+
+def _rollup_watermark(conn, use_rollup):
+    if use_rollup is None:
+        use_rollup = ANALYTICS_USE_ROLLUP != "0"
+    if not use_rollup:
+        return None
+    # 集計テーブルを作っていない DB では明細から計算する
+    inspector = inspect(conn)
+    if not all(inspector.has_table(t.name) for t in (daily, item_sales)):
+        return None
+    return watermark(conn)
+
+
+def _rolled(column, mark):
+    """集計済みの範囲 [low, high] の条件。"""
+    return [column >= mark[0], column <= mark[1]]
+
+
+def _live(column, mark):
+    """集計済みの範囲の外の条件。"""
+    return or_(column < mark[0], column > mark[1])
+
+
+def revenue_per_customer(conn, first: date = None, last: date = None, customer_id: str = None, limit: int = 10):
+    """[first, last] の顧客ごとの購入回数・数量・売上を、売上の多い順に limit 件返す。"""
+    revenue = func.sum(LINE_REVENUE).label("revenue")
+    conditions = _between(purchases.c.purchase_date, first, last)
+    if customer_id is not None:
+        conditions.append(purchases.c.customer_id == customer_id)
+    # 集約してから顧客名を結合する（GROUP BY に名前を含めない）
+    ranked = (
+        select(
+            purchases.c.customer_id,
+            func.count(func.distinct(purchases.c.purchase_id)).label("purchase_count"),
+            func.sum(details.c.quantity).label("quantity"),
+            revenue,
+        )
+        .select_from(_lines())
+        .where(*conditions)
+        .group_by(purchases.c.customer_id)
+        .order_by(revenue.desc(), purchases.c.customer_id)
+        .limit(limit)
+        .subquery()
+    )
+    query = (
+        select(ranked.c.customer_id, customers.c.customer_name, ranked.c.purchase_count, ranked.c.quantity,
+               ranked.c.revenue)
+        .select_from(ranked.outerjoin(customers, customers.c.customer_id == ranked.c.customer_id))
+        .order_by(ranked.c.revenue.desc(), ranked.c.customer_id)
+    )
+    return [_as_dict(r) for r in conn.execute(query).mappings()]
+
+
+def _item_lines(first, last, mark):
+    """商品ごとに集計する元の行（集計済みの範囲は daily_item_sales、範囲外は明細）。"""
+    live = (
+        select(details.c.item_id, details.c.quantity, LINE_REVENUE.label("revenue"))
+        .select_from(_lines())
+        .where(*_between(purchases.c.purchase_date, first, last))
+    )
+    if mark is None:
+        return live.subquery()
+    rolled = (
+        select(item_sales.c.item_id, item_sales.c.quantity, item_sales.c.revenue)
+        .where(*_between(item_sales.c.purchase_date, first, last), *_rolled(item_sales.c.purchase_date, mark))
+    )
+    return union_all(rolled, live.where(_live(purchases.c.purchase_date, mark))).subquery()
+
+
+def top_items(conn, first: date = None, last: date = None, limit: int = 10, use_rollup: bool = None):
+    """[first, last] の商品ごとの数量・売上を、売上の多い順に limit 件返す。"""
+    lines = _item_lines(first, last, _rollup_watermark(conn, use_rollup))
+    revenue = func.sum(lines.c.revenue).label("revenue")
+    ranked = (
+        select(lines.c.item_id, func.sum(lines.c.quantity).label("quantity"), revenue)
+        .group_by(lines.c.item_id)
+        .order_by(revenue.desc(), lines.c.item_id)
+        .limit(limit)
+        .subquery()
+    )
+    query = (
+        select(ranked.c.item_id, items.c.item_name, ranked.c.quantity, ranked.c.revenue)
+        .select_from(ranked.outerjoin(items, items.c.item_id == ranked.c.item_id))
+        .order_by(ranked.c.revenue.desc(), ranked.c.item_id)
+    )
+    return [_as_dict(r) for r in conn.execute(query).mappings()]
+
+
+def _daily_query(first, last):
+    """明細から日ごとの購入回数・数量・売上を集計する SELECT。"""
+    return (
+        select(
+            purchases.c.purchase_date,
+            func.count(func.distinct(purchases.c.purchase_id)).label("purchase_count"),
+            func.sum(details.c.quantity).label("quantity"),
+            func.sum(LINE_REVENUE).label("revenue"),
+        )
+        .select_from(_lines())
+        .where(*_between(purchases.c.purchase_date, first, last))
+        .group_by(purchases.c.purchase_date)
+    )
+
+
+def purchases_per_day(conn, first: date = None, last: date = None, use_rollup: bool = None):
+    """[first, last] の日ごとの購入回数・数量・売上を日付順に返す（購入のない日は含めない）。"""
+    mark = _rollup_watermark(conn, use_rollup)
+    query = _daily_query(first, last)
+    if mark is not None:
+        rolled = (
+            select(daily.c.purchase_date, daily.c.purchase_count, daily.c.quantity, daily.c.revenue)
+            .where(*_between(daily.c.purchase_date, first, last), *_rolled(daily.c.purchase_date, mark))
+        )
+        query = union_all(rolled, query.where(_live(purchases.c.purchase_date, mark)))
+    rows = conn.execute(query.order_by(literal_column("purchase_date"))).mappings()
+    return [_as_dict(r) for r in rows]
+
+
+def refresh_rollup(conn, first: date = None, last: date = None) -> int:
+    """
+    集計テーブルの [first, last] を明細から作り直し、集計した日数を返す。
+    first を省略すると最後に集計した日の ANALYTICS_REFRESH_LOOKBACK_DAYS 日前から
+    （一度も集計していなければ最古の購入日から）、last を省略すると最新の購入日まで。
+    集計済みの範囲と離れていれば、間の日も含めるよう [first, last] を広げる。
+    DELETE と INSERT ... SELECT だけで済ませ、明細をアプリケーションに読み込まない。
+    """
+    mark = watermark(conn)
+    if last is None:
+        newest = conn.execute(select(func.max(purchases.c.purchase_date))).scalar()
+        if newest is None:
+            return 0
+        last = date.fromisoformat(newest)
+    if first is None:
+        if mark is not None:
+            first = date.fromisoformat(mark[1]) - timedelta(days=ANALYTICS_REFRESH_LOOKBACK_DAYS)
+        else:
+            oldest = conn.execute(select(func.min(purchases.c.purchase_date))).scalar()
+            if oldest is None:
+                return 0
+            first = date.fromisoformat(oldest)
+    if last < first:
+        return 0
+    if mark is not None:
+        # 集計済みの範囲に穴を作らない（穴の日は集計テーブルから読まれ、0 件に見えてしまう）
+        first = min(first, date.fromisoformat(mark[1]) + timedelta(days=1))
+        last = max(last, date.fromisoformat(mark[0]) - timedelta(days=1))
+
+    for table in (daily, item_sales):
+        conn.execute(delete(table).where(*_between(table.c.purchase_date, first, last)))
+    days = conn.execute(insert(daily).from_select(
+        ["purchase_date", "purchase_count", "quantity", "revenue"], _daily_query(first, last))).rowcount
+    conn.execute(insert(item_sales).from_select(
+        ["purchase_date", "item_id", "quantity", "revenue"],
+        select(purchases.c.purchase_date, details.c.item_id, func.sum(details.c.quantity),
+               func.sum(LINE_REVENUE))
+        .select_from(_lines())
+        .where(*_between(purchases.c.purchase_date, first, last))
+        .group_by(purchases.c.purchase_date, details.c.item_id)))
+    return days
+
+
+def main():
+    parser = argparse.ArgumentParser(description="購入の集計テーブルの更新")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("refresh", help="daily_purchase_summary / daily_item_sales を差分更新する")
+    p.add_argument("--from", dest="first", help="開始日 YYYY-MM-DD（省略時は前回の続きから）")
+    p.add_argument("--to", dest="last", help="終了日 YYYY-MM-DD（省略時は最新の購入日）")
+    args = parser.parse_args()
+
+    from db_control.connect_MySQL import get_engine
+
+    engine = get_engine()
+    for table in (daily, item_sales):
+        table.create(engine, checkfirst=True)
+    first = date.fromisoformat(args.first) if args.first else None
+    last = date.fromisoformat(args.last) if args.last else None
+    with engine.begin() as conn:
+        n = refresh_rollup(conn, first, last)
+        mark = watermark(conn)
+    print(f"refreshed {n} days (rolled up {mark[0]} .. {mark[1]})" if mark else f"refreshed {n} days")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,4 +10,8 @@ print("platform:", platform.uname())
 main_path = os.path.dirname(os.path.abspath(__file__))
 path = os.chdir(main_path)
 print("path:", path)
-engine = create_engine("sqlite:///CRM.db", echo=True)
+from db_control import instrumentation
+
+# SQL ログは DB_ECHO=true のときだけ出す（計測は instrumentation のメトリクスで行う）
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+engine = instrumentation.instrument(create_engine("sqlite:///CRM.db", echo=DB_ECHO))
@@ -1,8 +1,17 @@
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
+import metrics
+import tracing
+from db_control import instrumentation
+
 # 環境変数の読み込み
 load_dotenv()
 
@@ -15,27 +24,119 @@ DB_NAME = os.getenv('DB_NAME')
 
 
 
-# MySQLのURL構築
-DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# MySQLのURL構築（DATABASE_URL が指定されていればそちらを優先。ローカル検証やベンチマーク用）
+DATABASE_URL = os.getenv('DATABASE_URL') or f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 SSL_CA_PATH = os.getenv('SSL_CA_PATH')
-# エンジンの作成
-engine = create_engine(
-    DATABASE_URL,
-    echo=True,
-    pool_pre_ping=True,
-    pool_recycle=3600,
-    connect_args={
-        "ssl_ca": SSL_CA_PATH
+
+# コネクションプールの設定（負荷に合わせて環境変数で調整する）
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))
+# pre-ping はチェックアウトのたびに 1 往復増える。DB_POOL_RECYCLE をサーバーの
+# wait_timeout より短くしていれば無効化してよい
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+# SQL と引数をすべて標準出力に書く（ローカルでのデバッグ用）。本番では
+# db_control.instrumentation のメトリクスと遅いクエリのログを使う
+DB_ECHO = os.getenv('DB_ECHO', 'false').lower() in ('1', 'true', 'yes')
+
+POOL_WAIT = metrics.histogram(
+    "db_pool_checkout_wait_seconds", "コネクションプールからの取得待ち時間（新規接続を含む）")
+POOL_TIMEOUTS = metrics.counter(
+    "db_pool_checkout_timeouts_total", "DB_POOL_TIMEOUT 内に接続を取得できなかった回数")
+
+
+class InstrumentedQueuePool(QueuePool):
+    """チェックアウトにかかった時間を計測する QueuePool。"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            ended = time.perf_counter()
+            POOL_WAIT.observe(ended - started)
+            tracing.add_span("db.checkout", started, ended)
+
+
+# エンジンは最初に使われたときに作る（import 時に接続設定や SSL 証明書の読み込みを行わない）
+_engine = None
+_engine_lock = threading.Lock()
+
+# アプリ全体で共有するセッションファクトリ（get_engine() の初回呼び出しでエンジンに紐づける）
+SessionLocal = sessionmaker(autoflush=False, autocommit=False)
+
+
+def get_engine():
+    """共有のエンジンを返す。初回呼び出し時に作成する。"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(
+                    DATABASE_URL,
+                    echo=DB_ECHO,
+                    poolclass=InstrumentedQueuePool,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                    pool_pre_ping=DB_POOL_PRE_PING,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    # SSL 証明書は MySQL 接続のときだけ渡す
+                    connect_args={
+                        "ssl_ca": SSL_CA_PATH
+                    } if DATABASE_URL.startswith("mysql") else {}
+                )
+                instrumentation.instrument(_engine)
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def new_session():
+    """共有のセッションファクトリからセッションを作る。"""
+    get_engine()
+    return SessionLocal()
+
+
+def __getattr__(name):
+    # 従来どおり `from db_control.connect_MySQL import engine` でも使えるようにする
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(name)
+
+
+def get_db():
+    """FastAPI の Depends 用。リクエストごとにセッションを 1 つ作り、終了時に必ず閉じる。"""
+    session = new_session()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def pool_status():
+    """コネクションプールの使用状況とチェックアウト待ち時間を返す。"""
+    pool = get_engine().pool
+    capacity = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    checked_out = pool.checkedout()
+    p50 = POOL_WAIT.quantile(0.5)
+    p95 = POOL_WAIT.quantile(0.95)
+    wait = (POOL_WAIT.snapshot() or [{}])[0]
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "utilization": checked_out / capacity if capacity else 0.0,
+        "checkouts": wait.get("count", 0),
+        "wait_p50_ms": p50 * 1000 if p50 is not None else None,
+        "wait_p95_ms": p95 * 1000 if p95 is not None else None,
+        "wait_max_ms": wait.get("max", 0.0) * 1000,
+        "timeouts": POOL_TIMEOUTS.value(),
     }
-)
-
-print("----- ✅ 環境変数の読み込み確認 -----")
-print("DB_USER:", DB_USER)
-print("DB_PASSWORD:", "(非表示)" if DB_PASSWORD else "None")
-print("DB_HOST:", DB_HOST)
-print("DB_PORT:", DB_PORT)
-print("DB_NAME:", DB_NAME)
-print("SSL_CA_PATH:", SSL_CA_PATH)
-print("DATABASE_URL:", DATABASE_URL)
-print("----------------------------------")
+
@@ -1,9 +1,9 @@
 import os
 from pathlib import Path
 from sqlalchemy import inspect
-from sqlalchemy.orm import sessionmaker
 from db_control.mymodels_MySQL import Base, Customers
 from db_control.connect_MySQL import engine
+from db_control import customer_import
 
 
 def init_db():
@@ -26,26 +26,38 @@ def init_db():
             raise
     else:
         print("Tables already exist.")
+        # 後から追加したテーブルだけを作成する（既存テーブルはそのまま）
+        Base.metadata.create_all(bind=engine, checkfirst=True)
+
+    ensure_indexes()
+
+
+def ensure_indexes():
+    """モデルに定義されたインデックスのうち、既存テーブルに無いものを作成する。"""
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"Creating index {index.name} >>> ")
+                index.create(bind=engine)
 
 # ここにインサート処理を追加！
 def insert_sample_data():
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
+    # 一括取り込みと同じ upsert で入れるので、何度実行しても一意制約違反にならない
     customers = [
-        Customers(customer_id="C1111", customer_name="ああさん", age=6, gender="男"),
-        Customers(customer_id="C110", customer_name="桃太郎さん", age=30, gender="女"),
+        {"customer_id": "C1111", "customer_name": "ああさん", "age": 6, "gender": "男"},
+        {"customer_id": "C110", "customer_name": "桃太郎さん", "age": 30, "gender": "女"},
     ]
 
     try:
-        session.add_all(customers)
-        session.commit()
-        print("Sample data inserted!")
+        result = customer_import.import_rows(enumerate(customers, 1), engine=engine)
+        print(f"Sample data inserted! ({result['upserted']} rows)")
     except Exception as e:
         print(f"Error inserting data: {e}")
-        session.rollback()
-    finally:
-        session.close()
 
 if __name__ == "__main__":
     init_db()
@@ -1,123 +1,132 @@
-# uname() error回避
-import platform
-print("platform", platform.uname())
-
-
 from sqlalchemy import create_engine, insert, delete, update, select
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker
-import json
-import pandas as pd
-from db_control.connect_MySQL import engine
+from contextlib import contextmanager
+from db_control.connect_MySQL import get_engine, new_session
 #from db_control.mymodels import Customers
 from db_control.mymodels_MySQL import Customers
 
-def myinsert(mymodel, values):
-    # session構築
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    query = insert(mymodel).values(values)
-    try:
-        # トランザクションを開始
-        with session.begin():
-            # データの挿入
-            result = session.execute(query)
-    except sqlalchemy.exc.IntegrityError:
-        print("一意制約違反により、挿入に失敗しました")
-        session.rollback()
-
-    # セッションを閉じる
-    session.close()
-    return "inserted"
-
 
-def myselect(mymodel, customer_id):
-    # session構築
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    query = session.query(mymodel).filter(mymodel.customer_id == customer_id)
-    try:
-        # トランザクションを開始
-        with session.begin():
-            result = query.all()
-        # 結果をオブジェクトから辞書に変換し、リストに追加
-        result_dict_list = []
-        for customer_info in result:
-            result_dict_list.append({
-                "customer_id": customer_info.customer_id,
-                "customer_name": customer_info.customer_name,
-                "age": customer_info.age,
-                "gender": customer_info.gender
-            })
-        # リストをJSONに変換
-        result_json = json.dumps(result_dict_list, ensure_ascii=False)
-    except sqlalchemy.exc.IntegrityError:
-        print("一意制約違反により、挿入に失敗しました")
-
-    # セッションを閉じる
-    session.close()
-    return result_json
-
-
-def myselectAll(mymodel):
-    # session構築
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    query = select(mymodel)
+@contextmanager
+def session_scope(session=None):
+    """
+    リクエストのセッション（get_db）が渡されればそれを使い、
+    なければ共有のセッションファクトリから作って最後に閉じる。
+    """
+    if session is not None:
+        yield session
+        return
+    session = new_session()
     try:
+        yield session
+    finally:
+        session.close()
+
+def _returning(session, kind):
+    """この DB が INSERT / UPDATE ... RETURNING に対応しているか（SQLite 3.35+ や MariaDB など）。"""
+    dialect = session.get_bind().dialect
+    return dialect.insert_returning if kind == "insert" else dialect.update_returning
+
+
+def myinsert(mymodel, values, session=None):
+    """
+    1 行 INSERT し、挿入した行を辞書で返す。一意制約違反なら None。
+    RETURNING が使える DB ではその結果を、使えない DB（MySQL）では挿入した値をそのまま返すので、
+    追加の SELECT は発生しない。
+    """
+    table = mymodel.__table__
+    query = insert(table).values(values)
+    with session_scope(session) as session:
+        use_returning = _returning(session, "insert")
+        if use_returning:
+            query = query.returning(*table.columns)
+        try:
+            # トランザクションを開始
+            with session.begin():
+                # データの挿入
+                result = session.execute(query)
+                row = dict(result.mappings().one()) if use_returning else dict(values)
+        except sqlalchemy.exc.IntegrityError:
+            print("一意制約違反により、挿入に失敗しました")
+            return None
+    return row
+
+
+def myselect(mymodel, customer_id, session=None):
+    """customer_id で 1 行取得し、辞書で返す。見つからなければ None。"""
+    table = mymodel.__table__
+    query = select(table).where(table.c.customer_id == customer_id)
+    with session_scope(session) as session:
         # トランザクションを開始
         with session.begin():
-            df = pd.read_sql_query(query, con=engine)
-            result_json = df.to_json(orient='records', force_ascii=False)
-
-    except sqlalchemy.exc.IntegrityError:
-        print("一意制約違反により、挿入に失敗しました")
-        result_json = None
-
-    # セッションを閉じる
-    session.close()
-    return result_json
-
-
-def myupdate(mymodel, values):
-    # session構築
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
+            row = session.execute(query).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def myselectAll(mymodel, after=None, limit=None, chunk_size=500):
+    """
+    全行を customer_id 順に、chunk_size 行ずつの辞書のリストとして順に返すジェネレーター。
+    サーバーサイドカーソルで読むので、テーブル全体をメモリに載せない。
+    after: この customer_id より後ろから返す（ページング用）
+    limit: 返す行数の上限
+
+    レスポンスの送信中に読み進めるため、リクエストのセッションではなく専用の接続を使う。
+    """
+    table = mymodel.__table__
+    query = select(table).order_by(table.c.customer_id)
+    if after is not None:
+        query = query.where(table.c.customer_id > after)
+    if limit is not None:
+        query = query.limit(limit)
+
+    with get_engine().connect() as conn:
+        result = conn.execute(query, execution_options={"stream_results": True, "yield_per": chunk_size})
+        for rows in result.mappings().partitions():
+            yield [dict(r) for r in rows]
+
+
+def myupdate(mymodel, values, session=None):
+    """
+    customer_id の行を更新し、更新後の行を辞書で返す。該当行がなければ None。
+    RETURNING が使えない DB（MySQL）では、更新件数で存在を確認して更新後の値を組み立てる。
+    """
+    table = mymodel.__table__
+    values = dict(values)
     customer_id = values.pop("customer_id")
 
     query = (
-        update(mymodel)
-        .where(mymodel.customer_id == customer_id)
+        update(table)
+        .where(table.c.customer_id == customer_id)
         .values(**values)
     )
 
-    try:
+    with session_scope(session) as session:
+        use_returning = _returning(session, "update")
+        if use_returning:
+            query = query.returning(*table.columns)
+        try:
+            # トランザクションを開始
+            with session.begin():
+                result = session.execute(query)
+                if use_returning:
+                    row = result.mappings().first()
+                    row = dict(row) if row is not None else None
+                elif result.rowcount:
+                    # MySQL の rowcount は一致した行数（CLIENT_FOUND_ROWS）なので、値が同じでも 1 になる
+                    row = {"customer_id": customer_id, **values}
+                else:
+                    row = None
+        except sqlalchemy.exc.IntegrityError:
+            print("一意制約違反により、更新に失敗しました")
+            return None
+    return row
+
+
+def mydelete(mymodel, customer_id, session=None):
+    """customer_id の行を削除する。削除できたら True、該当行がなければ False。"""
+    table = mymodel.__table__
+    query = delete(table).where(table.c.customer_id == customer_id)
+    with session_scope(session) as session:
         # トランザクションを開始
         with session.begin():
             result = session.execute(query)
-    except sqlalchemy.exc.IntegrityError:
-        print("一意制約違反により、挿入に失敗しました")
-        session.rollback()
-    # セッションを閉じる
-    session.close()
-    return "put"
-
-
-def mydelete(mymodel, customer_id):
-    # session構築
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    query = delete(mymodel).where(mymodel.customer_id == customer_id)
-    try:
-        # トランザクションを開始
-        with session.begin():
-            result = session.execute(query)
-    except sqlalchemy.exc.IntegrityError:
-        print("一意制約違反により、挿入に失敗しました")
-        session.rollback()
-
-    # セッションを閉じる
-    session.close()
-    return customer_id + " is deleted"
\ No newline at end of file
+    return result.rowcount > 0
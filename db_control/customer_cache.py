@@ -0,0 +1,149 @@
+"""
+customers の 1 件取得（customer_id で引く）の読み通しキャッシュ。
+
+顧客データはめったに変わらないので、読み出しは TieredCache（プロセス内 LRU + 任意の共有層）から返し、
+見つからなかったときだけ DB に問い合わせて結果を載せる。
+- 存在しない customer_id も短い TTL で覚えておき、404 の繰り返しで DB を叩かない（ネガティブキャッシュ）
+- 同じ customer_id のキャッシュミスが同時に来たら、DB へは 1 回だけ問い合わせて残りはその結果を使う
+- 登録・更新・削除ではその customer_id のエントリを書き換える（削除はネガティブエントリにする）。
+  書き込みと読み込みは同じキーのロックを取るので、更新前の行を後からキャッシュに載せることはない
+
+他のワーカーのプロセス内キャッシュは書き換わらないため、ワーカー間で古い値が見える期間は
+最大 CUSTOMER_CACHE_TTL 秒になる（共有層 CUSTOMER_CACHE_SHARED は書き込みと同時に更新される）。
+
+    CUSTOMER_CACHE_SIZE          プロセス内に持つ件数（既定 10000、0 でキャッシュしない）
+    CUSTOMER_CACHE_TTL           見つかった行を持つ秒数（既定 60）
+    CUSTOMER_CACHE_NEGATIVE_TTL  見つからなかったことを持つ秒数（既定 10）
+    CUSTOMER_CACHE_SHARED        共有層（未設定なら使わない / "db" / SQLAlchemy の URL）
+"""
+import os
+import threading
+import time
+import weakref
+
+import metrics
+from db_control import crud
+from db_control.mymodels_MySQL import Customers
+from ttl_cache import MISSING, TieredCache, build_shared_tier
+
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", "10000"))
+CUSTOMER_CACHE_TTL = float(os.getenv("CUSTOMER_CACHE_TTL", "60"))
+CUSTOMER_CACHE_NEGATIVE_TTL = float(os.getenv("CUSTOMER_CACHE_NEGATIVE_TTL", "10"))
+
+LOOKUPS = metrics.counter(
+    "customer_cache_lookups_total",
+    "customer_id での取得件数（result=hit/negative_hit/miss/coalesced）",
+    ["result"])
+LOAD_LATENCY = metrics.histogram("customer_cache_load_seconds", "キャッシュミス時の DB 取得時間")
+
+cache = TieredCache(
+    "customers",
+    maxsize=CUSTOMER_CACHE_SIZE,
+    ttl=CUSTOMER_CACHE_TTL,
+    shared=build_shared_tier(os.getenv("CUSTOMER_CACHE_SHARED", ""), "customers", CUSTOMER_CACHE_TTL),
+)
+
+# customer_id ごとのロック（使っている間だけ残る）
+_locks = weakref.WeakValueDictionary()
+_locks_guard = threading.Lock()
+
+
+def _lock(customer_id) -> threading.Lock:
+    with _locks_guard:
+        lock = _locks.get(customer_id)
+        if lock is None:
+            lock = _locks[customer_id] = threading.Lock()
+        return lock
+
+
+def _store(customer_id, row):
+    """取得・更新した行をキャッシュに載せる。row が None なら見つからなかったことを短い TTL で覚える。"""
+    if CUSTOMER_CACHE_SIZE <= 0:
+        return
+    cache.set(customer_id, row, None if row is not None else CUSTOMER_CACHE_NEGATIVE_TTL)
+
+
+def get_customer(customer_id, session=None):
+    """customer_id の行を辞書で返す。なければ None。"""
+    if CUSTOMER_CACHE_SIZE <= 0:
+        return crud.myselect(Customers, customer_id, session=session)
+
+    row = cache.get(customer_id)
+    if row is not MISSING:
+        LOOKUPS.inc(result="hit" if row is not None else "negative_hit")
+        return row
+
+    with _lock(customer_id):
+        # ロックを待つ間に別のスレッドが読み込んでいれば、それを使う
+        row = cache.get(customer_id)
+        if row is not MISSING:
+            LOOKUPS.inc(result="coalesced")
+            return row
+        LOOKUPS.inc(result="miss")
+        started = time.perf_counter()
+        row = crud.myselect(Customers, customer_id, session=session)
+        LOAD_LATENCY.observe(time.perf_counter() - started)
+        _store(customer_id, row)
+    return row
+
+
+def create_customer(values: dict, session=None):
+    """
+    1 件登録し、登録した行を返す。登録済み（一意制約違反）なら None。
+    登録できた行でネガティブエントリを上書きする。
+    """
+    customer_id = values.get("customer_id")
+    with _lock(customer_id):
+        row = crud.myinsert(Customers, values, session=session)
+        if row is not None:
+            _store(customer_id, row)
+        else:
+            # 既に行がある。ネガティブエントリが残っていれば消して、次の読み込みで取り直す
+            cache.delete(customer_id)
+    return row
+
+
+def update_customer(values: dict, session=None):
+    """customer_id の行を更新し、更新後の行を返す。該当行がなければ None。"""
+    customer_id = values.get("customer_id")
+    with _lock(customer_id):
+        row = crud.myupdate(Customers, values, session=session)
+        if row is not None:
+            _store(customer_id, row)
+        else:
+            # 行がない・一意制約違反のどちらでも、キャッシュの内容は信用せず次の読み込みで取り直す
+            cache.delete(customer_id)
+    return row
+
+
+def delete_customer(customer_id, session=None) -> bool:
+    """customer_id の行を削除する。削除できたら True。"""
+    with _lock(customer_id):
+        deleted = crud.mydelete(Customers, customer_id, session=session)
+        _store(customer_id, None)
+    return deleted
+
+
+def invalidate(customer_ids):
+    """
+    一括取り込みなど、このモジュールを通さずに書き換えた customer_id のエントリを消す。
+    キーのロックは取らないので、書き込みの直前に読み込んだ古い行が最大 CUSTOMER_CACHE_TTL 秒残ることがある。
+    """
+    if CUSTOMER_CACHE_SIZE > 0:
+        cache.delete_many(customer_ids)
+
+
+def stats():
+    """ヒット率（ネガティブヒットと相乗りを含む）と、キャッシュの状態を返す。"""
+    counts = {result: LOOKUPS.value(result=result) for result in ("hit", "negative_hit", "miss", "coalesced")}
+    total = sum(counts.values())
+    p50 = LOAD_LATENCY.quantile(0.5)
+    p99 = LOAD_LATENCY.quantile(0.99)
+    return {
+        **counts,
+        "lookups": total,
+        "hit_ratio": (total - counts["miss"]) / total if total else 0.0,
+        "load_p50_ms": p50 * 1000 if p50 is not None else None,
+        "load_p99_ms": p99 * 1000 if p99 is not None else None,
+        "cache": cache.stats(),
+    }
@@ -0,0 +1,294 @@
+"""
+customers の一括取り込み（CSV / NDJSON）。
+
+1 行ずつ POST /customers を呼ぶ代わりに、ファイル（またはアップロードされた本文）を先頭から読みながら
+CUSTOMER_IMPORT_CHUNK_SIZE 行ずつ upsert する（既存の customer_id は上書き）。
+- 1 チャンクを 1 トランザクション・1 回の executemany で書く。MySQL（PyMySQL）は
+  INSERT ... VALUES (...), (...) ON DUPLICATE KEY UPDATE の複数行の 1 文に、SQLite は ON CONFLICT になる
+- 読み込み中に持つのは書き込み前の 1 チャンクだけなので、100 万行でもメモリは増えない
+- 値が不正な行はスキップして、行番号とエラーを返す（CUSTOMER_IMPORT_ERRORS_MAX 件まで）。
+  DB に弾かれたチャンクは 1 行ずつ書き直し、書けなかった行だけをエラーにする
+- 書き込んだ customer_id は顧客キャッシュから消す
+
+CSV は 1 行目をヘッダー（customer_id,customer_name,age,gender）とする。NDJSON は 1 行 1 オブジェクト。
+
+    python -m db_control.customer_import customers.csv
+    python -m db_control.customer_import - --format ndjson < customers.ndjson
+
+    CUSTOMER_IMPORT_CHUNK_SIZE  1 トランザクションで書く行数（既定 1000）
+    CUSTOMER_IMPORT_ERRORS_MAX  結果に含めるエラーの件数の上限（既定 1000）
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+from sqlalchemy.exc import DBAPIError
+
+import applog
+import metrics
+from db_control import customer_cache
+from db_control.connect_MySQL import get_engine
+from db_control.dialect import upsert
+from db_control.mymodels_MySQL import Customers
+
+CUSTOMER_IMPORT_CHUNK_SIZE = int(os.getenv("CUSTOMER_IMPORT_CHUNK_SIZE", "1000"))
+CUSTOMER_IMPORT_ERRORS_MAX = int(os.getenv("CUSTOMER_IMPORT_ERRORS_MAX", "1000"))
+
+FORMATS = ("csv", "ndjson")
+COLUMNS = [c.name for c in Customers.__table__.columns]
+# 文字列の列の長さはモデル定義から取る（String(10) なら 10）
+MAX_LENGTHS = {c.name: c.type.length for c in Customers.__table__.columns if getattr(c.type, "length", None)}
+
+ROWS = metrics.counter("customer_import_rows_total", "一括取り込みした行数（result=upserted/failed）", ["result"])
+CHUNK_LATENCY = metrics.histogram("customer_import_chunk_seconds", "1 チャンクの upsert にかかった時間")
+
+logger = applog.get_logger("customer_import")
+
+
+class CustomerImportError(ValueError):
+    """取り込み全体を続けられない入力（不明な形式・ヘッダーの不足など）。"""
+
+
+def detect_format(fmt: str = None, content_type: str = None) -> str:
+    """指定された形式、なければ Content-Type から csv / ndjson を決める。"""
+    if fmt is None and content_type:
+        mime = content_type.split(";")[0].strip().lower()
+        if mime in ("text/csv", "application/csv"):
+            fmt = "csv"
+        elif mime in ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines"):
+            fmt = "ndjson"
+    if fmt not in FORMATS:
+        raise CustomerImportError(f"形式を指定してください（{' / '.join(FORMATS)}）")
+    return fmt
+
+
+class _ChunkStream(io.RawIOBase):
+    """bytes のイテラブル（アップロードの本文など）をファイルのように読めるようにする。"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def text_stream(chunks):
+    """bytes のイテラブルを、1 行ずつ読める UTF-8（BOM 付きも可）のテキストにする。"""
+    return io.TextIOWrapper(io.BufferedReader(_ChunkStream(chunks), 64 * 1024), encoding="utf-8-sig", newline="")
+
+
+def iter_csv(text):
+    """
+    CSV を (行番号, 辞書) の順に返す。列の数が合わない行は辞書の代わりに ValueError を返す。
+    途中から読めなくなったら（壊れた引用符・UTF-8 でないバイト）、その位置のエラーを返して終わる。
+    """
+    reader = csv.reader(text)
+    try:
+        header = next(reader, None)
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise CustomerImportError(f"CSV のヘッダーを読めません: {e}") from None
+    if header is None:
+        return
+    header = [name.strip() for name in header]
+    missing = [name for name in COLUMNS if name not in header]
+    if missing:
+        raise CustomerImportError(f"CSV のヘッダーに列がありません: {', '.join(missing)}")
+    try:
+        for values in reader:
+            if not values:
+                continue
+            if len(values) != len(header):
+                yield reader.line_num, ValueError(f"列の数が {len(values)} です（ヘッダーは {len(header)} 列）")
+                continue
+            yield reader.line_num, dict(zip(header, values))
+    except (csv.Error, UnicodeDecodeError) as e:
+        yield reader.line_num + 1, ValueError(f"ここから先を読めないため取り込みを打ち切りました: {e}")
+
+
+def iter_ndjson(text):
+    """NDJSON を (行番号, 辞書) の順に返す。読めない行は辞書の代わりに ValueError を返す。"""
+    line_no = 0
+    try:
+        for line_no, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                value = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, ValueError(f"JSON として読めません: {e.msg}")
+                continue
+            if not isinstance(value, dict):
+                yield line_no, ValueError("1 行に 1 つのオブジェクトを書いてください")
+                continue
+            yield line_no, value
+    except UnicodeDecodeError as e:
+        yield line_no + 1, ValueError(f"ここから先を読めないため取り込みを打ち切りました: {e}")
+
+
+READERS = {"csv": iter_csv, "ndjson": iter_ndjson}
+
+
+def _text(raw: dict, name: str) -> str:
+    value = raw.get(name)
+    if value is None or isinstance(value, (dict, list)):
+        raise ValueError(f"{name} がありません")
+    value = str(value).strip()
+    if not value and name == "customer_id":
+        raise ValueError("customer_id が空です")
+    if len(value) > MAX_LENGTHS[name]:
+        raise ValueError(f"{name} が {MAX_LENGTHS[name]} 文字を超えています")
+    return value
+
+
+def to_customer(raw: dict) -> dict:
+    """1 行分の辞書を customers の行にする。不正な値は ValueError。"""
+    age = raw.get("age")
+    if age is None or age == "":
+        raise ValueError("age がありません")
+    if isinstance(age, bool) or isinstance(age, float) and not age.is_integer():
+        raise ValueError(f"age が整数ではありません: {age!r}")
+    try:
+        age = int(str(age).strip()) if not isinstance(age, (int, float)) else int(age)
+    except ValueError:
+        raise ValueError(f"age が整数ではありません: {str(age)[:20]!r}") from None
+    if age < 0:
+        raise ValueError(f"age が負の値です: {age}")
+    return {
+        "customer_id": _text(raw, "customer_id"),
+        "customer_name": _text(raw, "customer_name"),
+        "age": age,
+        "gender": _text(raw, "gender"),
+    }
+
+
+class _Result:
+    """取り込みの件数とエラー（上限まで）を集める。"""
+
+    def __init__(self, max_errors: int):
+        self.rows = self.upserted = self.failed = self.chunks = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def fail(self, line_no, customer_id, message):
+        self.failed += 1
+        ROWS.inc(result="failed")
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line_no, "customer_id": customer_id, "error": message})
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "upserted": self.upserted,
+            "failed": self.failed,
+            "chunks": self.chunks,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def _write_chunk(engine, chunk: dict, result: _Result):
+    """1 チャンクを upsert する。DB に弾かれたら 1 行ずつ書き直して、書けなかった行をエラーにする。"""
+    rows = [row for _, row in chunk.values()]
+    started = time.perf_counter()
+    try:
+        with engine.begin() as conn:
+            upsert(conn, Customers, rows)
+        written = list(chunk)
+    except DBAPIError as e:
+        if e.connection_invalidated:
+            # 接続が切れた（DB の停止など）。1 行ずつ書き直しても同じなので取り込みを止める
+            raise
+        logger.warning("顧客の一括取り込みで %d 行のチャンクが失敗したため 1 行ずつ書き直します: %s", len(rows), e.orig)
+        written = []
+        for customer_id, (line_no, row) in chunk.items():
+            try:
+                with engine.begin() as conn:
+                    upsert(conn, Customers, [row])
+                written.append(customer_id)
+            except DBAPIError as row_error:
+                if row_error.connection_invalidated:
+                    raise
+                result.fail(line_no, customer_id, str(row_error.orig))
+    CHUNK_LATENCY.observe(time.perf_counter() - started)
+    customer_cache.invalidate(written)
+    result.upserted += len(written)
+    result.chunks += 1
+    ROWS.inc(len(written), result="upserted")
+
+
+def import_rows(items, engine=None, chunk_size: int = None, max_errors: int = None) -> dict:
+    """
+    (行番号, 辞書) のイテラブルを chunk_size 行ずつ upsert し、件数とエラーを返す。
+    辞書の代わりに例外が来た行（読めなかった行）はエラーとして数える。
+    同じ customer_id が 1 つのチャンクに複数あれば後の行で上書きする。
+    """
+    engine = engine or get_engine()
+    chunk_size = chunk_size or CUSTOMER_IMPORT_CHUNK_SIZE
+    result = _Result(CUSTOMER_IMPORT_ERRORS_MAX if max_errors is None else max_errors)
+    chunk = {}
+    for line_no, raw in items:
+        result.rows += 1
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            row = to_customer(raw)
+        except ValueError as e:
+            customer_id = raw.get("customer_id") if isinstance(raw, dict) else None
+            result.fail(line_no, customer_id if isinstance(customer_id, str) else None, str(e))
+            continue
+        # 重複した customer_id を同じ文に含めないよう、チャンク内では最後の行だけを残す
+        chunk.pop(row["customer_id"], None)
+        chunk[row["customer_id"]] = (line_no, row)
+        if len(chunk) >= chunk_size:
+            _write_chunk(engine, chunk, result)
+            chunk = {}
+    if chunk:
+        _write_chunk(engine, chunk, result)
+    return result.as_dict()
+
+
+def import_stream(chunks, fmt: str, engine=None, chunk_size: int = None, max_errors: int = None) -> dict:
+    """bytes のイテラブル（アップロードの本文・ファイル）を fmt として読みながら取り込む。"""
+    text = text_stream(chunks)
+    return {"format": fmt, **import_rows(READERS[fmt](text), engine, chunk_size, max_errors)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="customers を CSV / NDJSON から一括取り込みする")
+    parser.add_argument("path", help="取り込むファイル（- で標準入力）")
+    parser.add_argument("--format", choices=FORMATS, help="省略時は拡張子から決める")
+    parser.add_argument("--chunk-size", type=int, default=CUSTOMER_IMPORT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    source = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    try:
+        result = import_stream(iter(lambda: source.read(64 * 1024), b""), fmt, chunk_size=args.chunk_size)
+    except CustomerImportError as e:
+        print(f"🔴 {e}", file=sys.stderr)
+        return 2
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+from sqlalchemy import insert
+
+
+def upsert(conn, table, rows, update_columns=None, increment_columns=()):
+    """
+    主キー（または一意キー）が重複したら更新する INSERT を 1 文で実行する。
+
+    MySQL は INSERT ... ON DUPLICATE KEY UPDATE、SQLite / PostgreSQL は
+    INSERT ... ON CONFLICT DO UPDATE を使う。
+    update_columns: 重複時に新しい値で上書きする列名
+    increment_columns: 重複時に既存値へ加算する列名（集計テーブル用）
+    """
+    if not rows:
+        return None
+    if isinstance(table, type):
+        table = table.__table__
+    if update_columns is None:
+        pk = {c.name for c in table.primary_key.columns}
+        update_columns = [c.name for c in table.columns if c.name not in pk and c.name not in increment_columns]
+
+    # Session の場合は紐づく Engine から方言を取る
+    dialect = (conn.get_bind() if hasattr(conn, "get_bind") else conn).dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table)
+        new = stmt.inserted
+        values = {c: new[c] for c in update_columns}
+        values.update({c: table.c[c] + new[c] for c in increment_columns})
+        stmt = stmt.on_duplicate_key_update(**values)
+    elif dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        new = stmt.excluded
+        values = {c: new[c] for c in update_columns}
+        values.update({c: table.c[c] + new[c] for c in increment_columns})
+        index_elements = [c.name for c in table.primary_key.columns]
+        if values:
+            stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=values)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    else:
+        raise NotImplementedError(f"upsert は {dialect} に対応していません")
+
+    return conn.execute(stmt, rows)
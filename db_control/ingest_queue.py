@@ -0,0 +1,291 @@
+"""
+activity_logs への書き込みを後回しにする（write-behind）ための永続キュー。
+
+INGEST_MODE=queue のとき、/api/record は構造化済みの行をローカルの SQLite（WAL）ファイルに
+追記し、fsync が終わった時点で応答する。バックグラウンドのスレッドが溜まった行を
+まとめて 1 トランザクションで DB に書き込み（グループコミット）、成功したらキューから消す。
+
+- 失敗したバッチは 1 行ずつ書き直し、書けなかった行だけ指数バックオフで再試行する
+- INGEST_MAX_ATTEMPTS 回失敗した行は dead テーブルに移して止める（データは残る）
+- 取り出した行にはリース期限を付けるので、同じファイルを複数のワーカープロセスで
+  共有しても二重に書き込まない。途中で落ちたプロセスの行はリース切れ後に再送される
+- DB へのコミット後、キューから消す前にプロセスが落ちると、その行は再送される（at-least-once）
+
+    INGEST_MODE            sync（既定。従来どおり同期で書く）/ queue
+    INGEST_QUEUE_PATH      キューファイルのパス（既定 ingest_queue.db）
+    INGEST_BATCH_SIZE      1 トランザクションで書く最大行数（既定 200）
+    INGEST_FLUSH_INTERVAL  書き込みを待つ最大秒数（既定 0.05）
+    INGEST_MAX_ATTEMPTS    dead に移すまでの試行回数（既定 10）
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import applog
+import metrics
+
+INGEST_MODE = os.getenv("INGEST_MODE", "sync")
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", "ingest_queue.db")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "200"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.05"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "10"))
+
+# 取り出した行をほかのプロセスに渡さない時間（書き込みがこれより長引くと二重送信になりうる）
+LEASE_SECONDS = 60
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 60
+
+APPENDED = metrics.counter("ingest_appended_total", "キューに追記した行数")
+FLUSHED = metrics.counter("ingest_flushed_total", "キューから DB に書き込んだ行数")
+FAILURES = metrics.counter("ingest_failures_total", "DB への書き込みに失敗した回数（行単位）")
+DEAD = metrics.counter("ingest_dead_total", "再試行をあきらめて dead に移した行数")
+BATCH_ROWS = metrics.histogram(
+    "ingest_batch_rows", "1 回のグループコミットで書いた行数",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+LAG = metrics.histogram("ingest_lag_seconds", "キューに追記してから DB にコミットされるまでの時間")
+
+logger = applog.get_logger("ingest")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    activity_type TEXT NOT NULL,
+    row TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_pending_ts ON pending (ts);
+CREATE INDEX IF NOT EXISTS ix_pending_available ON pending (available_at, id);
+CREATE TABLE IF NOT EXISTS dead (
+    id INTEGER PRIMARY KEY,
+    row TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT NOT NULL,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+def _encode(row: dict) -> str:
+    return json.dumps({**row, "timestamp": row["timestamp"].isoformat()}, ensure_ascii=False)
+
+
+def _decode(text: str) -> dict:
+    row = json.loads(text)
+    row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return row
+
+
+class IngestQueue:
+    """
+    SQLite ファイルを使った永続キューと、DB へ書き込むワーカースレッド。
+    writer(rows) は行のリストを 1 トランザクションで書き込み、失敗したら例外を投げる関数。
+    """
+
+    def __init__(self, path: str, writer, batch_size: int = INGEST_BATCH_SIZE,
+                 flush_interval: float = INGEST_FLUSH_INTERVAL, max_attempts: int = INGEST_MAX_ATTEMPTS):
+        self.path = path
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        # WAL + synchronous=FULL: コミットのたびに WAL を fsync するので、追記が返れば電源断でも消えない
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @contextmanager
+    def _transaction(self):
+        # 複数文を 1 回の fsync にまとめる。BEGIN IMMEDIATE で他プロセスの書き込みと直列化する
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    # ── 追記・参照（リクエスト側） ───────────────────────────────────────
+    def append(self, rows):
+        """行をキューに追記する。戻った時点でディスクに書き込まれている。"""
+        now = time.time()
+        with self._transaction() as db:
+            db.executemany(
+                "INSERT INTO pending (ts, activity_type, row, enqueued_at) VALUES (?, ?, ?, ?)",
+                [(r["timestamp"].isoformat(), r["activity_type"], _encode(r), now) for r in rows],
+            )
+        APPENDED.inc(len(rows))
+        self._wake.set()
+
+    def pending(self, start: datetime, end: datetime, types=None):
+        """
+        timestamp が [start, end) に入る未書き込みの行を timestamp 順に返す（read-your-writes 用）。
+        start / end は DB 基準の naive datetime。
+        """
+        sql = "SELECT row FROM pending WHERE ts >= ? AND ts < ?"
+        params = [start.isoformat(), end.isoformat()]
+        if types:
+            sql += f" AND activity_type IN ({','.join('?' * len(types))})"
+            params += list(types)
+        with self._lock:
+            rows = [_decode(text) for (text,) in self._db.execute(sql + " ORDER BY ts, id", params)]
+        return rows
+
+    def stats(self):
+        with self._lock:
+            depth, oldest = self._db.execute("SELECT COUNT(*), MIN(enqueued_at) FROM pending").fetchone()
+            dead = self._db.execute("SELECT COUNT(*) FROM dead").fetchone()[0]
+        return {
+            "depth": depth,
+            "oldest_age_seconds": time.time() - oldest if oldest else 0.0,
+            "dead": dead,
+            "appended": APPENDED.value(),
+            "flushed": FLUSHED.value(),
+            "failures": FAILURES.value(),
+        }
+
+    # ── 書き込み（ワーカー側） ──────────────────────────────────────────
+    def _claim(self):
+        """書き込める行を最大 batch_size 件取り出し、リースを付ける。"""
+        now = time.time()
+        with self._transaction() as db:
+            claimed = db.execute(
+                "SELECT id, row, enqueued_at, attempts FROM pending WHERE available_at <= ? ORDER BY id LIMIT ?",
+                (now, self.batch_size),
+            ).fetchall()
+            if claimed:
+                db.executemany("UPDATE pending SET available_at = ? WHERE id = ?",
+                               [(now + LEASE_SECONDS, c[0]) for c in claimed])
+        return claimed
+
+    def _ack(self, claimed):
+        with self._transaction() as db:
+            db.executemany("DELETE FROM pending WHERE id = ?", [(c[0],) for c in claimed])
+        now = time.time()
+        for c in claimed:
+            LAG.observe(now - c[2])
+        FLUSHED.inc(len(claimed))
+
+    def _nack(self, item, error: Exception):
+        item_id, row, enqueued_at, attempts = item
+        attempts += 1
+        FAILURES.inc()
+        if attempts >= self.max_attempts:
+            with self._transaction() as db:
+                db.execute("INSERT OR REPLACE INTO dead VALUES (?, ?, ?, ?, ?, ?)",
+                           (item_id, row, enqueued_at, attempts, str(error), time.time()))
+                db.execute("DELETE FROM pending WHERE id = ?", (item_id,))
+            DEAD.inc()
+            logger.error("ingest row %s moved to dead after %s attempts: %s", item_id, attempts, error)
+            return
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+        with self._transaction() as db:
+            db.execute("UPDATE pending SET attempts = ?, available_at = ? WHERE id = ?",
+                       (attempts, time.time() + delay, item_id))
+
+    def flush_once(self) -> int:
+        """1 バッチ分を DB に書き込み、書き込めた行数を返す。"""
+        claimed = self._claim()
+        if not claimed:
+            return 0
+        try:
+            self.writer([_decode(c[1]) for c in claimed])
+        except Exception as e:
+            logger.warning("ingest batch of %s rows failed: %s", len(claimed), e)
+            if len(claimed) == 1:
+                self._nack(claimed[0], e)
+                return 0
+            # 1 行の不正データでバッチ全体が止まらないよう、1 行ずつ書き直す
+            written = 0
+            for item in claimed:
+                try:
+                    self.writer([_decode(item[1])])
+                except Exception as e1:
+                    self._nack(item, e1)
+                    continue
+                self._ack([item])
+                written += 1
+            if written:
+                BATCH_ROWS.observe(written)
+            return written
+        self._ack(claimed)
+        BATCH_ROWS.observe(len(claimed))
+        return len(claimed)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                # 満杯のバッチが続く間は待たずに書き続ける
+                while self.flush_once() == self.batch_size and not self._stopping.is_set():
+                    pass
+            except Exception as e:
+                logger.error("ingest worker error: %s", e)
+                time.sleep(RETRY_BASE_SECONDS)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, drain_timeout: float = 10.0):
+        """ワーカーを止める。drain_timeout 秒までは残りを書き込む（書けなかった行はファイルに残る）。"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        deadline = time.monotonic() + drain_timeout
+        try:
+            while time.monotonic() < deadline and self.flush_once():
+                pass
+        except Exception as e:
+            logger.error("ingest drain stopped: %s", e)
+        with self._lock:
+            self._db.close()
+
+
+def _as_pending(row: dict) -> dict:
+    # まだ DB に入っていないので id / created_at はない
+    return {"id": None, **row, "created_at": None, "pending": True}
+
+
+def merge_pending(db_rows, pending_rows, keep_tail=None):
+    """
+    DB から読んだ行（timestamp 順）とキューの未書き込み行（timestamp 順）を timestamp 順に合わせる。
+    キューを先に読み、その後に DB を読むので、間にワーカーが書き込んだ行は両方に現れうる。
+    同じ timestamp・同じ内容の DB 行があればキュー側を捨てる。
+    keep_tail: DB 行を読み終えた後に残ったキュー行を出すかどうかを 1 行ずつ判定する関数
+    （ページングで次のページに回す行を除くため。DB 行を読み終えた時点で呼ばれる）。
+    """
+    pending = list(pending_rows)
+    i = 0
+    for row in db_rows:
+        while i < len(pending) and pending[i]["timestamp"] < row["timestamp"]:
+            yield _as_pending(pending[i])
+            i += 1
+        for j in range(i, len(pending)):
+            if pending[j]["timestamp"] != row["timestamp"]:
+                break
+            if all(pending[j][k] == row[k] for k in pending[j]):
+                del pending[j]
+                break
+        yield row
+    for p in pending[i:]:
+        if keep_tail is None or keep_tail(p):
+            yield _as_pending(p)
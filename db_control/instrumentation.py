@@ -0,0 +1,96 @@
+"""
+SQLAlchemy のエンジンイベントで SQL の実行を計測する。
+
+echo=True の代わりに使う。文ごとに SQL と引数を標準出力へ書くのではなく、
+- 実行時間のヒストグラム（operation=select/insert/update/delete/other）
+- 影響・取得件数のヒストグラム（ドライバーが件数を返すときだけ）
+- 遅いクエリの件数と、サンプリングしたクエリのログ（引数は個人情報を含みうるので出さない）
+を記録する。値は metrics に入るので /metrics から Prometheus 形式で取れる。
+
+    DB_SLOW_QUERY_MS          遅いクエリとみなす実行時間（既定 200ms）
+    DB_SLOW_QUERY_SAMPLE_RATE 遅いクエリのうちログに出す割合（既定 1.0）
+    DB_QUERY_SAMPLE_RATE      それ以外のクエリのうち DEBUG ログに出す割合（既定 0.0）
+"""
+import os
+import random
+import time
+
+from sqlalchemy import event
+
+import applog
+import metrics
+
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_SLOW_QUERY_SAMPLE_RATE = float(os.getenv("DB_SLOW_QUERY_SAMPLE_RATE", "1.0"))
+DB_QUERY_SAMPLE_RATE = float(os.getenv("DB_QUERY_SAMPLE_RATE", "0.0"))
+
+# ログに出す SQL の最大長（IN 句の展開などで巨大になることがある）
+MAX_STATEMENT_LENGTH = 1000
+
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+QUERY_LATENCY = metrics.histogram(
+    "db_query_duration_seconds", "SQL 1 文の実行時間（operation=select/insert/update/delete/other）",
+    ["operation"])
+QUERY_ROWS = metrics.histogram(
+    "db_query_rows", "SQL 1 文の影響・取得件数（ドライバーが件数を返す場合のみ）",
+    ["operation"], buckets=ROW_BUCKETS)
+QUERY_ERRORS = metrics.counter(
+    "db_query_errors_total", "実行に失敗した SQL の件数", ["operation"])
+SLOW_QUERIES = metrics.counter(
+    "db_slow_queries_total", "DB_SLOW_QUERY_MS を超えた SQL の件数", ["operation"])
+
+OPERATIONS = ("select", "insert", "update", "delete")
+
+logger = applog.get_logger("db.query")
+
+
+def _one_line(statement: str) -> str:
+    return " ".join(statement.split())[:MAX_STATEMENT_LENGTH]
+
+
+def _operation(statement: str) -> str:
+    head = statement.lstrip()[:6].lower()
+    return head if head in OPERATIONS else "other"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    operation = _operation(statement)
+    QUERY_LATENCY.observe(elapsed, operation=operation)
+    # SQLite の SELECT やサーバーサイドカーソルでは件数が分からない（-1）
+    rowcount = cursor.rowcount
+    if rowcount is not None and rowcount >= 0:
+        QUERY_ROWS.observe(rowcount, operation=operation)
+
+    if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(operation=operation)
+        if random.random() < DB_SLOW_QUERY_SAMPLE_RATE:
+            logger.warning("slow query %.1fms rows=%s executemany=%s: %s",
+                           elapsed * 1000, rowcount, executemany, _one_line(statement))
+    elif DB_QUERY_SAMPLE_RATE and random.random() < DB_QUERY_SAMPLE_RATE:
+        logger.debug("query %.1fms rows=%s: %s", elapsed * 1000, rowcount, _one_line(statement))
+
+
+def _handle_error(exception_context):
+    statement = exception_context.statement or ""
+    operation = _operation(statement)
+    QUERY_ERRORS.inc(operation=operation)
+    logger.error("query failed (%s): %s", exception_context.original_exception, _one_line(statement))
+
+
+def instrument(engine):
+    """engine にイベントリスナーを登録する。同じエンジンに 2 回呼んでも 1 回分しか登録しない。"""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    return engine
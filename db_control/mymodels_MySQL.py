@@ -1,7 +1,7 @@
-from sqlalchemy import String, Integer, ForeignKey
+from sqlalchemy import String, Integer, BigInteger, ForeignKey, Text, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from datetime import datetime
-from sqlalchemy import DateTime
+from datetime import date, datetime
+from sqlalchemy import Date, DateTime, func
 
 class Base(DeclarativeBase):
     pass
@@ -24,6 +24,11 @@ class Items(Base):
 
 class Purchases(Base):
     __tablename__ = 'purchases'
+    __table_args__ = (
+        # 期間での集計（日付 → 購入 ID）と、顧客ごとの集計（顧客 → 日付）をインデックスだけで済ませる
+        Index('ix_purchases_date_customer', 'purchase_date', 'customer_id', 'purchase_id'),
+        Index('ix_purchases_customer_date', 'customer_id', 'purchase_date'),
+    )
     purchase_id: Mapped[str] = mapped_column(String(10), primary_key=True)
     customer_id: Mapped[str] = mapped_column(String(10), ForeignKey("customers.customer_id"))
     purchase_date: Mapped[str] = mapped_column(String(10))
@@ -31,7 +36,13 @@ class Purchases(Base):
 
 class PurchaseDetails(Base):
     __tablename__ = 'purchase_details'
-    detail_id: Mapped[str] = mapped_column(String(10), primary_key=True, autoincrement=True)
+    __table_args__ = (
+        # 購入 ID から明細を引く結合用（item_id・quantity まで含めてテーブル本体を読まない）
+        Index('ix_purchase_details_purchase_item', 'purchase_id', 'item_id', 'quantity'),
+        Index('ix_purchase_details_item', 'item_id'),
+    )
+    # 文字列の主キーは自動採番できない（autoincrement=True だと CREATE TABLE が失敗する）
+    detail_id: Mapped[str] = mapped_column(String(10), primary_key=True)
     purchase_id: Mapped[str] = mapped_column(String(10), ForeignKey("purchases.purchase_id"))
     item_id: Mapped[str] = mapped_column(String(10), ForeignKey("items.item_id"))
     quantity: Mapped[int] = mapped_column(Integer)
@@ -43,11 +54,15 @@ class MilkLog(Base):
     id: Mapped[str] = mapped_column(Integer, primary_key=True)
     milktype: Mapped[str] = mapped_column(String(10))
     volume: Mapped[int] = mapped_column(Integer)
-    created_at: Mapped[datetime] = mapped_column(DateTime)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
 #activity_logsのテーブルを追加
 class ActivityLog(Base):
     __tablename__ = 'activity_logs'
+    __table_args__ = (
+        # 日付範囲（timestamp の半開区間）での検索と activity_type での絞り込み用
+        Index('ix_activity_logs_timestamp_type', 'timestamp', 'activity_type'),
+    )
 
     id: Mapped[int] = mapped_column(
         Integer, primary_key=True, autoincrement=True
@@ -76,4 +91,87 @@ class ActivityLog(Base):
     timestamp: Mapped[datetime] = mapped_column(
         DateTime, nullable=False
     )
-    created_at: Mapped[datetime] = mapped_column(DateTime)
\ No newline at end of file
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+#日ごとの集計テーブルを追加（activity_logs から差分更新する。日付は APP_TIMEZONE 基準）
+class DailyActivitySummary(Base):
+    __tablename__ = 'daily_activity_summary'
+
+    day: Mapped[date] = mapped_column(
+        Date, primary_key=True
+    )
+    feed_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0
+    )
+    milk_volume: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0
+    )
+    diaper_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0
+    )
+    pee_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0
+    )
+    poo_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0
+    )
+    sleep_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0
+    )
+    sleep_minutes: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0
+    )
+
+#キャッシュ共有用のテーブルを追加（gunicorn の全ワーカーで結果を共有する）
+class CacheEntry(Base):
+    __tablename__ = 'kv_cache'
+
+    namespace: Mapped[str] = mapped_column(
+        String(32), primary_key=True
+    )
+    cache_key: Mapped[str] = mapped_column(
+        String(64), primary_key=True
+    )
+    value: Mapped[str] = mapped_column(
+        Text, nullable=False
+    )
+    expires_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False
+    )
+
+
+#購入の日ごとの集計テーブルを追加（purchases / purchase_details から db_control.analytics で差分更新する）
+class DailyPurchaseSummary(Base):
+    __tablename__ = 'daily_purchase_summary'
+
+    purchase_date: Mapped[str] = mapped_column(
+        String(10), primary_key=True
+    )
+    purchase_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0
+    )
+    quantity: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0
+    )
+    revenue: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0
+    )
+
+
+#商品ごと・日ごとの売上の集計テーブルを追加
+class DailyItemSales(Base):
+    __tablename__ = 'daily_item_sales'
+
+    purchase_date: Mapped[str] = mapped_column(
+        String(10), primary_key=True
+    )
+    item_id: Mapped[str] = mapped_column(
+        String(10), primary_key=True
+    )
+    quantity: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0
+    )
+    revenue: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0
+    )
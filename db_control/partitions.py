@@ -0,0 +1,381 @@
+"""
+activity_logs の月単位のパーティション（LOG_PARTITIONS=1 のとき）。
+
+- MySQL: ネイティブの RANGE COLUMNS(timestamp) パーティション（p202506 に 2025-06 の行、pmax にそれ以降）。
+  timestamp の範囲で検索すると、MySQL が範囲に重なるパーティションだけを読む（パーティションプルーニング）
+- SQLite: 月ごとのテーブル activity_logs_202506 に振り分ける。読み込みは範囲に重なる月のテーブルだけを
+  UNION ALL でつなぐ（init で移す前の行も読めるよう、元の activity_logs も常に含める）。
+  id は月ごとに 年月 × 10^9 から採番するので、テーブルをまたいでも重ならない
+- ensure_partitions: 今月から LOG_PARTITIONS_AHEAD か月先までのパーティションを作っておく（起動時に呼ぶ）
+- archive: 指定した月より前のパーティションを gzip 圧縮の NDJSON に書き出してから削除する。
+  書き出すのは日付の範囲ではなくパーティションの全行（MySQL の最も古いパーティションには、それより前の
+  日付で後から入った行も入る）。数え直して書き出した件数と合わなければ削除しない。
+  daily_activity_summary の集計は残る
+
+月の区切りは DB に保存した timestamp（DB_TIMEZONE 基準）で決める。
+
+    python -m db_control.partitions init                       # 既存の activity_logs を月ごとに分ける（1 回だけ）
+    python -m db_control.partitions ensure
+    python -m db_control.partitions status
+    python -m db_control.partitions archive --before 2025-01   # 2024-12 以前を書き出して削除
+
+    LOG_PARTITIONS         1 で有効（既定 0）
+    LOG_PARTITIONS_AHEAD   先に作っておく月数（既定 3）
+    LOG_RETENTION_MONTHS   archive で --before を省略したときに残す月数（今月を含む。既定 12）
+    LOG_ARCHIVE_DIR        書き出し先のディレクトリ（既定 archive）
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import MetaData, func, insert, select, text
+
+from db_control import timeutil
+from db_control.mymodels_MySQL import ActivityLog
+
+LOG_PARTITIONS = os.getenv("LOG_PARTITIONS", "0").lower() in ("1", "true", "yes")
+LOG_PARTITIONS_AHEAD = int(os.getenv("LOG_PARTITIONS_AHEAD", "3"))
+LOG_RETENTION_MONTHS = int(os.getenv("LOG_RETENTION_MONTHS", "12"))
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "archive")
+
+BASE = ActivityLog.__table__
+# SQLite の月ごとのテーブルの id の開始値（年月 × ID_BLOCK、例: 2025-06 は 202506000000001 から）
+ID_BLOCK = 10 ** 9
+
+_TABLE_RE = re.compile(rf"^{BASE.name}_(\d{{4}})(\d{{2}})$")
+_metadata = MetaData()
+_month_tables = {}
+
+
+def _today() -> date:
+    # 月の区切りは保存した timestamp と同じ DB_TIMEZONE で決める
+    return datetime.now(timeutil.DB_TIMEZONE).date()
+
+
+def month_of(value) -> date:
+    """日付・日時が属する月の 1 日。"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    years, index = divmod(month.month - 1 + n, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"p{month:%Y%m}"
+
+
+def _month_start(month: date) -> datetime:
+    return datetime(month.year, month.month, 1)
+
+
+def mode(conn):
+    """パーティションの方式。"native"（MySQL のパーティション）/ "tables"（SQLite の月ごとのテーブル）/ None（無効）。"""
+    if not LOG_PARTITIONS:
+        return None
+    dialect = (conn.get_bind() if hasattr(conn, "get_bind") else conn).dialect.name
+    if dialect == "mysql":
+        return "native"
+    if dialect == "sqlite":
+        return "tables"
+    return None
+
+
+def _connection(conn):
+    # DDL は Connection で実行する（Session ならそのトランザクションの接続を使う）
+    return conn.connection() if hasattr(conn, "get_bind") else conn
+
+
+def month_table(month: date):
+    """SQLite の月ごとのテーブル（activity_logs と同じ列・インデックス）。"""
+    table = _month_tables.get(month)
+    if table is None:
+        name = f"{BASE.name}_{month:%Y%m}"
+        table = BASE.to_metadata(_metadata, name=name)
+        for index in table.indexes:
+            # インデックス名は DB 全体で一意にする
+            index.name = index.name.replace(BASE.name, name, 1)
+        # 削除した id を再利用せず、sqlite_sequence の開始値から採番する
+        table.dialect_options["sqlite"]["autoincrement"] = True
+        table = _month_tables.setdefault(month, table)
+    return table
+
+
+def _table_months(conn) -> list:
+    """SQLite に作られている月ごとのテーブルの月（古い順）。"""
+    names = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars()
+    months = [date(int(m.group(1)), int(m.group(2)), 1) for m in map(_TABLE_RE.match, names) if m]
+    return sorted(months)
+
+
+def _create_month_table(conn, month: date):
+    connection = _connection(conn)
+    table = month_table(month)
+    table.create(connection, checkfirst=True)
+    connection.execute(
+        text("INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+             "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"),
+        {"name": table.name, "seq": int(f"{month:%Y%m}") * ID_BLOCK},
+    )
+
+
+def log_tables(conn, start: datetime = None, end: datetime = None) -> list:
+    """[start, end) のログを読むテーブル。SQLite の月ごとのテーブル以外では activity_logs だけ。"""
+    if mode(conn) != "tables":
+        return [BASE]
+    first = month_of(start) if start is not None else None
+    last = month_of(end - timedelta(microseconds=1)) if end is not None else None
+    months = [m for m in _table_months(conn)
+              if (first is None or m >= first) and (last is None or m <= last)]
+    return [BASE] + [month_table(m) for m in months]
+
+
+def insert_rows(conn, rows):
+    """
+    SQLite の月ごとのテーブルに、timestamp の月で振り分けて INSERT する（月ごとに executemany 1 回）。
+    テーブルがまだない月は、同じトランザクションで作る。
+    """
+    by_month = defaultdict(list)
+    for row in rows:
+        by_month[month_of(row["timestamp"])].append(row)
+    existing = set(_table_months(conn))
+    for month, month_rows in sorted(by_month.items()):
+        if month not in existing:
+            _create_month_table(conn, month)
+        conn.execute(insert(month_table(month)), month_rows)
+
+
+def _mysql_partitions(conn) -> list:
+    """MySQL の activity_logs のパーティション名（定義順）。パーティション化されていなければ空。"""
+    names = conn.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"table": BASE.name}).scalars()
+    return [n for n in names if n is not None]
+
+
+def _less_than(month: date) -> str:
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d} 00:00:00')"
+
+
+def _oldest_month(conn, table):
+    oldest = conn.execute(select(func.min(table.c.timestamp))).scalar()
+    return month_of(oldest) if oldest is not None else None
+
+
+def _wanted_months(first: date, today: date = None, ahead: int = None) -> list:
+    """first から今月の ahead か月先までの月。"""
+    last = add_months(month_of(today or _today()), LOG_PARTITIONS_AHEAD if ahead is None else ahead)
+    months = []
+    month = first
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def init(conn, today: date = None) -> list:
+    """
+    既存の activity_logs をパーティションに分け、作ったパーティションの月を返す（1 回だけ実行する）。
+    MySQL は主キーを (id, timestamp) に変えてから RANGE COLUMNS でパーティション化する
+    （パーティションのキーは主キーに含める必要がある）。SQLite は行を月ごとのテーブルに移す。
+    """
+    current = month_of(today or _today())
+    first = min(_oldest_month(conn, BASE) or current, current)
+    months = _wanted_months(first, today)
+    if mode(conn) == "native":
+        if _mysql_partitions(conn):
+            print("activity_logs は既にパーティション化されています")
+            return []
+        conn.execute(text(f"ALTER TABLE {BASE.name} DROP PRIMARY KEY, ADD PRIMARY KEY (id, `timestamp`)"))
+        clauses = ", ".join([_less_than(m) for m in months] + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+        conn.execute(text(f"ALTER TABLE {BASE.name} PARTITION BY RANGE COLUMNS(`timestamp`) ({clauses})"))
+        return months
+    if mode(conn) == "tables":
+        for month in months:
+            _create_month_table(conn, month)
+            in_month = [BASE.c.timestamp >= _month_start(month), BASE.c.timestamp < _month_start(add_months(month, 1))]
+            # id はそのまま移す（カーソルや画面に出した id が変わらない）
+            conn.execute(insert(month_table(month)).from_select([c.name for c in BASE.columns],
+                                                                select(BASE).where(*in_month)))
+            conn.execute(BASE.delete().where(*in_month))
+        return months
+    raise RuntimeError("LOG_PARTITIONS=1 で、MySQL か SQLite の DB を指定してください")
+
+
+def ensure_partitions(conn, today: date = None, ahead: int = None) -> list:
+    """今月から ahead（既定 LOG_PARTITIONS_AHEAD）か月先までのパーティションを作り、作った月を返す。"""
+    current = month_of(today or _today())
+    if mode(conn) == "tables":
+        existing = set(_table_months(conn))
+        missing = [m for m in _wanted_months(current, today, ahead) if m not in existing]
+        for month in missing:
+            _create_month_table(conn, month)
+        return missing
+    if mode(conn) == "native":
+        names = _mysql_partitions(conn)
+        if not names:
+            print("🟡 activity_logs がパーティション化されていません（python -m db_control.partitions init）")
+            return []
+        defined = [date(int(n[1:5]), int(n[5:7]), 1) for n in names if re.fullmatch(r"p\d{6}", n)]
+        after = max(defined) if defined else add_months(current, -1)
+        # pmax を分割して、最後のパーティションより後の月を足す（pmax に入っていた行も振り分けられる）
+        missing = [m for m in _wanted_months(current, today, ahead) if m > after]
+        if missing:
+            clauses = ", ".join([_less_than(m) for m in missing] + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+            conn.execute(text(f"ALTER TABLE {BASE.name} REORGANIZE PARTITION pmax INTO ({clauses})"))
+        return missing
+    return []
+
+
+def startup(engine):
+    """起動時に呼ぶ。パーティションの先行作成に失敗してもアプリの起動は止めない。"""
+    if not LOG_PARTITIONS:
+        return
+    try:
+        with engine.begin() as conn:
+            created = ensure_partitions(conn)
+        if created:
+            print(f"activity_logs のパーティションを作成しました: {', '.join(f'{m:%Y-%m}' for m in created)}")
+    except Exception as e:
+        print("🟡 activity_logs のパーティションの作成に失敗:", e)
+
+
+def _months(conn) -> list:
+    """パーティションになっている月（古い順）。"""
+    if mode(conn) == "tables":
+        return _table_months(conn)
+    if mode(conn) == "native":
+        return [date(int(n[1:5]), int(n[5:7]), 1) for n in _mysql_partitions(conn) if re.fullmatch(r"p\d{6}", n)]
+    return []
+
+
+def _from_partition(stmt, month: date, native: bool):
+    """
+    stmt の読み取りを month のパーティションの全行に絞る。
+    MySQL は PARTITION 句で指定する（最も古いパーティションには、それより前の日付の行も入るため、
+    timestamp の範囲ではなくパーティションそのものを読む）。SQLite の月ごとのテーブルはテーブル全体。
+    """
+    if native:
+        return stmt.with_hint(BASE, f"PARTITION ({partition_name(month)})", "mysql")
+    return stmt
+
+
+def _partition_table(month: date, native: bool):
+    return BASE if native else month_table(month)
+
+
+def _partition_count(conn, month: date, native: bool) -> int:
+    table = _partition_table(month, native)
+    return conn.execute(_from_partition(select(func.count()).select_from(table), month, native)).scalar()
+
+
+def status(conn) -> list:
+    """月ごとのパーティションと行数。"""
+    native = mode(conn) == "native"
+    return [{"partition": partition_name(month), "month": f"{month:%Y-%m}",
+             "rows": _partition_count(conn, month, native)}
+            for month in _months(conn)]
+
+
+def _json_default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f"{type(o).__name__} は JSON に変換できません")
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False, default=_json_default)
+
+
+def _export(conn, query, path: str) -> int:
+    """query の結果を gzip 圧縮の NDJSON に書き出し、行数を返す（書き終えてから path に置き換える）。"""
+    tmp = path + ".tmp"
+    count = 0
+    result = conn.execute(query, execution_options={"stream_results": True, "yield_per": 1000})
+    # 圧縮レベルは zlib の既定（6）。9 は NDJSON ではサイズがほとんど変わらず倍近く遅い
+    with open(tmp, "wb") as raw:
+        with gzip.open(raw, "wt", encoding="utf-8", compresslevel=6) as f:
+            for rows in result.mappings().partitions():
+                f.write("".join(_encoder.encode(dict(row)) + "\n" for row in rows))
+                count += len(rows)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    return count
+
+
+def archive(engine, before: date, out_dir: str = None) -> list:
+    """
+    before の月より前のパーティションを 1 か月ずつ書き出して削除し、[{month, rows, path}] を返す。
+    書き出すのはパーティションの全行（DROP で消える行と同じ）。書き出しの後にパーティションの行数を
+    数え直し、書き出した件数と合わなければその月は削除しない。
+    """
+    out_dir = out_dir or LOG_ARCHIVE_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    with engine.connect() as conn:
+        months = [m for m in _months(conn) if m < month_of(before)]
+        native = mode(conn) == "native"
+
+    archived = []
+    for month in months:
+        table = _partition_table(month, native)
+        path = os.path.join(out_dir, f"{BASE.name}_{month:%Y%m}.ndjson.gz")
+        with engine.connect() as conn:
+            query = _from_partition(select(table).order_by(table.c.timestamp, table.c.id), month, native)
+            rows = _export(conn, query, path)
+        # 書き出しとは別のトランザクションで数え直す（同じスナップショットだと後から増えた行が見えない）
+        with engine.begin() as conn:
+            recount = _partition_count(conn, month, native)
+            if recount != rows:
+                print(f"🟡 {month:%Y-%m} は書き出し中に行が変わったため削除しません（{rows} → {recount} 行）")
+                continue
+            if native:
+                conn.execute(text(f"ALTER TABLE {BASE.name} DROP PARTITION {partition_name(month)}"))
+            else:
+                table.drop(conn)
+        archived.append({"month": f"{month:%Y-%m}", "rows": rows, "path": path})
+    return archived
+
+
+def main():
+    parser = argparse.ArgumentParser(description="activity_logs のパーティションの管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("init", help="既存の activity_logs をパーティションに分ける（1 回だけ）")
+    sub.add_parser("ensure", help=f"今月から LOG_PARTITIONS_AHEAD（{LOG_PARTITIONS_AHEAD}）か月先まで作る")
+    sub.add_parser("status", help="月ごとの行数を表示する")
+    p = sub.add_parser("archive", help="古い月を gzip 圧縮の NDJSON に書き出して削除する")
+    p.add_argument("--before", help="この月（YYYY-MM）より前を書き出す。省略時は LOG_RETENTION_MONTHS か月より前")
+    p.add_argument("--out", default=LOG_ARCHIVE_DIR, help="書き出し先のディレクトリ")
+    args = parser.parse_args()
+
+    from db_control.connect_MySQL import get_engine
+
+    engine = get_engine()
+    if not LOG_PARTITIONS:
+        print("LOG_PARTITIONS=1 を指定してください")
+        return
+    if args.command == "archive":
+        before = (datetime.strptime(args.before, "%Y-%m").date() if args.before
+                  else add_months(month_of(_today()), 1 - LOG_RETENTION_MONTHS))
+        for item in archive(engine, before, args.out):
+            print(f"archived {item['month']}: {item['rows']} rows -> {item['path']}")
+        return
+    with engine.begin() as conn:
+        if args.command == "init":
+            months = init(conn)
+            print(f"partitioned {len(months)} months")
+        elif args.command == "ensure":
+            months = ensure_partitions(conn)
+            print(f"created {len(months)} partitions")
+        else:
+            for item in status(conn):
+                print(f"{item['partition']}  {item['month']}  {item['rows']:>10} rows")
+
+
+if __name__ == "__main__":
+    main()
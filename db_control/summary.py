@@ -0,0 +1,225 @@
+"""
+日ごとの集計（授乳回数・ミルク量・おむつ回数・睡眠時間）を daily_activity_summary に保持する。
+
+- apply_logs: activity_logs に INSERT した行を集計に反映する（記録 API から呼ぶ）
+- rebuild: activity_logs から集計を作り直す（バックフィル用）
+- startup: テーブルが無ければ作る（アプリの起動時に呼ぶ）
+
+    python -m db_control.summary rebuild --from 2025-06-01 --to 2025-06-30
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, inspect, select
+
+from db_control import activity_logs, timeutil
+from db_control.dialect import upsert
+from db_control.mymodels_MySQL import DailyActivitySummary
+
+COUNTER_COLUMNS = ("feed_count", "milk_volume", "diaper_count", "pee_count", "poo_count")
+SLEEP_COLUMNS = ("sleep_count", "sleep_minutes")
+SLEEP_TYPES = ("sleep", "wake")
+# これより長いセッションは起床の記録漏れとみなして数えない
+MAX_SLEEP_SESSION = timedelta(hours=24)
+
+
+def local_day(ts: datetime) -> date:
+    """DB 基準の timestamp を APP_TIMEZONE の日付に変換する。"""
+    return timeutil.from_db_time(ts).date()
+
+
+def _empty(day: date) -> dict:
+    row = {"day": day}
+    row.update({c: 0 for c in COUNTER_COLUMNS + SLEEP_COLUMNS})
+    return row
+
+
+def _count(row: dict, log: dict):
+    """1 件のログを集計行のカウンターに加える（睡眠は pair_sleep_sessions で別に数える）。"""
+    if log["activity_type"] == "feeding":
+        row["feed_count"] += 1
+        row["milk_volume"] += log.get("volume") or 0
+    elif log["activity_type"] == "diaper":
+        row["diaper_count"] += 1
+        if log.get("diaper_type") == "おしっこ":
+            row["pee_count"] += 1
+        elif log.get("diaper_type") == "うんち":
+            row["poo_count"] += 1
+
+
+def pair_sleep_sessions(events):
+    """
+    時刻順の (timestamp, activity_type) から sleep → wake の組を作る。
+    戻り値は ([(開始, 終了), ...], 閉じていない sleep の開始時刻または None)。
+    wake は、直前の wake より後で MAX_SLEEP_SESSION 以内の最も早い sleep と組にする
+    （sleep が連続したら最初のもの。対応する sleep のない wake は無視する）。
+    各 wake の組は [wake - MAX_SLEEP_SESSION, wake] のイベントだけで決まるので、
+    どこから読み始めても、その範囲を含んでいれば同じ組になる（差分更新と作り直しで結果がそろう）。
+    """
+    sessions, pending = [], []
+    for ts, activity_type in events:
+        if activity_type == "sleep":
+            pending.append(ts)
+            continue
+        # 起床の記録漏れで残った古い sleep は捨てる
+        opened = next((t for t in pending if ts - t <= MAX_SLEEP_SESSION), None)
+        if opened is not None:
+            sessions.append((opened, ts))
+        pending = []
+    return sessions, (pending[0] if pending else None)
+
+
+def _sleep_totals(sessions):
+    totals = defaultdict(lambda: [0, 0])
+    for started, ended in sessions:
+        t = totals[local_day(started)]
+        t[0] += 1
+        t[1] += int((ended - started).total_seconds() // 60)
+    return totals
+
+
+def _sleep_events(conn, first: date, last: date):
+    """
+    [first, last] に始まった睡眠セッションを組むのに必要な sleep / wake。
+    前後 MAX_SLEEP_SESSION ずつ広げて読む（前日から続く sleep・翌日の wake も見る）。
+    """
+    start = timeutil.day_start(first) - MAX_SLEEP_SESSION
+    end = timeutil.day_start(last + timedelta(days=1)) + MAX_SLEEP_SESSION
+    return [(r.timestamp, r.activity_type) for r in activity_logs.select_logs(conn, start, end, SLEEP_TYPES)]
+
+
+def refresh_sleep(conn, first: date, last: date = None):
+    """[first, last]（last を省略すると first の 1 日）に始まった睡眠セッションを数え直す。"""
+    last = last or first
+    sessions, _ = pair_sleep_sessions(_sleep_events(conn, first, last))
+    totals = _sleep_totals(sessions)
+
+    rows = []
+    day = first
+    while day <= last:
+        count, minutes = totals.get(day, (0, 0))
+        row = _empty(day)
+        row.update({"sleep_count": count, "sleep_minutes": minutes})
+        rows.append(row)
+        day += timedelta(days=1)
+    upsert(conn, DailyActivitySummary, rows, update_columns=list(SLEEP_COLUMNS))
+
+
+def apply_logs(conn, rows):
+    """
+    activity_logs に INSERT した行（activity_logs.to_row の形）を集計に反映する。
+    授乳・おむつは加算の UPSERT、睡眠はその前後 1 日のセッションを数え直す。
+    INSERT と同じトランザクションで呼ぶこと。
+    """
+    deltas = {}
+    sleep_days = set()
+    for log in rows:
+        day = local_day(log["timestamp"])
+        if log["activity_type"] in SLEEP_TYPES:
+            # 追加した sleep / wake で組み直しになりうるセッションの開始日（前後 1 日）
+            sleep_days.update((day - timedelta(days=1), day, day + timedelta(days=1)))
+            continue
+        _count(deltas.setdefault(day, _empty(day)), log)
+
+    if deltas:
+        upsert(conn, DailyActivitySummary, list(deltas.values()),
+               update_columns=[], increment_columns=COUNTER_COLUMNS)
+    if sleep_days:
+        refresh_sleep(conn, min(sleep_days), max(sleep_days))
+
+
+def rebuild(conn, first: date, last: date):
+    """
+    [first, last] の集計を activity_logs から作り直す。ログを 1 回なめるだけで済ませる。
+    """
+    start = timeutil.day_start(first)
+    end = timeutil.day_start(last + timedelta(days=1))
+    days = {}
+    events = []
+    # 初日より前から続く sleep と、最終日に始まった睡眠の wake を拾うため、前後 MAX_SLEEP_SESSION ずつ広げて読む
+    result = activity_logs.select_logs(
+        conn, start - MAX_SLEEP_SESSION, end + MAX_SLEEP_SESSION,
+        execution_options={"stream_results": True, "yield_per": 1000},
+    )
+    for log in result.mappings():
+        if start <= log["timestamp"] < end:
+            day = local_day(log["timestamp"])
+            _count(days.setdefault(day, _empty(day)), log)
+        if log["activity_type"] in SLEEP_TYPES:
+            events.append((log["timestamp"], log["activity_type"]))
+
+    sessions, _ = pair_sleep_sessions(events)
+    for day, (count, minutes) in _sleep_totals(sessions).items():
+        if first <= day <= last:
+            row = days.setdefault(day, _empty(day))
+            row["sleep_count"], row["sleep_minutes"] = count, minutes
+
+    table = DailyActivitySummary.__table__
+    conn.execute(delete(table).where(table.c.day >= first, table.c.day <= last))
+    if days:
+        conn.execute(table.insert(), list(days.values()))
+    return len(days)
+
+
+def startup(engine):
+    """
+    起動時に呼ぶ。daily_activity_summary が無ければ作る（記録 API は同じトランザクションで集計も更新するので、
+    テーブルが無いと記録ごと失敗する）。作ったあとは rebuild で既存のログから集計を作り直す。
+    """
+    table = DailyActivitySummary.__table__
+    try:
+        with engine.begin() as conn:
+            if inspect(conn).has_table(table.name):
+                return
+            table.create(conn)
+        print(f"{table.name} を作成しました（既存のログは python -m db_control.summary rebuild で集計してください）")
+    except Exception as e:
+        print(f"🟡 {table.name} の作成に失敗:", e)
+
+
+def select_summary(conn, first: date, last: date):
+    """[first, last] の集計を日付順に返す。記録のない日も 0 で埋める。"""
+    table = DailyActivitySummary.__table__
+    stored = {
+        r["day"]: dict(r)
+        for r in conn.execute(
+            select(table).where(table.c.day >= first, table.c.day <= last)
+        ).mappings()
+    }
+    days = []
+    day = first
+    while day <= last:
+        days.append(stored.get(day) or _empty(day))
+        day += timedelta(days=1)
+    return days
+
+
+def main():
+    parser = argparse.ArgumentParser(description="daily_activity_summary の再構築")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("rebuild", help="activity_logs から集計を作り直す")
+    p.add_argument("--from", dest="first", help="開始日 YYYY-MM-DD（省略時は最古のログ）")
+    p.add_argument("--to", dest="last", help="終了日 YYYY-MM-DD（省略時は今日）")
+    args = parser.parse_args()
+
+    from db_control.connect_MySQL import get_engine
+
+    engine = get_engine()
+    DailyActivitySummary.__table__.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        if args.first:
+            first = date.fromisoformat(args.first)
+        else:
+            oldest = activity_logs.oldest_timestamp(conn)
+            if oldest is None:
+                print("activity_logs が空です")
+                return
+            first = local_day(oldest)
+        last = date.fromisoformat(args.last) if args.last else datetime.now(timeutil.APP_TIMEZONE).date()
+        n = rebuild(conn, first, last)
+    print(f"rebuilt {n} days ({first} .. {last})")
+
+
+if __name__ == "__main__":
+    main()
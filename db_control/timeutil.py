@@ -0,0 +1,48 @@
+import os
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# 「1 日」の区切りに使うタイムゾーン（利用者の生活時間）
+APP_TIMEZONE = ZoneInfo(os.getenv("APP_TIMEZONE", "Asia/Tokyo"))
+# DB の DATETIME 列（タイムゾーンなし）に保存するときの基準タイムゾーン。
+# 既存の activity_logs は利用者の時刻（APP_TIMEZONE の壁時計）のまま入っているので、既定はそれに合わせる
+# （UTC で保存したい場合は、既存の行を UTC に直してから DB_TIMEZONE=UTC にする）
+DB_TIMEZONE = ZoneInfo(os.getenv("DB_TIMEZONE") or APP_TIMEZONE.key)
+
+
+def get_zone(name: str = None) -> ZoneInfo:
+    """タイムゾーン名から ZoneInfo を返す。未指定なら APP_TIMEZONE。不正な名前は ValueError。"""
+    if not name:
+        return APP_TIMEZONE
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"不明なタイムゾーンです: {name}")
+
+
+def to_db_time(dt: datetime) -> datetime:
+    """
+    DB に保存・比較するための naive datetime（DB_TIMEZONE 基準）に変換する。
+    タイムゾーンなしの値は既に DB_TIMEZONE 基準とみなしてそのまま返す。
+    """
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(DB_TIMEZONE).replace(tzinfo=None)
+
+
+def from_db_time(dt: datetime, tz: ZoneInfo = None) -> datetime:
+    """DB から読んだ naive datetime を tz（既定は APP_TIMEZONE）の aware datetime にする。"""
+    return dt.replace(tzinfo=DB_TIMEZONE).astimezone(tz or APP_TIMEZONE)
+
+
+def day_start(day: date, tz: ZoneInfo = None) -> datetime:
+    """tz における day の 0:00 を DB 基準の naive datetime で返す。"""
+    return to_db_time(datetime.combine(day, time.min, tzinfo=tz or APP_TIMEZONE))
+
+
+def day_range(day: date, tz: ZoneInfo = None):
+    """
+    tz における day の 1 日分を、DB 基準の半開区間 [start, end) で返す。
+    DATE(timestamp) = :d のように列に関数をかけずに済むので、timestamp のインデックスが使える。
+    """
+    return day_start(day, tz), day_start(day + timedelta(days=1), tz)
@@ -2,13 +2,49 @@
 
 import os
 import json
-import openai
+import time
+import asyncio
 
-# 環境変数から OpenAI API キーを取得
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise RuntimeError("環境変数 OPENAI_API_KEY が設定されていません。")
-client = openai.OpenAI(api_key=api_key)
+import llm_gateway
+import metrics
+import record_validator
+import rule_parser
+import tracing
+from ttl_cache import MISSING, TieredCache, build_shared_tier
+
+MODEL = "gpt-4o-mini"
+
+# LLM に渡すプロンプトの種類。full は例つきの SYSTEM_PROMPT と説明文つきの FUNC_DEF、
+# compact は指示を短くして選択肢を enum で渡す版（入力トークンが少ない）
+PROMPT_MODE = os.getenv("PROMPT_MODE", "full")
+
+# ルールベースの結果をそのまま採用する確信度のしきい値。これ未満なら LLM に問い合わせる
+RULE_MIN_CONFIDENCE = float(os.getenv("RULE_PARSER_MIN_CONFIDENCE", "0.8"))
+
+PARSE_REQUESTS = metrics.counter(
+    "parser_requests_total", "parse_utterance の処理件数（path=rule/cache/llm/error）", ["path"])
+PARSE_LATENCY = metrics.histogram(
+    "parser_latency_seconds", "parse_utterance の処理時間（path=rule/cache/llm/error）", ["path"])
+LLM_TOKENS = metrics.counter(
+    "parser_llm_tokens_total",
+    "LLM 呼び出しのトークン数（kind=prompt/cached/completion、cached はプロンプトキャッシュに載った分）",
+    ["mode", "kind"])
+
+# バッチ解析で同時に LLM へ投げる件数の上限
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "5"))
+
+# LLM の結果キャッシュ（正規化した発話 → timestamp を除いた構造化結果）
+# PARSE_CACHE_SHARED: 未設定なら各プロセス内のみ、"db" ならアプリの DB、それ以外は SQLAlchemy URL
+PARSE_CACHE_TTL = float(os.getenv("PARSE_CACHE_TTL", "86400"))
+parse_cache = TieredCache(
+    "parse_utterance",
+    maxsize=int(os.getenv("PARSE_CACHE_SIZE", "10000")),
+    ttl=PARSE_CACHE_TTL,
+    shared=build_shared_tier(os.getenv("PARSE_CACHE_SHARED", ""), "parse_utterance", PARSE_CACHE_TTL),
+)
+
+# OpenAI の呼び出しは llm_gateway を通す（同時実行数・流量制限・再試行・同一リクエストの相乗り）。
+# クライアントはゲートウェイが最初の LLM 呼び出しで作る
 
 # ─────────────────────────────────────────────────────────────────────
 # SYSTEM_PROMPT を拡張して、「授乳」「排せつ」「睡眠／起床」を分類し、
@@ -99,28 +135,84 @@ FUNC_DEF = [{
     }
 }]
 
+# ─────────────────────────────────────────────────────────────────────
+# compact モード用のプロンプトとスキーマ。
+# 取りうる値はスキーマの enum で示し、説明文と例は最小限にする。
+# timestamp はサーバー側で recorded_at に置き換えるので、モデルには生成させない。
+# システムメッセージとスキーマは定数のまま送り、発話は最後のメッセージにだけ入れる
+# （プロンプトの先頭部分が毎回同じバイト列になり、プロバイダー側のプロンプトキャッシュが効く）。
+# ─────────────────────────────────────────────────────────────────────
+SYSTEM_PROMPT_COMPACT = (
+    "赤ちゃんの育児記録の発話を record_feed の引数に変換する。"
+    "その活動に関係しない項目は空文字、volume は 0 にする。\n"
+    "例: うんちが出て量多めで少し固かった → "
+    '{"activity_type":"diaper","diaper_type":"うんち","hardness":"固い","diaper_amount":"多め"}'
+)
 
-def parse_utterance(utterance: str, recorded_at: str):
-    """
-    utterance: ユーザーの発話テキスト
-    recorded_at: ISO 8601 形式の文字列（例: "2025-06-02T10:00:00Z"）
-    戻り値は、上記スキーマを満たす辞書オブジェクト。
-    """
-    # 1) Chat API へ投げるメッセージを準備
-    msgs = [
-        {"role": "system",  "content": SYSTEM_PROMPT},
+FUNC_DEF_COMPACT = [{
+    "name": "record_feed",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "activity_type": {"type": "string", "enum": ["feeding", "diaper", "sleep", "wake"]},
+            "milktype": {"type": "string", "enum": ["ミルク", "母乳", "不明", ""]},
+            "volume": {"type": "integer", "description": "mL"},
+            "diaper_type": {"type": "string", "enum": ["おしっこ", "うんち", ""]},
+            "hardness": {"type": "string", "enum": ["固い", "普通", "やわらかい", ""]},
+            "diaper_amount": {"type": "string", "enum": ["少量", "普通", "多め", ""]},
+            "sleep_state": {"type": "string", "enum": ["sleep", "wake", ""]},
+        },
+        "required": ["activity_type"],
+    },
+}]
+
+PROMPTS = {
+    "full": (SYSTEM_PROMPT, FUNC_DEF),
+    "compact": (SYSTEM_PROMPT_COMPACT, FUNC_DEF_COMPACT),
+}
+if PROMPT_MODE not in PROMPTS:
+    raise ValueError(f"PROMPT_MODE は {' / '.join(PROMPTS)} のいずれかを指定してください: {PROMPT_MODE}")
+
+
+def _build_messages(utterance: str, mode: str = None):
+    """Chat API へ投げるメッセージを組み立てる。"""
+    system_prompt, _ = PROMPTS[mode or PROMPT_MODE]
+    return [
+        {"role": "system",  "content": system_prompt},
         {"role": "user",    "content": utterance}
     ]
 
-    # 2) Function Calling を指定して GPT に構造化データを返してもらう
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=msgs,
-        functions=FUNC_DEF,
-        function_call={"name": "record_feed"}
-    )
 
-    # 3) 戻ってきた function_call.arguments をパース
+def _request_kwargs(utterance: str, mode: str = None) -> dict:
+    """parse_utterance が LLM に送るリクエスト（モデル・メッセージ・スキーマ）。"""
+    mode = mode or PROMPT_MODE
+    _, functions = PROMPTS[mode]
+    return {
+        "model": MODEL,
+        "messages": _build_messages(utterance, mode),
+        "functions": functions,
+        "function_call": {"name": "record_feed"},
+    }
+
+
+def _observe_usage(resp, mode: str = None):
+    """レスポンスの usage からトークン数を記録する（usage がなければ何もしない）。"""
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return
+    mode = mode or PROMPT_MODE
+    details = getattr(usage, "prompt_tokens_details", None)
+    LLM_TOKENS.inc(usage.prompt_tokens or 0, mode=mode, kind="prompt")
+    LLM_TOKENS.inc(getattr(details, "cached_tokens", None) or 0, mode=mode, kind="cached")
+    LLM_TOKENS.inc(usage.completion_tokens or 0, mode=mode, kind="completion")
+
+
+def _to_record(resp, recorded_at: str):
+    """
+    Chat API のレスポンスから function_call.arguments を取り出し、
+    スキーマに沿った辞書へ整形する（record_validator で値を検証・正規化する）。
+    """
+    # 戻ってきた function_call.arguments をパース
     choice = resp.choices[0].message
     if not hasattr(choice, "function_call") or choice.function_call is None:
         # もし function_call が返ってこなければ、エラーとして扱う
@@ -129,19 +221,144 @@ def parse_utterance(utterance: str, recorded_at: str):
     args_json = choice.function_call.arguments
     data = json.loads(args_json)
 
-    # 4) recorded_at を必ず timestamp として上書きする
+    # recorded_at を必ず timestamp として上書きする
     data["timestamp"] = recorded_at
 
-    # 5) feeding 以外のアクティビティでは不要フィールドを空文字または 0 に整形する
-    activity = data.get("activity_type", "")
-    if activity != "feeding":
-        data["milktype"] = ""
-        data["volume"] = 0
-    if activity != "diaper":
-        data["diaper_type"] = ""
-        data["hardness"] = ""
-        data["diaper_amount"] = ""
-    if activity not in ["sleep", "wake"]:
-        data["sleep_state"] = ""
+    # 同義語を正規の値に直し、activity_type に関係しない項目を空文字または 0 に整形する。
+    # DB に保存できない値（不明な activity_type・長すぎる文字列）は RecordValidationError
+    return record_validator.validate_record(data)
 
+
+def _parse_by_rules(utterance: str, recorded_at: str):
+    """ルールで確信を持って判定できた場合だけ結果を返す。それ以外は None。"""
+    data, confidence = rule_parser.parse(utterance)
+    if data is None or confidence < RULE_MIN_CONFIDENCE:
+        return None
+    data["timestamp"] = recorded_at
     return data
+
+
+def _cache_key(utterance: str) -> str:
+    """
+    キャッシュキーを作る。NFKC 正規化で全角数字・英字を半角に畳み、空白を取り除く。
+    モデルやプロンプトを変えたときに古い結果を使わないよう、モデル名とプロンプトの種類も含める。
+    """
+    return f"{MODEL}:{PROMPT_MODE}:{rule_parser.normalize(utterance)}"
+
+
+def _from_cache(cached, recorded_at: str):
+    data = dict(cached)
+    data["timestamp"] = recorded_at
+    return data
+
+
+def _to_cache(data: dict):
+    # timestamp はリクエストごとに recorded_at で上書きするのでキャッシュしない
+    return {k: v for k, v in data.items() if k != "timestamp"}
+
+
+def _observe(path: str, started: float):
+    PARSE_REQUESTS.inc(path=path)
+    PARSE_LATENCY.observe(time.perf_counter() - started, path=path)
+
+
+def parse_utterance(utterance: str, recorded_at: str):
+    """
+    utterance: ユーザーの発話テキスト
+    recorded_at: ISO 8601 形式の文字列（例: "2025-06-02T10:00:00Z"）
+    戻り値は、上記スキーマを満たす辞書オブジェクト。
+    定型的な発話はルールベースで処理し、判定できないものだけ GPT に問い合わせる。
+    """
+    started = time.perf_counter()
+    data = _parse_by_rules(utterance, recorded_at)
+    if data is not None:
+        _observe("rule", started)
+        return data
+
+    key = _cache_key(utterance)
+    cached = parse_cache.get(key)
+    if cached is not MISSING:
+        _observe("cache", started)
+        return _from_cache(cached, recorded_at)
+
+    # Function Calling を指定して GPT に構造化データを返してもらう
+    try:
+        with tracing.span("llm.request", model=MODEL):
+            resp = llm_gateway.chat_sync(**_request_kwargs(utterance))
+        _observe_usage(resp)
+        with tracing.span("json.decode"):
+            data = _to_record(resp, recorded_at)
+    except Exception:
+        # LLM 呼び出しや検証（RecordValidationError）で失敗したものも件数・レイテンシに含める
+        _observe("error", started)
+        raise
+    parse_cache.set(key, _to_cache(data))
+    _observe("llm", started)
+    return data
+
+
+async def parse_utterance_async(utterance: str, recorded_at: str):
+    """
+    parse_utterance の非同期版。
+    AsyncOpenAI を使うため、LLM の応答待ちの間もイベントループは他のリクエストを処理できる。
+    """
+    started = time.perf_counter()
+    data = _parse_by_rules(utterance, recorded_at)
+    if data is not None:
+        _observe("rule", started)
+        return data
+
+    key = _cache_key(utterance)
+    cached = await parse_cache.aget(key)
+    if cached is not MISSING:
+        _observe("cache", started)
+        return _from_cache(cached, recorded_at)
+
+    try:
+        with tracing.span("llm.request", model=MODEL):
+            resp = await llm_gateway.chat(**_request_kwargs(utterance))
+        _observe_usage(resp)
+        with tracing.span("json.decode"):
+            data = _to_record(resp, recorded_at)
+    except Exception:
+        _observe("error", started)
+        raise
+    await parse_cache.aset(key, _to_cache(data))
+    _observe("llm", started)
+    return data
+
+
+async def parse_utterances_async(items):
+    """
+    複数の発話をまとめて構造化する。
+    items: (utterance, recorded_at) のリスト
+    戻り値は items と同じ順のリストで、失敗した要素には例外オブジェクト（CancelledError を含む）が入る。
+    ルール / キャッシュで済むものは即座に返り、LLM 呼び出しは BATCH_LLM_CONCURRENCY 件までに絞る。
+    """
+    sem = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+    async def one(utterance, recorded_at):
+        async with sem:
+            return await parse_utterance_async(utterance, recorded_at)
+
+    return await asyncio.gather(*(one(u, r) for u, r in items), return_exceptions=True)
+
+
+def parser_stats():
+    """経路（rule / cache / llm / error）ごとのヒット率とレイテンシ、キャッシュの状態を返す。"""
+    paths = ("rule", "cache", "llm", "error")
+    total = sum(PARSE_REQUESTS.value(path=p) for p in paths)
+    stats = {"total": total, "paths": {}, "cache": parse_cache.stats(), "prompt_mode": PROMPT_MODE,
+             "tokens": {kind: LLM_TOKENS.value(mode=PROMPT_MODE, kind=kind)
+                        for kind in ("prompt", "cached", "completion")}}
+    for path in paths:
+        count = PARSE_REQUESTS.value(path=path)
+        p50 = PARSE_LATENCY.quantile(0.5, path=path)
+        p95 = PARSE_LATENCY.quantile(0.95, path=path)
+        stats["paths"][path] = {
+            "count": count,
+            "hit_rate": count / total if total else 0.0,
+            "p50_ms": p50 * 1000 if p50 is not None else None,
+            "p95_ms": p95 * 1000 if p95 is not None else None,
+        }
+    return stats
@@ -0,0 +1,177 @@
+# http_client.py
+"""
+外部 API を呼ぶための共有 HTTP クライアント（httpx.AsyncClient）。
+
+リクエストごとにクライアントを作ると、毎回 DNS 解決・TCP 接続・TLS ハンドシェイクからやり直しになる。
+ここで作った 1 つのクライアントを使い回し、接続をキープアライブで再利用する。
+- 接続プールの上限とキープアライブ（HTTP_MAX_CONNECTIONS / HTTP_MAX_KEEPALIVE / HTTP_KEEPALIVE_EXPIRY）。
+  同時に送るのは HTTP_MAX_CONNECTIONS 件までで、それを超えた分は順番待ちにする
+- HTTP/2（h2 パッケージを別に入れたときだけ使う。requirements.txt には含めていないので既定は HTTP/1.1。
+  pip install "httpx[http2]" で有効になり、HTTP2=0 で無効にできる）
+- 接続・全体のタイムアウト（HTTP_CONNECT_TIMEOUT / HTTP_TIMEOUT）と、接続失敗時の 1 回の再試行
+- get_json(): GET の JSON 応答を TTL 付きでキャッシュする（HTTP_CACHE_SIZE / HTTP_CACHE_TTL）。
+  キャッシュにない同じ GET が同時に来たら 1 回だけ呼んで結果を共有する
+
+FastAPI の lifespan で start() / aclose() を呼ぶ。lifespan の外（スクリプトなど）では
+初回利用時にクライアントを作る。接続はイベントループに結びつくので、クライアントはループごとに持つ。
+"""
+import asyncio
+import importlib.util
+import os
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import metrics
+from ttl_cache import MISSING, TTLCache
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+# h2 が入っているときだけ HTTP/2 を使う（入っていなければ HTTP/1.1 のキープアライブ）
+HTTP2 = os.getenv("HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+HTTP_CACHE_TTL = float(os.getenv("HTTP_CACHE_TTL", "60"))
+
+REQUESTS = metrics.counter(
+    "http_client_requests_total", "外部 API への GET の件数（outcome=ok/error/cache/coalesced）", ["host", "outcome"])
+LATENCY = metrics.histogram("http_client_request_duration_seconds", "外部 API の応答時間", ["host"])
+
+response_cache = TTLCache("http_client", maxsize=int(os.getenv("HTTP_CACHE_SIZE", "256")), ttl=HTTP_CACHE_TTL)
+
+_clients = weakref.WeakKeyDictionary()
+_semaphores = weakref.WeakKeyDictionary()
+# キャッシュにない GET の実行中のもの（イベントループごと）
+_inflight = weakref.WeakKeyDictionary()
+
+
+def _new_client():
+    import httpx
+
+    limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                          keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+    # retries は接続の確立に失敗したときだけ再試行する（送信済みのリクエストは再送しない）
+    transport = httpx.AsyncHTTPTransport(http2=HTTP2, limits=limits, retries=1)
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        headers={"User-Agent": "step3-1_backend"},
+        follow_redirects=True,
+    )
+
+
+def get_client():
+    """実行中のイベントループ用の共有クライアントを返す。なければ作る。"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = _new_client()
+    return client
+
+
+async def start():
+    """lifespan の開始時に呼ぶ。最初のリクエストを待たずにクライアントを用意する。"""
+    get_client()
+
+
+async def aclose():
+    """lifespan の終了時に呼ぶ。プールの接続を閉じる。"""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _max_age(response):
+    """Cache-Control から保存してよい秒数を返す（no-store / private / no-cache なら 0、指定なしは None）。"""
+    directives = [d.strip().lower() for d in response.headers.get("cache-control", "").split(",")]
+    if any(d in ("no-store", "no-cache", "private") for d in directives):
+        return 0
+    for d in directives:
+        if d.startswith("max-age="):
+            try:
+                return max(0, int(d[len("max-age="):]))
+            except ValueError:
+                return None
+    return None
+
+
+def _semaphore():
+    # httpcore のプールは待っているリクエストごとに全接続を調べるので、待ち行列が長いと CPU を食う。
+    # 接続数を超える分はプールに入れず、このセマフォで待たせる
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(HTTP_MAX_CONNECTIONS)
+    return semaphore
+
+
+async def _fetch_json(url, params, headers, host):
+    started = time.perf_counter()
+    try:
+        async with _semaphore():
+            response = await get_client().get(url, params=params, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+    except Exception:
+        REQUESTS.inc(host=host, outcome="error")
+        raise
+    finally:
+        LATENCY.observe(time.perf_counter() - started, host=host)
+    REQUESTS.inc(host=host, outcome="ok")
+    return data, _max_age(response)
+
+
+async def get_json(url: str, params: dict = None, headers: dict = None, ttl: float = None):
+    """
+    GET して JSON を返す。2xx 以外は httpx.HTTPStatusError、通信エラーは httpx.HTTPError。
+    ttl 秒（省略時は応答の Cache-Control: max-age、なければ HTTP_CACHE_TTL）だけ結果をキャッシュする。
+    ttl=0 ならキャッシュを使わない。返り値はキャッシュと共有しているので書き換えないこと。
+    キャッシュにない同じ GET が同時に来たら、外部 API は 1 回だけ呼んで結果を共有する。
+    """
+    host = urlsplit(url).hostname or ""
+    if ttl == 0:
+        data, _ = await _fetch_json(url, params, headers, host)
+        return data
+
+    key = (url, tuple(sorted((params or {}).items())), tuple(sorted((headers or {}).items())))
+    cached = response_cache.get(key)
+    if cached is not MISSING:
+        REQUESTS.inc(host=host, outcome="cache")
+        return cached
+
+    loop = asyncio.get_running_loop()
+    inflight = _inflight.setdefault(loop, {})
+    future = inflight.get(key)
+    if future is not None:
+        REQUESTS.inc(host=host, outcome="coalesced")
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # この呼び出し自体がキャンセルされた
+                raise
+        # 先に呼んだ側がキャンセルされた（クライアントの切断など）。こちらはキャンセルされていないので取り直す
+        return await get_json(url, params, headers, ttl)
+
+    future = inflight[key] = loop.create_future()
+    try:
+        data, max_age = await _fetch_json(url, params, headers, host)
+    except Exception as e:
+        future.set_exception(e)
+        # 待っている呼び出しがなければ例外を回収済みにしておく（未取得の警告を出さない）
+        future.exception()
+        raise
+    else:
+        future.set_result(data)
+    finally:
+        inflight.pop(key, None)
+        if not future.done():
+            # キャンセルなど Exception 以外で抜けた。待っている呼び出しには例外を渡さず、取り直させる
+            future.cancel()
+
+    if ttl is None:
+        ttl = HTTP_CACHE_TTL if max_age is None else max_age
+    if ttl > 0:
+        response_cache.set(key, data, ttl)
+    return data
@@ -0,0 +1,384 @@
+# llm_gateway.py
+"""
+OpenAI Chat Completions の呼び出しをまとめて制御するゲートウェイ。
+
+gpt_parser と /ai_gpt はここを通して LLM を呼ぶ。
+- 同時実行数の上限（LLM_MAX_CONCURRENCY）
+- トークンバケットによる流量制限（LLM_RPM / LLM_BURST。契約のレート上限に合わせる）
+- 1 回ごとのタイムアウトと、全体の期限（LLM_TIMEOUT / LLM_DEADLINE）の中でのジッター付き再試行
+- 同じリクエストが同時に来たら 1 回だけ呼んで結果を共有する（single-flight）
+- stream(): トークンを届いた順に返すストリーミング呼び出し（打ち切ると上流も閉じる）
+
+上限を超えて待たされた数・待ち時間は metrics に記録する。
+クライアントは初回利用時に作る。テストやベンチマークでは set_clients() で差し替えるか、
+OPENAI_BASE_URL をローカルのスタブサーバー（benchmarks/stub_llm_server.py）に向ける。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import weakref
+
+import anyio
+
+import metrics
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# 1 分あたりのリクエスト数の上限（0 なら制限しない）と、瞬間的に許すまとまりの大きさ
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 8.0
+
+QUEUE_DEPTH = metrics.gauge("llm_queue_depth", "同時実行数・流量の上限で LLM 呼び出しを待っている数")
+IN_FLIGHT = metrics.gauge("llm_in_flight", "実行中の LLM 呼び出しの数")
+WAIT = metrics.histogram("llm_wait_seconds", "LLM 呼び出しが上限で待たされた時間")
+LATENCY = metrics.histogram("llm_request_duration_seconds", "LLM API 1 回あたりの応答時間", ["outcome"])
+RETRIES = metrics.counter("llm_retries_total", "LLM 呼び出しの再試行回数（reason=rate_limit/timeout/...）", ["reason"])
+COALESCED = metrics.counter("llm_coalesced_total", "実行中の同一リクエストに相乗りして API 呼び出しを省いた回数")
+TIME_TO_FIRST_CHUNK = metrics.histogram(
+    "llm_time_to_first_chunk_seconds", "ストリーミング呼び出しで最初のチャンクが届くまでの時間")
+STREAMS_ABANDONED = metrics.counter(
+    "llm_streams_abandoned_total", "クライアントの切断などで途中で打ち切ったストリームの数")
+FAILURES = metrics.counter("llm_failures_total", "再試行しても失敗した LLM 呼び出しの数", ["reason"])
+
+
+class LLMUnavailableError(RuntimeError):
+    """流量制限・タイムアウト・上流の障害で、期限内に応答を得られなかったことを表す。"""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    1 秒あたり rate 個補充され、最大 burst 個まで貯まるトークンバケット（スレッドセーフ）。
+    reserve() は 1 個を予約し、使えるようになるまでの秒数を返す（呼び出し側で待つ）。
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+def _retry_reason(error: Exception):
+    """再試行すべき例外なら理由を、そうでなければ None を返す。"""
+    import openai
+
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(error, (openai.APITimeoutError, TimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    if isinstance(error, openai.InternalServerError):
+        return "server_error"
+    return None
+
+
+def _retry_after(error: Exception):
+    """429 / 503 の Retry-After ヘッダー（秒）があれば返す。"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _backoff(attempt: int, error: Exception) -> float:
+    # full jitter: 同時に失敗した呼び出しが同じタイミングで再試行しないようにする
+    delay = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+    return max(delay, _retry_after(error) or 0.0)
+
+
+def _next_delay(attempt: int, error: Exception, deadline: float, max_retries: int) -> float:
+    """
+    失敗した呼び出しを再試行するまでの待ち時間を返す。
+    再試行できない例外はそのまま、回数か期限を使い切ったら LLMUnavailableError を投げる。
+    """
+    reason = _retry_reason(error)
+    if reason is None:
+        raise error
+    delay = _backoff(attempt, error)
+    if attempt >= max_retries or time.monotonic() + delay >= deadline:
+        FAILURES.inc(reason=reason)
+        raise LLMUnavailableError(f"LLM の呼び出しに失敗しました（{reason}）",
+                                  retry_after=_retry_after(error)) from error
+    RETRIES.inc(reason=reason)
+    return delay
+
+
+def _request_key(kwargs) -> str:
+    return hashlib.sha256(json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, rpm: float = LLM_RPM, burst: int = LLM_BURST,
+                 timeout: float = LLM_TIMEOUT, deadline: float = LLM_DEADLINE, max_retries: int = LLM_MAX_RETRIES):
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.bucket = TokenBucket(rpm / 60, burst)
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self._client = None
+        self._async_client = None
+        self._client_lock = threading.Lock()
+        self._sync_semaphore = threading.BoundedSemaphore(max_concurrency)
+        # asyncio のセマフォと実行中リクエストはイベントループごとに持つ
+        self._loop_state = weakref.WeakKeyDictionary()
+
+    # ── クライアント ──────────────────────────────────────────────────
+    def set_clients(self, client=None, async_client=None):
+        """テスト用に OpenAI クライアント（または同じ形のオブジェクト）を差し替える。"""
+        self._client = client
+        self._async_client = async_client
+
+    def _new_client(self, cls_name: str):
+        import openai
+
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("環境変数 OPENAI_API_KEY が設定されていません。")
+        # 再試行とタイムアウトはゲートウェイで制御するので、SDK 側の再試行は切る
+        return getattr(openai, cls_name)(api_key=api_key, max_retries=0, timeout=self.timeout)
+
+    def get_client(self):
+        """同期版の OpenAI クライアントを返す。初回呼び出し時に作成する。"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._new_client("OpenAI")
+        return self._client
+
+    def get_async_client(self):
+        """非同期版の OpenAI クライアントを返す。初回呼び出し時に作成する。"""
+        if self._async_client is None:
+            with self._client_lock:
+                if self._async_client is None:
+                    self._async_client = self._new_client("AsyncOpenAI")
+        return self._async_client
+
+    # ── 非同期 ────────────────────────────────────────────────────────
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loop_state.get(loop)
+        if state is None:
+            state = self._loop_state[loop] = (asyncio.Semaphore(self.max_concurrency), {})
+        return state
+
+    async def chat(self, **kwargs):
+        """
+        chat.completions.create を制御付きで呼ぶ。kwargs はそのまま API に渡す。
+        期限内に応答が得られなければ LLMUnavailableError。
+        同じ kwargs の呼び出しが実行中なら、その結果を待って共有する。
+        """
+        _, inflight = self._state()
+        key = _request_key(kwargs)
+        future = inflight.get(key)
+        if future is not None:
+            COALESCED.inc()
+            try:
+                # 相乗りした側がキャンセルされても、元の呼び出しは止めない
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    # この呼び出し自体がキャンセルされた
+                    raise
+            # 元の呼び出しがキャンセルされた（クライアントの切断など）。こちらはキャンセルされていないので呼び直す
+            return await self.chat(**kwargs)
+
+        future = asyncio.get_running_loop().create_future()
+        inflight[key] = future
+        try:
+            result = await self._call_with_retry(kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            # 相乗りがいなくても「取り出されなかった例外」の警告を出さないよう、ここで一度取り出す
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            inflight.pop(key, None)
+            if not future.done():
+                # キャンセルなど Exception 以外で抜けた。相乗りした側には例外を渡さず、呼び直させる
+                future.cancel()
+
+    async def _acquire(self, semaphore):
+        """同時実行数の枠とトークンを 1 つずつ取る。待った時間を記録する。"""
+        waited = time.perf_counter()
+        QUEUE_DEPTH.inc()
+        try:
+            await semaphore.acquire()
+            try:
+                delay = self.bucket.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+            except BaseException:
+                semaphore.release()
+                raise
+        finally:
+            QUEUE_DEPTH.dec()
+        WAIT.observe(time.perf_counter() - waited)
+
+    async def _call_with_retry(self, kwargs):
+        semaphore, _ = self._state()
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            await self._acquire(semaphore)
+            remaining = deadline - time.monotonic()
+            started = time.perf_counter()
+            IN_FLIGHT.inc()
+            try:
+                if remaining <= 0:
+                    raise TimeoutError()
+                timeout = min(self.timeout, remaining)
+                # SDK のタイムアウトが効かない場合（差し替えたクライアントなど）に備えて外側でも打ち切る
+                result = await asyncio.wait_for(
+                    self.get_async_client().chat.completions.create(**kwargs, timeout=timeout), timeout + 1)
+                LATENCY.observe(time.perf_counter() - started, outcome="ok")
+                return result
+            except Exception as e:
+                LATENCY.observe(time.perf_counter() - started, outcome="error")
+                delay = _next_delay(attempt, e, deadline, self.max_retries)
+                attempt += 1
+            finally:
+                IN_FLIGHT.dec()
+                semaphore.release()
+            await asyncio.sleep(delay)
+
+    async def stream(self, **kwargs):
+        """
+        stream=True で呼び、届いたチャンクを順に返す非同期ジェネレーター。
+        再試行は最初のチャンクを受け取るまで（接続・429 など）。ストリームの途中で失敗したらそのまま例外を投げる。
+        呼び出し側がジェネレーターを閉じる・キャンセルされると、上流の接続も閉じて生成を打ち切る。
+        同時実行数の枠はストリームを読み終えるまで持ち続ける。
+        """
+        semaphore, _ = self._state()
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            await self._acquire(semaphore)
+            started = time.perf_counter()
+            IN_FLIGHT.inc()
+            upstream = None
+            try:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        raise TimeoutError()
+                    timeout = min(self.timeout, remaining)
+                    # ストリームでは timeout はチャンク間の読み取り待ちにも効く
+                    upstream = await asyncio.wait_for(
+                        self.get_async_client().chat.completions.create(**kwargs, stream=True, timeout=timeout),
+                        timeout + 1)
+                    first = await upstream.__anext__()
+                except StopAsyncIteration:
+                    return
+                except Exception as e:
+                    LATENCY.observe(time.perf_counter() - started, outcome="error")
+                    delay = _next_delay(attempt, e, deadline, self.max_retries)
+                    attempt += 1
+                else:
+                    TIME_TO_FIRST_CHUNK.observe(time.perf_counter() - started)
+                    yield first
+                    async for chunk in upstream:
+                        yield chunk
+                    LATENCY.observe(time.perf_counter() - started, outcome="ok")
+                    return
+            except (GeneratorExit, asyncio.CancelledError):
+                STREAMS_ABANDONED.inc()
+                raise
+            finally:
+                if upstream is not None:
+                    # キャンセル中でも上流の接続は確実に閉じる（閉じないと生成が最後まで続き課金される）
+                    with anyio.CancelScope(shield=True):
+                        await upstream.close()
+                IN_FLIGHT.dec()
+                semaphore.release()
+            await asyncio.sleep(delay)
+
+    # ── 同期（バッチ処理・スクリプト用） ──────────────────────────────────
+    def chat_sync(self, **kwargs):
+        """chat の同期版。single-flight は行わない。"""
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            waited = time.perf_counter()
+            QUEUE_DEPTH.inc()
+            try:
+                self._sync_semaphore.acquire()
+            finally:
+                QUEUE_DEPTH.dec()
+            try:
+                delay = self.bucket.reserve()
+                if delay:
+                    time.sleep(delay)
+                WAIT.observe(time.perf_counter() - waited)
+                remaining = deadline - time.monotonic()
+                started = time.perf_counter()
+                IN_FLIGHT.inc()
+                try:
+                    if remaining <= 0:
+                        raise TimeoutError()
+                    result = self.get_client().chat.completions.create(
+                        **kwargs, timeout=min(self.timeout, remaining))
+                    LATENCY.observe(time.perf_counter() - started, outcome="ok")
+                    return result
+                except Exception as e:
+                    LATENCY.observe(time.perf_counter() - started, outcome="error")
+                    delay = _next_delay(attempt, e, deadline, self.max_retries)
+                    attempt += 1
+                finally:
+                    IN_FLIGHT.dec()
+            finally:
+                self._sync_semaphore.release()
+            time.sleep(delay)
+
+    def stats(self):
+        p50 = WAIT.quantile(0.5)
+        p95 = WAIT.quantile(0.95)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "rpm": self.rpm,
+            "queue_depth": QUEUE_DEPTH.value(),
+            "in_flight": IN_FLIGHT.value(),
+            "wait_p50_ms": p50 * 1000 if p50 is not None else None,
+            "wait_p95_ms": p95 * 1000 if p95 is not None else None,
+            "coalesced": COALESCED.value(),
+            "retries": {s["labels"]["reason"]: s["value"] for s in RETRIES.snapshot()},
+            "failures": {s["labels"]["reason"]: s["value"] for s in FAILURES.snapshot()},
+        }
+
+
+# アプリ全体で共有するゲートウェイ
+gateway = LLMGateway()
+chat = gateway.chat
+stream = gateway.stream
+chat_sync = gateway.chat_sync
+get_client = gateway.get_client
+get_async_client = gateway.get_async_client
@@ -0,0 +1,315 @@
+# record_validator.py
+"""
+構造化したログ（LLM・ルールベース・一括取り込みの結果）を、
+activity_logs に保存できる値にそろえる検証・正規化。
+
+- 同義語を正規の値に置き換える（例: "やや固い" → "固い"、"おっぱい" → "母乳"）
+- activity_type に関係しない項目を空文字 / 0 にする
+- volume を整数にして 0〜RECORD_VOLUME_MAX に収める（配列・真偽値・NaN・無限大は不正として弾く）
+- 列の長さ（ActivityLog の String(n)）を超える文字列や、不明な activity_type は不正として弾く
+
+validate_record() は 1 件の辞書、validate_columns() は項目ごとのリスト（列形式）、
+validate_records() は辞書のリストを受け取る。
+列形式では列に現れる値の種類ごとに 1 回だけ正規化して列全体に当てはめるので、
+同じ値が繰り返し出てくる大量のレコードを速く処理できる。
+
+    RECORD_VOLUME_MAX  1 回の授乳量として受け付ける上限（mL、既定 500）
+"""
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+import metrics
+from db_control.mymodels_MySQL import ActivityLog
+
+RECORD_VOLUME_MAX = int(os.getenv("RECORD_VOLUME_MAX", "500"))
+
+FIXES = metrics.counter(
+    "record_validator_fixes_total",
+    "検証で値を直した・弾いた件数（action=synonym/coerce/default/clamp/reject）",
+    ["field", "action"])
+
+ACTIVITY_TYPES = ("feeding", "diaper", "sleep", "wake")
+
+# 項目ごとの正規の値・同義語・既定値と、その項目を使う activity_type
+FIELDS = {
+    "activity_type": {
+        "values": ACTIVITY_TYPES,
+        "synonyms": {
+            "feed": "feeding", "授乳": "feeding", "ミルク": "feeding", "母乳": "feeding",
+            "おむつ": "diaper", "排せつ": "diaper", "排泄": "diaper", "おむつ替え": "diaper",
+            "睡眠": "sleep", "寝た": "sleep", "ねんね": "sleep", "asleep": "sleep",
+            "起床": "wake", "起きた": "wake", "awake": "wake", "wakeup": "wake", "wake_up": "wake",
+        },
+        "default": None,
+        "applies_to": ACTIVITY_TYPES,
+    },
+    "milktype": {
+        "values": ("ミルク", "母乳", "不明"),
+        "synonyms": {
+            "粉ミルク": "ミルク", "液体ミルク": "ミルク", "formula": "ミルク", "milk": "ミルク",
+            "おっぱい": "母乳", "breast": "母乳", "breastmilk": "母乳", "搾乳": "母乳",
+            "unknown": "不明",
+        },
+        "default": "不明",
+        "applies_to": ("feeding",),
+    },
+    "diaper_type": {
+        "values": ("おしっこ", "うんち"),
+        "synonyms": {
+            "しっこ": "おしっこ", "尿": "おしっこ", "pee": "おしっこ",
+            "うんこ": "うんち", "便": "うんち", "poo": "うんち", "poop": "うんち", "両方": "うんち",
+        },
+        "default": "",
+        "applies_to": ("diaper",),
+    },
+    "hardness": {
+        "values": ("固い", "普通", "やわらかい"),
+        "synonyms": {
+            "やや固い": "固い", "少し固い": "固い", "かため": "固い", "硬い": "固い", "かたい": "固い",
+            "固め": "固い", "硬め": "固い",
+            "ふつう": "普通", "通常": "普通",
+            "やわらかめ": "やわらかい", "柔らかい": "やわらかい", "柔らかめ": "やわらかい",
+            "ややゆるい": "やわらかい", "ゆるい": "やわらかい", "ゆるめ": "やわらかい", "軟便": "やわらかい",
+            "水っぽい": "やわらかい", "下痢": "やわらかい",
+        },
+        "default": "",
+        "applies_to": ("diaper",),
+    },
+    "diaper_amount": {
+        "values": ("少量", "普通", "多め"),
+        "synonyms": {
+            "少なめ": "少量", "少ない": "少量", "ちょっと": "少量", "少し": "少量",
+            "ふつう": "普通", "通常": "普通",
+            "多い": "多め", "たくさん": "多め", "大量": "多め", "いっぱい": "多め",
+        },
+        "default": "",
+        "applies_to": ("diaper",),
+    },
+    "sleep_state": {
+        "values": ("sleep", "wake"),
+        "synonyms": {"睡眠": "sleep", "寝た": "sleep", "asleep": "sleep", "起床": "wake", "起きた": "wake",
+                     "awake": "wake"},
+        "default": "",
+        "applies_to": ("sleep", "wake"),
+    },
+}
+
+# 列の長さはモデル定義から取る（String(10) なら 10）
+MAX_LENGTHS = {name: ActivityLog.__table__.c[name].type.length for name in FIELDS}
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+class RecordValidationError(ValueError):
+    """保存できない値を含むレコード。"""
+
+    def __init__(self, field: str, message: str):
+        super().__init__(f"{field}: {message}")
+        self.field = field
+
+
+def _key(value) -> str:
+    """同義語の照合用に、NFKC 正規化・小文字化・空白除去した文字列にする。"""
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", str(value)).lower())
+
+
+def _build_lookup(spec) -> dict:
+    lookup = {_key(v): v for v in spec["values"]}
+    lookup.update({_key(k): v for k, v in spec["synonyms"].items()})
+    return lookup
+
+
+_LOOKUPS = {name: _build_lookup(spec) for name, spec in FIELDS.items()}
+
+
+class _Structured(str):
+    """配列やオブジェクトを文字列にしたもの（数値の項目ではそのまま弾く）。同じ内容の文字列とは区別する。"""
+
+    def __eq__(self, other):
+        return isinstance(other, _Structured) and str.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((_Structured, str(self)))
+
+
+def _hashable(value):
+    # LLM が配列やオブジェクトを返しても lru_cache のキーにできるよう文字列にする
+    return value if isinstance(value, (str, int, float, type(None))) else _Structured(value)
+
+
+@lru_cache(maxsize=4096)
+def _canonical(field: str, value):
+    """
+    項目の値を正規の値にする。戻り値は (値, action)。
+    action は None（そのまま）/ "synonym" / "default"。保存できない値は RecordValidationError。
+    """
+    spec = FIELDS[field]
+    if value in spec["values"]:
+        return value, None
+    if value in ("", None) and spec["default"] is not None:
+        # 省略された項目は既定値（直した件数には数えない）
+        return spec["default"], None
+    found = _LOOKUPS[field].get(_key("" if value is None else value))
+    if found is not None:
+        return found, "synonym"
+    if spec["default"] is None:
+        raise RecordValidationError(field, f"不明な値です: {str(value)[:20]!r}")
+    if len(str(value)) > MAX_LENGTHS[field]:
+        raise RecordValidationError(field, f"{MAX_LENGTHS[field]} 文字を超えています: {str(value)[:20]!r}")
+    return spec["default"], "default"
+
+
+@lru_cache(maxsize=4096)
+def _volume(value):
+    """
+    volume を 0〜RECORD_VOLUME_MAX の整数にする。戻り値は (値, action)。
+    配列・オブジェクト・NaN・無限大は RecordValidationError。
+    """
+    if value is None:
+        return 0, None
+    if isinstance(value, (bool, _Structured)) or not isinstance(value, (str, int, float)):
+        raise RecordValidationError("volume", f"数値ではありません: {str(value)[:20]!r}")
+    if isinstance(value, int):
+        number, action = value, None
+    elif isinstance(value, float):
+        number, action = value, "coerce"
+    else:
+        text = unicodedata.normalize("NFKC", value).replace(",", "").strip()
+        try:
+            number = float(text)
+        except ValueError:
+            # "80ml" のような値から数値を取り出す
+            m = _NUMBER_RE.search(text)
+            if m is None:
+                return 0, "default"
+            number = float(m.group())
+        action = "coerce"
+    if math.isnan(number) or math.isinf(number):
+        raise RecordValidationError("volume", f"数値ではありません: {str(value)[:20]!r}")
+    clamped = min(max(number, 0), RECORD_VOLUME_MAX)
+    return int(clamped), "clamp" if clamped != number else action
+
+
+def _field_value(field: str, activity: str, value):
+    """activity_type を踏まえて 1 項目を正規化する。戻り値は (値, action)。"""
+    if field == "volume":
+        return _volume(_hashable(value)) if activity == "feeding" else (0, None)
+    if field != "activity_type" and activity not in FIELDS[field]["applies_to"]:
+        return "", None
+    return _canonical(field, _hashable(value))
+
+
+# activity_type の次に正規化する項目（volume を含む）
+_DEPENDENT_FIELDS = [name for name in FIELDS if name != "activity_type"] + ["volume"]
+
+
+def _normalize(field: str, activity: str, value):
+    try:
+        value, action = _field_value(field, activity, value)
+    except RecordValidationError:
+        FIXES.inc(field=field, action="reject")
+        raise
+    if action is not None:
+        FIXES.inc(field=field, action=action)
+    return value
+
+
+def validate_record(data: dict) -> dict:
+    """
+    1 件の辞書を検証・正規化して新しい辞書を返す（timestamp など他のキーはそのまま残す）。
+    保存できない値を含む場合は RecordValidationError。
+    """
+    activity = _normalize("activity_type", None, data.get("activity_type"))
+    out = dict(data)
+    out["activity_type"] = activity
+    for field in _DEPENDENT_FIELDS:
+        out[field] = _normalize(field, activity, data.get(field))
+    if activity in ("sleep", "wake"):
+        # 睡眠・起床は activity_type と sleep_state が同じ意味になる
+        out["sleep_state"] = activity
+    if out["diaper_type"] != "うんち":
+        # 硬さと量はうんちのときだけ
+        out["hardness"] = out["diaper_amount"] = ""
+    return out
+
+
+def _normalize_column(field: str, activities, values, errors: dict):
+    """
+    1 列分を正規化する。列に現れる (activity_type, 値) の組み合わせごとに 1 回だけ正規化し、
+    結果を列全体に当てはめる。直した件数は組み合わせの出現回数からまとめてメトリクスに足す。
+    """
+    keys = list(zip(activities, values))
+    try:
+        counts = Counter(keys)
+    except TypeError:
+        # LLM が配列やオブジェクトを返した列だけ、文字列にしてから数える
+        keys = [(a, _hashable(v)) for a, v in keys]
+        counts = Counter(keys)
+
+    memo = {}
+    rejected = {}
+    for key, count in counts.items():
+        try:
+            value, action = _field_value(field, *key)
+        except RecordValidationError as e:
+            value, action = None, "reject"
+            rejected[key] = str(e)
+        memo[key] = value
+        if action is not None:
+            FIXES.inc(count, field=field, action=action)
+
+    if rejected:
+        for i, key in enumerate(keys):
+            if key in rejected:
+                errors.setdefault(i, rejected[key])
+    return [memo[key] for key in keys]
+
+
+def validate_columns(columns: dict):
+    """
+    列形式（項目名 → 値のリスト）のレコード群を検証・正規化する。
+    戻り値は (正規化した列, エラー) で、エラーは (元の位置, メッセージ) のリスト。
+    不正な行は戻り値の列から取り除き、"index" 列に元の位置を入れる。
+    timestamp など検証しない列はそのまま引き継ぐ。
+    """
+    size = len(columns["activity_type"])
+    errors = {}
+    blank = [None] * size
+
+    activities = _normalize_column("activity_type", blank, columns["activity_type"], errors)
+    result = {"activity_type": activities}
+    for field in _DEPENDENT_FIELDS:
+        result[field] = _normalize_column(field, activities, columns.get(field) or blank, errors)
+    result["sleep_state"] = [a if a in ("sleep", "wake") else s for a, s in zip(activities, result["sleep_state"])]
+    for field in ("hardness", "diaper_amount"):
+        result[field] = [v if d == "うんち" else "" for d, v in zip(result["diaper_type"], result[field])]
+    for name, values in columns.items():
+        result.setdefault(name, list(values))
+
+    if not errors:
+        result["index"] = list(range(size))
+        return result, []
+    keep = [i for i in range(size) if i not in errors]
+    cleaned = {name: [values[i] for i in keep] for name, values in result.items()}
+    cleaned["index"] = keep
+    return cleaned, sorted(errors.items())
+
+
+def validate_records(records):
+    """辞書のリストを列形式に直して validate_columns にかけ、(辞書のリスト, エラー) を返す。"""
+    if not records:
+        return [], []
+    names = list(dict.fromkeys(name for record in records for name in record))
+    columns = {name: [record.get(name) for record in records] for name in names}
+    columns.setdefault("activity_type", [None] * len(records))
+    cleaned, errors = validate_columns(columns)
+    names = [name for name in cleaned if name != "index"]
+    rows = [dict(zip(names, values)) for values in zip(*(cleaned[name] for name in names))]
+    return rows, errors
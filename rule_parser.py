@@ -0,0 +1,155 @@
+# rule_parser.py
+"""
+定型的な発話を LLM を使わずに構造化するルールベースのパーサー。
+
+「母乳を80ミリあげたよ」「おしっこ出た」「起きたよ」のような短い発話は
+キーワードと正規表現だけで十分に判定できるので、ここで処理して LLM 呼び出しを省く。
+判定に自信がない発話（複数のカテゴリにまたがる、否定形や推量を含む、吐き戻しの話 など）は
+confidence を低く返し、呼び出し側で LLM にフォールバックさせる。
+"""
+import re
+import unicodedata
+
+# ─────────────────────────────────────────────────────────────────────
+# キーワード定義
+# ─────────────────────────────────────────────────────────────────────
+# 「母乳パッド」「尿検査」「便秘」のように排泄・授乳そのものではない語は除く
+BREAST_MILK_RE = re.compile(r"母乳(?!パッド)|おっぱい")
+FEEDING_RE = re.compile(BREAST_MILK_RE.pattern + r"|ミルク|授乳|哺乳")
+PEE_RE = re.compile(r"おしっこ|しっこ|(?<![検採])尿(?!検査)")
+POO_RE = re.compile(r"うんち|うんこ|(?<![郵不])便(?![秘利箋乗])")
+SLEEP_WORDS = ("寝かしつけ", "寝た", "寝て", "寝ちゃ", "寝始め", "眠っ", "眠り", "ねんね", "昼寝", "就寝")
+WAKE_WORDS = ("起きた", "起きて", "起床", "目覚め", "目を覚ま", "目が覚め")
+
+# 量の単位（NFKC 正規化後の表記で照合する）
+VOLUME_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(ml|ミリリットル|ミリ|cc|シーシー)", re.IGNORECASE)
+
+HARDNESS_RULES = (
+    ("やわらかい", re.compile(r"やわらか|柔らか|ゆる|緩|水っぽ|下痢")),
+    ("固い", re.compile(r"固|硬|かた[いかくめ]")),
+    ("普通", re.compile(r"普通の(?:かた|固|硬)さ|ふつうの(?:かた|固|硬)さ")),
+)
+AMOUNT_RULES = (
+    ("多め", re.compile(r"多め|多い|多かった|たくさん|いっぱい|大量")),
+    ("少量", re.compile(r"少量|少なめ|少ない|少なかった|ちょっとだけ|ちょびっと")),
+    ("普通", re.compile(r"量は普通|量普通|普通の量|ふつうの量")),
+)
+
+# 否定・取り消し・予定・推量・しようとしただけ（「飲ませようとしたら嫌がった」）など、
+# キーワードだけでは意味が決まらない表現（「水っぽい」「かなり」は便の状態・量の表現なので除く）
+NEGATION_RE = re.compile(
+    r"(?<!少)(?:ない|なかった)|ません|ず[にで]|まだ|予定|かも|(?<!か)たい"
+    r"|かな(?!り)|(?<!水)っぽ|どうか|みたい|気がする"
+    r"|ようと|嫌が|いやが|拒"
+)
+# 吐き戻しは授乳・おむつの記録と紛らわしいので、ルールでは判定しない
+EXCLUDE_RE = re.compile(r"吐|戻|もど[しす]")
+
+# この長さを超える発話はニュアンスを含みやすいので確信度を下げる
+LONG_UTTERANCE = 30
+
+
+def normalize(utterance: str) -> str:
+    """NFKC 正規化（全角数字・英字の半角化）と空白除去を行う。"""
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", utterance or ""))
+
+
+def _contains(text: str, words) -> bool:
+    return any(w in text for w in words)
+
+
+def _empty_record(activity_type: str) -> dict:
+    return {
+        "activity_type": activity_type,
+        "milktype": "",
+        "volume": 0,
+        "diaper_type": "",
+        "hardness": "",
+        "diaper_amount": "",
+        "sleep_state": "",
+    }
+
+
+def _parse_feeding(text: str):
+    data = _empty_record("feeding")
+    if "ミルク" in text:
+        data["milktype"] = "ミルク"
+    elif BREAST_MILK_RE.search(text):
+        data["milktype"] = "母乳"
+    else:
+        data["milktype"] = "不明"
+
+    volumes = VOLUME_RE.findall(text)
+    # 「母乳80ミリ、ミルク40ミリ」のように量や種類が複数あるものは、1 レコードへのまとめ方を LLM に任せる
+    if len(volumes) > 1 or ("ミルク" in text and BREAST_MILK_RE.search(text)):
+        return data, 0.5
+    if volumes:
+        data["volume"] = int(float(volumes[0][0]))
+        return data, 0.95
+    # 母乳は量を測らないことが多いので、量なしでも確定とする
+    return data, 0.9 if data["milktype"] == "母乳" else 0.7
+
+
+def _parse_diaper(text: str, pee: bool, poo: bool):
+    data = _empty_record("diaper")
+    if pee and not poo:
+        data["diaper_type"] = "おしっこ"
+        return data, 0.95
+
+    data["diaper_type"] = "うんち"
+    confidence = 0.9
+    # 「おしっことうんち」のように両方出たケースは 1 レコードで表せないので LLM に任せる
+    if pee:
+        confidence = 0.5
+    for label, pattern in HARDNESS_RULES:
+        if pattern.search(text):
+            data["hardness"] = label
+            break
+    for label, pattern in AMOUNT_RULES:
+        if pattern.search(text):
+            data["diaper_amount"] = label
+            break
+    return data, confidence
+
+
+def parse(utterance: str):
+    """
+    発話をルールで構造化する。
+
+    戻り値は (data, confidence)。data は FUNC_DEF と同じキーを持つ辞書
+    （timestamp は呼び出し側で付与する）で、判定できなければ None。
+    confidence は 0.0〜1.0 で、呼び出し側のしきい値未満なら LLM にフォールバックする。
+    """
+    text = normalize(utterance)
+    if not text or EXCLUDE_RE.search(text):
+        return None, 0.0
+
+    feeding = bool(FEEDING_RE.search(text) or VOLUME_RE.search(text))
+    pee = bool(PEE_RE.search(text))
+    poo = bool(POO_RE.search(text))
+    sleep = _contains(text, SLEEP_WORDS)
+    wake = _contains(text, WAKE_WORDS)
+
+    # 複数カテゴリにまたがる発話はルールでは決めきれない
+    categories = sum([feeding, pee or poo, sleep or wake])
+    if categories != 1:
+        return None, 0.0
+
+    if feeding:
+        data, confidence = _parse_feeding(text)
+    elif pee or poo:
+        data, confidence = _parse_diaper(text, pee, poo)
+    elif sleep and wake:
+        # 「起きたけどまた寝た」など順序の解釈が必要なものは LLM に任せる
+        return None, 0.0
+    else:
+        state = "sleep" if sleep else "wake"
+        data = _empty_record(state)
+        data["sleep_state"] = state
+        confidence = 0.95
+
+    if NEGATION_RE.search(text):
+        confidence = min(confidence, 0.4)
+    if len(text) > LONG_UTTERANCE:
+        confidence -= 0.2
+    return data, confidence
@@ -0,0 +1,160 @@
+# tracing.py
+"""
+リクエスト内の処理段階ごとの所要時間（スパン）を記録する軽量トレーサー。
+
+- TracingMiddleware: リクエストごとにトレースを開始し、記録したスパンを
+  Server-Timing ヘッダーで返す（ブラウザの開発者ツールや curl -v で見える）
+- span(): with 文で囲んだ区間をスパンとして記録する。トレースの外では何もしない
+- add_span(): 計測済みの区間（プールのチェックアウト待ちなど）を後から記録する
+
+遅いリクエストとサンプリングしたリクエストは、OpenTelemetry の OTLP/JSON に
+揃えた形（traceId / spanId / parentSpanId / startTimeUnixNano ...）で
+ロガー app.trace に 1 行 JSON として出す。
+
+    TRACE_SLOW_MS      これを超えたリクエストは必ずトレースログに出す（既定 1000ms）
+    TRACE_SAMPLE_RATE  それ以外のリクエストのうちトレースログに出す割合（既定 0.0）
+"""
+import contextvars
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+
+import applog
+
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.0"))
+
+logger = applog.get_logger("trace")
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return random.getrandbits(nbytes * 8).to_bytes(nbytes, "big").hex()
+
+
+class Trace:
+    """1 リクエスト分のスパンの入れ物。"""
+
+    def __init__(self, name: str):
+        self.trace_id = _new_id(16)
+        self.root_id = _new_id(8)
+        self.name = name
+        # 壁時計と単調時計の対応（スパンは perf_counter で測り、出力時に Unix 時刻へ直す）
+        self.wall_start = time.time()
+        self.perf_start = time.perf_counter()
+        self.perf_end = None
+        self.spans = []
+
+    def add(self, name, started, ended, parent_id=None, attributes=None, span_id=None):
+        self.spans.append({
+            "span_id": span_id or _new_id(8),
+            "parent_id": parent_id or self.root_id,
+            "name": name,
+            "start": started,
+            "end": ended,
+            "attributes": attributes or {},
+        })
+
+    def _unix_nano(self, perf: float) -> str:
+        return str(int((self.wall_start + perf - self.perf_start) * 1e9))
+
+    def server_timing(self) -> str:
+        """同じ名前のスパンは合計して Server-Timing の値にする。"""
+        totals = {}
+        for s in self.spans:
+            totals[s["name"]] = totals.get(s["name"], 0.0) + (s["end"] - s["start"])
+        end = self.perf_end if self.perf_end is not None else time.perf_counter()
+        totals["total"] = end - self.perf_start
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+    def to_otlp(self, attributes=None) -> dict:
+        """OTLP/JSON の ResourceSpans 1 件分の形にする。"""
+        def span_json(span_id, parent_id, name, started, ended, attrs):
+            item = {
+                "traceId": self.trace_id,
+                "spanId": span_id,
+                "name": name,
+                "startTimeUnixNano": self._unix_nano(started),
+                "endTimeUnixNano": self._unix_nano(ended),
+                "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in attrs.items()],
+            }
+            if parent_id:
+                item["parentSpanId"] = parent_id
+            return item
+
+        spans = [span_json(self.root_id, None, self.name, self.perf_start, self.perf_end, attributes or {})]
+        spans += [span_json(s["span_id"], s["parent_id"], s["name"], s["start"], s["end"], s["attributes"])
+                  for s in self.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "step3-1_backend"}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]}
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """with 文の区間をスパンとして記録する。トレース中でなければ何もしない。"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    span_id = _new_id(8)
+    token = _current_span.set(span_id)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+        trace.add(name, started, time.perf_counter(), _current_span.get(), attributes, span_id)
+
+
+def add_span(name: str, started: float, ended: float, **attributes):
+    """perf_counter で計測済みの区間をスパンとして記録する。"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, started, ended, _current_span.get(), attributes)
+
+
+class TracingMiddleware:
+    """
+    HTTP リクエストごとにトレースを開始する ASGI ミドルウェア。
+    レスポンスヘッダーを送る時点までに記録されたスパンを Server-Timing に載せる
+    （ストリーミングで本文を書き出している間の処理は含まれない）。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(f'{scope["method"]} {scope["path"]}')
+        token = _current_trace.set(trace)
+        status = {"code": None}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_trace.reset(token)
+            trace.perf_end = time.perf_counter()
+            elapsed_ms = (trace.perf_end - trace.perf_start) * 1000
+            if elapsed_ms >= TRACE_SLOW_MS or (TRACE_SAMPLE_RATE and random.random() < TRACE_SAMPLE_RATE):
+                logger.info(json.dumps(trace.to_otlp({
+                    "http.method": scope["method"],
+                    "http.route": scope["path"],
+                    "http.status_code": status["code"],
+                }), ensure_ascii=False))
@@ -0,0 +1,277 @@
+# ttl_cache.py
+"""
+TTL 付き LRU キャッシュと、ワーカー間で共有するための SQL バックエンドの 2 段構成キャッシュ。
+
+- TTLCache: プロセス内の上限付き LRU。エントリは TTL を過ぎると無効になる。
+- SqlCacheTier: kv_cache テーブルに JSON で保存する共有層（SQLite ファイルでも MySQL でも可）。
+- TieredCache: ローカル → 共有の順に引き、共有層で当たればローカルにも載せる。
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import anyio
+from sqlalchemy import create_engine, delete, event, func, select
+
+import applog
+import metrics
+from db_control.dialect import upsert
+from db_control.mymodels_MySQL import CacheEntry
+
+CACHE_REQUESTS = metrics.counter(
+    "cache_requests_total", "キャッシュの参照件数（tier=local/shared, result=hit/miss）",
+    ["cache", "tier", "result"])
+CACHE_EVICTIONS = metrics.counter(
+    "cache_evictions_total", "キャッシュから追い出された件数（reason=size/expired）",
+    ["cache", "reason"])
+
+logger = applog.get_logger("cache")
+
+# 見つからなかったことを表す番兵（None をキャッシュ値として扱えるようにする）
+MISSING = object()
+
+
+class TTLCache:
+    """上限付き LRU + TTL のプロセス内キャッシュ（スレッドセーフ）。"""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 3600):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > now:
+                    self._data.move_to_end(key)
+                    CACHE_REQUESTS.inc(cache=self.name, tier="local", result="hit")
+                    return value
+                del self._data[key]
+                CACHE_EVICTIONS.inc(cache=self.name, reason="expired")
+        CACHE_REQUESTS.inc(cache=self.name, tier="local", result="miss")
+        return MISSING
+
+    def set(self, key, value, ttl: float = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                CACHE_EVICTIONS.inc(cache=self.name, reason="size")
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqlCacheTier:
+    """kv_cache テーブルを使った共有キャッシュ層。値は JSON で保存する。"""
+
+    # max_entries を超えていないか確認する間隔（set の回数）
+    PRUNE_EVERY = 100
+
+    def __init__(self, engine, namespace: str, ttl: float = 3600, max_entries: int = None):
+        # engine はエンジンそのものか、エンジンを返す関数（get_engine など）。
+        # テーブルの作成も含め、接続は最初に使われるまで行わない
+        self._engine = engine
+        self._ready = False
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._sets = 0
+
+    @property
+    def engine(self):
+        if callable(self._engine):
+            self._engine = self._engine()
+        if not self._ready:
+            CacheEntry.__table__.create(self._engine, checkfirst=True)
+            self._ready = True
+        return self._engine
+
+    @staticmethod
+    def _hash(key) -> str:
+        return hashlib.sha256(str(key).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        h = self._hash(key)
+        table = CacheEntry.__table__
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                select(table.c.value, table.c.expires_at)
+                .where(table.c.namespace == self.namespace, table.c.cache_key == h)
+            ).first()
+            if row is None:
+                return MISSING
+            if row.expires_at <= datetime.utcnow():
+                conn.execute(delete(table).where(table.c.namespace == self.namespace, table.c.cache_key == h))
+                CACHE_EVICTIONS.inc(cache=self.namespace, reason="expired")
+                return MISSING
+        return json.loads(row.value)
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl if ttl is None else ttl)
+        with self.engine.begin() as conn:
+            upsert(conn, CacheEntry, [{
+                "namespace": self.namespace,
+                "cache_key": self._hash(key),
+                "value": json.dumps(value, ensure_ascii=False),
+                "expires_at": expires_at,
+            }])
+        self._sets += 1
+        if self._sets % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, key):
+        table = CacheEntry.__table__
+        with self.engine.begin() as conn:
+            conn.execute(delete(table).where(
+                table.c.namespace == self.namespace, table.c.cache_key == self._hash(key)))
+
+    def delete_many(self, keys):
+        """複数のキーを 1 文で消す（一括更新のあとの無効化用）。"""
+        hashes = [self._hash(key) for key in keys]
+        if not hashes:
+            return
+        table = CacheEntry.__table__
+        with self.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.namespace == self.namespace, table.c.cache_key.in_(hashes)))
+
+    def prune(self):
+        """期限切れの行を消し、max_entries を超えていれば期限の近いものから消す。"""
+        table = CacheEntry.__table__
+        mine = table.c.namespace == self.namespace
+        with self.engine.begin() as conn:
+            expired = conn.execute(delete(table).where(mine, table.c.expires_at <= datetime.utcnow())).rowcount
+            if expired > 0:
+                CACHE_EVICTIONS.inc(expired, cache=self.namespace, reason="expired")
+            if not self.max_entries:
+                return
+            excess = conn.execute(select(func.count()).select_from(table).where(mine)).scalar() - self.max_entries
+            if excess <= 0:
+                return
+            # 残す行のうち最も期限が近いものの期限を境に消す
+            cutoff = conn.execute(
+                select(table.c.expires_at).where(mine).order_by(table.c.expires_at).offset(excess - 1).limit(1)
+            ).scalar()
+            evicted = conn.execute(delete(table).where(mine, table.c.expires_at <= cutoff)).rowcount
+            CACHE_EVICTIONS.inc(evicted, cache=self.namespace, reason="size")
+
+
+class TieredCache:
+    """ローカル LRU と任意の共有層を重ねたキャッシュ。"""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 3600, shared: SqlCacheTier = None):
+        self.name = name
+        self.local = TTLCache(name, maxsize, ttl)
+        self.shared = shared
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not MISSING or self.shared is None:
+            return value
+        try:
+            value = self.shared.get(key)
+        except Exception as e:
+            # 共有層の障害でリクエストを失敗させない
+            logger.warning("共有キャッシュ %s の参照に失敗: %s", self.name, e)
+            return MISSING
+        CACHE_REQUESTS.inc(cache=self.name, tier="shared", result="miss" if value is MISSING else "hit")
+        if value is not MISSING:
+            self.local.set(key, value)
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl)
+            except Exception as e:
+                logger.warning("共有キャッシュ %s の書き込みに失敗: %s", self.name, e)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            try:
+                self.shared.delete(key)
+            except Exception as e:
+                logger.warning("共有キャッシュ %s の削除に失敗: %s", self.name, e)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        self.local.delete_many(keys)
+        if self.shared is not None:
+            try:
+                self.shared.delete_many(keys)
+            except Exception as e:
+                logger.warning("共有キャッシュ %s の削除に失敗: %s", self.name, e)
+
+    async def aget(self, key):
+        """非同期版 get。共有層がある場合だけ DB アクセスをスレッドに逃がす。"""
+        if self.shared is None:
+            return self.local.get(key)
+        return await anyio.to_thread.run_sync(self.get, key)
+
+    async def aset(self, key, value, ttl: float = None):
+        if self.shared is None:
+            self.local.set(key, value, ttl)
+        else:
+            await anyio.to_thread.run_sync(self.set, key, value, ttl)
+
+    def stats(self):
+        result = {"size": len(self.local), "maxsize": self.local.maxsize, "ttl": self.local.ttl,
+                  "shared": self.shared is not None}
+        for tier in ("local", "shared"):
+            for outcome in ("hit", "miss"):
+                result[f"{tier}_{outcome}"] = CACHE_REQUESTS.value(cache=self.name, tier=tier, result=outcome)
+        for reason in ("size", "expired"):
+            result[f"evicted_{reason}"] = CACHE_EVICTIONS.value(cache=self.name, reason=reason)
+        return result
+
+
+def _file_engine(url: str):
+    engine = create_engine(url)
+    if engine.dialect.name == "sqlite":
+        # 複数のワーカープロセスで同じファイルを読み書きするので、WAL にして読み取りを書き込みで止めない
+        @event.listens_for(engine, "connect")
+        def _sqlite_pragmas(dbapi_conn, _):
+            dbapi_conn.execute("PRAGMA journal_mode=WAL")
+            dbapi_conn.execute("PRAGMA busy_timeout=5000")
+    return engine
+
+
+def build_shared_tier(setting: str, namespace: str, ttl: float, default_engine=None, max_entries: int = None):
+    """
+    環境変数の設定値から共有層を作る。
+    ""（未設定）なら共有しない、"db" ならアプリの DB を使い、それ以外は SQLAlchemy の URL とみなす
+    （"sqlite:///cache.db" ならワーカー間で共有するローカルファイル）。
+    いずれも接続は最初の参照時まで行わない。
+    """
+    if not setting:
+        return None
+    if setting == "db":
+        if default_engine is None:
+            from db_control.connect_MySQL import get_engine as default_engine
+        return SqlCacheTier(default_engine, namespace, ttl, max_entries)
+    return SqlCacheTier(lambda: _file_engine(setting), namespace, ttl, max_entries)